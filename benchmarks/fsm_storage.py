@@ -0,0 +1,94 @@
+"""
+Нагрузочный тест хранилищ состояний FSM: сравнивает синхронное PostgreSQLStorage,
+асинхронное AsyncPostgreSQLStorage, его же за кэшем WriteBackStorage, а также SQLiteFSMStorage
+и MemoryFSMStorage при одновременной работе многих пользователей.
+
+Каждое "обновление" повторяет типичную работу бота: чтение состояния и данных FSM,
+ответ пользователю (имитируется задержкой --handler-io) и запись данных и состояния.
+Используются отрицательные chat_id, после теста записи удаляются.
+
+Запуск из корня проекта:
+    python -m benchmarks.fsm_storage --users 100 --updates 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+from core.fsm_storage import MemoryFSMStorage, SQLiteFSMStorage, WriteBackStorage
+from core.sql import AsyncPostgreSQLStorage, PostgreSQLStorage
+
+BENCHMARK_BOT_ID = 0
+BENCHMARK_CHAT_ID_OFFSET = -1_000_000_000 # Не пересекается с реальными чатами
+
+
+async def simulate_user(storage, user_index: int, updates: int, handler_io: float):
+    """Последовательно обрабатывает updates обновлений одного пользователя."""
+    key = StorageKey(bot_id=BENCHMARK_BOT_ID, chat_id=BENCHMARK_CHAT_ID_OFFSET - user_index, user_id=user_index)
+    for step in range(updates):
+        await storage.get_state(key)
+        data = await storage.get_data(key)
+        await asyncio.sleep(handler_io) # Ответ пользователю через Telegram API
+        data['step'] = step
+        await storage.set_data(key, data)
+        await storage.set_state(key, f"BenchmarkState:step_{step % 3}")
+        if isinstance(storage, WriteBackStorage):
+            await storage.flush(key) # Как CustomFSMContextMiddleware в конце обработки обновления
+
+
+async def run(storage, users: int, updates: int, handler_io: float) -> float:
+    """Запускает users пользователей одновременно и возвращает число обработанных обновлений в секунду."""
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate_user(storage, index, updates, handler_io) for index in range(users)))
+    elapsed = time.perf_counter() - started
+    for index in range(users): # Удаляем тестовые записи
+        await storage.set_state(StorageKey(bot_id=BENCHMARK_BOT_ID, chat_id=BENCHMARK_CHAT_ID_OFFSET - index, user_id=index), None)
+    return users * updates / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Сравнение пропускной способности хранилищ состояний FSM.")
+    parser.add_argument('--users', type=int, default=100, help="Количество одновременных пользователей")
+    parser.add_argument('--updates', type=int, default=20, help="Обновлений на пользователя")
+    parser.add_argument('--handler-io', type=float, default=0.02, help="Имитация ответа пользователю, секунд")
+    args = parser.parse_args()
+    logging.disable(logging.INFO) # Хранилища пишут в лог каждое изменение состояния
+
+    sync_storage = PostgreSQLStorage()
+    sync_storage.initialize()
+    before = await run(sync_storage, args.users, args.updates, args.handler_io)
+    await sync_storage.close()
+
+    async_storage = AsyncPostgreSQLStorage()
+    await async_storage.initialize()
+    after = await run(async_storage, args.users, args.updates, args.handler_io)
+
+    cached_storage = WriteBackStorage(async_storage, durability='end_of_update')
+    await cached_storage.initialize()
+    cached = await run(cached_storage, args.users, args.updates, args.handler_io)
+    await cached_storage.close() # Закрывает и AsyncPostgreSQLStorage
+
+    with tempfile.TemporaryDirectory() as directory:
+        sqlite_storage = SQLiteFSMStorage(os.path.join(directory, 'fsm_states.sqlite3'))
+        await sqlite_storage.initialize()
+        sqlite = await run(sqlite_storage, args.users, args.updates, args.handler_io)
+        await sqlite_storage.close()
+
+    memory_storage = MemoryFSMStorage()
+    memory = await run(memory_storage, args.users, args.updates, args.handler_io)
+
+    print(f"Пользователей: {args.users}, обновлений на пользователя: {args.updates}, ответ пользователю: {args.handler_io * 1000:.0f} мс")
+    print(f"PostgreSQLStorage (синхронное):       {before:8.1f} обновлений/с")
+    print(f"AsyncPostgreSQLStorage (асинхронное): {after:8.1f} обновлений/с")
+    print(f"WriteBackStorage (кэш, end_of_update): {cached:8.1f} обновлений/с")
+    print(f"SQLiteFSMStorage (файл, WAL):         {sqlite:8.1f} обновлений/с")
+    print(f"MemoryFSMStorage (в памяти):          {memory:8.1f} обновлений/с")
+    print(f"Ускорение: x{after / before:.1f}, с кэшем x{cached / before:.1f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
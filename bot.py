@@ -24,11 +24,10 @@ from core.classes import Reservation, User, Device
 logging.basicConfig(level=logging.INFO)
 
 dependencies.db_manager.initialize()
-dependencies.storage.initialize()
 
 dependencies.bot = Bot(token=BOT_TOKEN)
 
-dp = Dispatcher(storage=dependencies.storage)
+dp = Dispatcher(storage=dependencies.storage, disable_fsm=True) # Состояние FSM загружает CustomFSMContextMiddleware
 dp.update.outer_middleware(CustomFSMContextMiddleware(storage=dependencies.storage))
 dp.include_routers(admin.router, director.router, register.router, assistant.router)
 
@@ -56,18 +55,19 @@ async def check_schedule_and_notify():
     while True:
         now = datetime.now()
 
-        reservations_today = Reservation.get_all_by_today() # Получаем все резервации на сегодня
+        reservations_today = await Reservation.aget_all_by_today() # Получаем все резервации на сегодня, не блокируя обработку обновлений
         for reservation in reservations_today:
             if reservation.start_date:
                 time_remaining = reservation.start_date - now
                 if timedelta(minutes=4) <= time_remaining <= timedelta(minutes=5): # Проверяем, что время до начала задачи между 4 и 5 минутами
+                    device = await Device.aget_by_id(reservation.id_device)
                     for assistant_id in reservation.assistants:
                         try:
-                            user = User.get_by_id(assistant_id)
+                            user = await User.aget_by_id(assistant_id)
                             if user:
                                 await dependencies.bot.send_message(
                                     chat_id=assistant_id,
-                                    text=f"🔔 Напоминание: Через 5 минут начинается задача '{reservation.name_task}' (протокол '{reservation.type_protocol}') в {reservation.start_date.strftime('%H:%M')}. Кабинет: {Device.get_by_id(reservation.id_device).name_cabinet if Device.get_by_id(reservation.id_device) else 'Неизвестно'}.",
+                                    text=f"🔔 Напоминание: Через 5 минут начинается задача '{reservation.name_task}' (протокол '{reservation.type_protocol}') в {reservation.start_date.strftime('%H:%M')}. Кабинет: {device.name_cabinet if device else 'Неизвестно'}.",
                                 )
                         except Exception as e:
                             logging.error(f"Ошибка при отправке уведомления ассистенту {assistant_id}: {e}")
@@ -75,9 +75,15 @@ async def check_schedule_and_notify():
 
 
 async def main():
+    await dependencies.async_db_manager.initialize() # Асинхронные пулы открываются внутри работающего цикла событий
+    await dependencies.storage.initialize()
     dp.startup.register(start_bot)
     asyncio.create_task(check_schedule_and_notify()) # Запускаем фоновую задачу уведомлений
-    await dp.start_polling(dependencies.bot)
+    try:
+        await dp.start_polling(dependencies.bot)
+    finally:
+        await dependencies.storage.close()
+        await dependencies.async_db_manager.close()
 
 
 
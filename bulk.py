@@ -0,0 +1,45 @@
+"""
+Пакетная загрузка и выгрузка настроек лаборатории и расписания (кабинеты, устройства,
+стандартные задачи, протоколы, резервации) через COPY, см. core/bulk.py.
+
+Загрузка (все файлы одной транзакцией, таблица определяется по имени файла):
+    python bulk.py import cabinets.csv devices.csv standarttasks.jsonl protocols.jsonl
+
+Выгрузка (по умолчанию все таблицы в CSV):
+    python bulk.py export dump/ --format jsonl --tables Cabinets Devices
+"""
+import argparse
+import logging
+
+from core.bulk import BULK_FORMATS, BULK_TABLES, export_tables, import_files
+from core.utils import dependencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная загрузка и выгрузка таблиц через COPY.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help="Загрузить файлы CSV/JSON-lines в БД одной транзакцией")
+    import_parser.add_argument('files', nargs='+', help=f"Файлы <таблица>.csv или <таблица>.jsonl, таблицы: {', '.join(BULK_TABLES)}")
+
+    export_parser = subparsers.add_parser('export', help="Выгрузить таблицы в файлы")
+    export_parser.add_argument('directory', help="Каталог для файлов")
+    export_parser.add_argument('--format', choices=BULK_FORMATS, default='csv', help="Формат файлов")
+    export_parser.add_argument('--tables', nargs='+', help="Таблицы для выгрузки (по умолчанию все)")
+    args = parser.parse_args()
+
+    dependencies.db_manager.initialize()
+    try:
+        if args.command == 'import':
+            counts = import_files(args.files)
+        else:
+            counts = export_tables(args.directory, args.format, args.tables)
+    finally:
+        dependencies.db_manager.close()
+    for table_name, count in counts.items():
+        print(f"{table_name}: {count}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
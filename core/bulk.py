@@ -0,0 +1,177 @@
+import csv
+import io
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, Optional
+
+from core.classes import Cabinet, Device, Protocol, Reservation, StandartTask
+from core.utils import dependencies
+
+# Таблицы, которые загружаются и выгружаются пакетно, в порядке внешних ключей (загрузка идет сверху вниз),
+# и их столбцы. Для Devices и Reservations выгружается и id: на него ссылаются резервации.
+BULK_TABLES: Dict[str, List[str]] = {
+    Cabinet.table: ['name', 'active'],
+    Device.table: ['id', 'type_device', 'name', 'name_cabinet', 'active', 'capacity'],
+    StandartTask.table: ['name', 'type_device', 'is_parallel', 'time_task'],
+    Protocol.table: ['name', 'list_standart_tasks'],
+    Reservation.table: ['id', 'number_protocol', 'type_protocol', 'id_device', 'name_task', 'assistants', 'start_date', 'end_date', 'active'],
+}
+
+# Порядок строк при выгрузке
+BULK_ORDER_BY: Dict[str, str] = {
+    Cabinet.table: 'name',
+    Device.table: 'id',
+    StandartTask.table: 'name',
+    Protocol.table: 'name',
+    Reservation.table: 'id',
+}
+
+# Таблицы с id SERIAL: после загрузки с явными id последовательность сдвигается за максимальный id
+SERIAL_TABLES = (Device.table, Reservation.table)
+
+BULK_FORMATS = ('csv', 'jsonl')
+
+
+def _table_for_file(path: str) -> str:
+    """Определяет таблицу по имени файла (devices.csv -> Devices)."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    for table_name in BULK_TABLES:
+        if table_name.lower() == stem.lower():
+            return table_name
+    raise ValueError(f"Файл '{path}': не удалось определить таблицу, ожидается одно из имен {', '.join(BULK_TABLES)}.")
+
+
+def _format_for_file(path: str) -> str:
+    """Определяет формат по расширению файла."""
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension not in BULK_FORMATS:
+        raise ValueError(f"Файл '{path}': неподдерживаемый формат '{extension}', ожидается csv или jsonl.")
+    return extension
+
+
+def _check_columns(table_name: str, columns: List[str], path: str):
+    """Проверяет, что в файле только известные столбцы таблицы."""
+    unknown = [column for column in columns if column not in BULK_TABLES[table_name]]
+    if unknown or not columns:
+        raise ValueError(f"Файл '{path}': неизвестные столбцы {unknown} для таблицы {table_name}, "
+                         f"допустимы {BULK_TABLES[table_name]}.")
+
+
+def _csv_field(value) -> str:
+    """
+    Значение поля для COPY ... FORMAT csv: NULL - пустое поле без кавычек, остальные значения в кавычках
+    (пустая строка в кавычках остается пустой строкой). Списки и словари записываются как JSON.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, (list, dict)):
+        value = json.dumps(value, ensure_ascii=False)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _jsonl_to_csv(lines: Iterable[str], table_name: str, path: str):
+    """Преобразует строки JSON-lines в CSV для COPY. Возвращает (столбцы, буфер CSV)."""
+    columns = None
+    buffer = io.StringIO()
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if columns is None:
+            columns = list(record)
+            _check_columns(table_name, columns, path)
+        elif set(record) != set(columns):
+            raise ValueError(f"Файл '{path}', строка {line_number}: набор полей отличается от первой строки {columns}.")
+        buffer.write(','.join(_csv_field(record[column]) for column in columns) + '\n')
+    buffer.seek(0)
+    return columns or [], buffer
+
+
+def _copy_in(cursor, table_name: str, path: str) -> int:
+    """Загружает один файл в таблицу через COPY ... FROM STDIN. Возвращает число загруженных строк."""
+    with open(path, encoding='utf-8', newline='') as file:
+        if _format_for_file(path) == 'csv':
+            columns = next(csv.reader(file), [])
+            _check_columns(table_name, columns, path)
+            data = file # Данные читаются COPY прямо из файла, после строки заголовка
+        else:
+            columns, data = _jsonl_to_csv(file, table_name, path)
+            if not columns:
+                return 0
+        cursor.copy_expert(f"COPY \"{table_name}\" ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", data)
+    count = cursor.rowcount if cursor.rowcount >= 0 else 0
+
+    if table_name in SERIAL_TABLES and 'id' in columns:
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('\"{table_name}\"', 'id'), "
+                       f"GREATEST((SELECT MAX(id) FROM \"{table_name}\"), 1))")
+    return count
+
+
+def import_files(paths: List[str]) -> Dict[str, int]:
+    """
+    Загружает файлы CSV (первая строка - заголовок со столбцами) и JSON-lines в таблицы BULK_TABLES
+    через COPY одной транзакцией: либо загружаются все файлы, либо ни один. Таблица определяется
+    по имени файла (cabinets.csv, devices.jsonl, ...), файлы загружаются в порядке внешних ключей.
+    Возвращает число загруженных строк по таблицам.
+    """
+    files = sorted(((_table_for_file(path), path) for path in paths), key=lambda item: list(BULK_TABLES).index(item[0]))
+    counts: Dict[str, int] = {}
+    with dependencies.db_manager.transaction() as conn:
+        with conn.cursor() as cursor:
+            for table_name, path in files:
+                counts[table_name] = counts.get(table_name, 0) + _copy_in(cursor, table_name, path)
+                logging.info(f"Файл {path} загружен в таблицу {table_name}.")
+    logging.info(f"Пакетная загрузка завершена: {counts}.")
+    return counts
+
+
+class _JsonLinesWriter(io.TextIOBase):
+    """
+    Файл для COPY ... TO STDOUT в текстовом формате, который записывает строки row_to_json как JSON-lines.
+    Наследуется от io.TextIOBase: только таким файлам psycopg2 передает строки, остальным - bytes.
+    COPY передает по одной строке за вызов write. В тексте row_to_json нет управляющих символов
+    (они экранированы в JSON), поэтому COPY экранирует в нем только обратную косую черту - ее и восстанавливаем.
+    """
+
+    def __init__(self, file):
+        super().__init__()
+        self.file = file
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: str) -> int:
+        self.file.write(data.replace('\\\\', '\\'))
+        return len(data)
+
+
+def export_tables(directory: str, file_format: str = 'csv', tables: Optional[List[str]] = None) -> Dict[str, int]:
+    """
+    Выгружает таблицы (по умолчанию все BULK_TABLES) в файлы <directory>/<таблица>.<формат> через COPY ... TO STDOUT
+    в одной транзакции REPEATABLE READ, чтобы все файлы соответствовали одному состоянию БД.
+    Выгруженные файлы загружаются обратно import_files. Открывает собственную транзакцию.
+    Возвращает число выгруженных строк по таблицам.
+    """
+    if file_format not in BULK_FORMATS:
+        raise ValueError(f"Неподдерживаемый формат '{file_format}', ожидается csv или jsonl.")
+    tables = [_table_for_file(table_name) for table_name in tables] if tables else list(BULK_TABLES)
+    os.makedirs(directory, exist_ok=True)
+
+    counts: Dict[str, int] = {}
+    with dependencies.db_manager.transaction() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            for table_name in tables:
+                select = f"SELECT {', '.join(BULK_TABLES[table_name])} FROM \"{table_name}\" ORDER BY {BULK_ORDER_BY[table_name]}"
+                path = os.path.join(directory, f"{table_name.lower()}.{file_format}")
+                if file_format == 'csv':
+                    with open(path, 'w', encoding='utf-8', newline='') as file:
+                        cursor.copy_expert(f"COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER true)", file)
+                else:
+                    with open(path, 'w', encoding='utf-8') as file:
+                        cursor.copy_expert(f"COPY (SELECT row_to_json(t) FROM ({select}) t) TO STDOUT", _JsonLinesWriter(file))
+                counts[table_name] = cursor.rowcount if cursor.rowcount >= 0 else 0
+                logging.info(f"Таблица {table_name} выгружена в файл {path}.")
+    logging.info(f"Пакетная выгрузка завершена: {counts}.")
+    return counts
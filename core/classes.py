@@ -1,4 +1,4 @@
-from typing import List, Optional, Union
+from typing import Dict, Iterator, List, Optional, Union
 from typing import Tuple
 from datetime import datetime, date, timedelta
 import os
@@ -27,6 +27,10 @@ class DuplicateRecordError(DatabaseError):
     """Исключение, если запись с таким ID уже существует."""
     pass
 
+class ScheduleConflictError(DatabaseError):
+    """Исключение, если занятость устройств изменилась между построением плана и его записью."""
+    pass
+
 
 class User:
     table = "Users"
@@ -63,12 +67,29 @@ class User:
 
     def update(self):
         """Обновляет данные пользователя в БД."""
-        if not User.get_by_id(self.id): # Проверяем, существует ли запись перед обновлением
-            raise RecordNotFoundError(f"Пользователь с ID {self.id} не найден.")
-        if not dependencies.db_manager.update(User.table, User.columns[1:],
-                                      [self.id_role, self.id_chief, self.fio, self.active], # id нельзя менять, обновляем остальные поля
-                                      condition_columns=['id'], condition_values=[self.id]):
+        records = dependencies.db_manager.update_returning(User.table, User.columns[1:],
+                                                           [self.id_role, self.id_chief, self.fio, self.active], # id нельзя менять, обновляем остальные поля
+                                                           condition_columns=['id'], condition_values=[self.id])
+        if records is None:
             raise DatabaseError(f"Ошибка при обновлении пользователя с ID {self.id} в БД.")
+        if not records: # Отсутствие записи определяется по RETURNING, без отдельного запроса
+            raise RecordNotFoundError(f"Пользователь с ID {self.id} не найден.")
+        return True
+
+    async def aadd(self):
+        """Асинхронно добавляет пользователя в БД."""
+        if await User.aget_by_id(self.id):
+            raise DuplicateRecordError(f"Пользователь с ID {self.id} уже существует.")
+        if await dependencies.async_db_manager.insert(User.table, User.columns, [self.id, self.id_role, self.id_chief, self.fio, self.active]) is None:
+            raise DatabaseError("Ошибка при добавлении пользователя в БД.")
+        return True
+
+    async def aupdate(self):
+        """Асинхронно обновляет данные пользователя в БД."""
+        if not await dependencies.async_db_manager.update(User.table, User.columns[1:],
+                                                          [self.id_role, self.id_chief, self.fio, self.active],
+                                                          condition_columns=['id'], condition_values=[self.id]):
+            raise RecordNotFoundError(f"Пользователь с ID {self.id} не найден или не обновлен.")
         return True
 
     @staticmethod
@@ -80,13 +101,23 @@ class User:
         return None
 
     @staticmethod
-    def get_or_create(user_id: int) -> 'User':
-        """Получает пользователя по ID, или создает нового ассистента, если не найден."""
-        user = User.get_by_id(user_id)
-        if not user:
-            user = User(id=user_id) # Создаем нового пользователя с ролью ассистента по умолчанию
-            user.add() # Добавляем в БД
-        return user
+    async def aget_by_id(user_id: int) -> Optional['User']:
+        """Асинхронно получает пользователя по ID."""
+        data = await dependencies.async_db_manager.find_records(table_name=User.table, search_columns=['id'], search_values=[user_id])
+        if data:
+            return User(**data)
+        return None
+
+    @staticmethod
+    async def aget_or_create(user_id: int) -> 'User':
+        """Асинхронно получает пользователя по ID, или создает нового ассистента, если не найден."""
+        user = User(id=user_id) # Новый пользователь с ролью ассистента по умолчанию
+        # Вставка без конфликта при одновременных /start; существующий пользователь читается без изменений
+        data = await dependencies.async_db_manager.upsert(User.table, User.columns, [user.id, user.id_role, user.id_chief, user.fio, user.active],
+                                                          conflict_columns=['id'], update_columns=[])
+        if data is None:
+            raise DatabaseError(f"Ошибка при получении пользователя с ID {user_id} из БД.")
+        return User(**data)
 
     @staticmethod
     def get_all() -> List['User']:
@@ -94,6 +125,12 @@ class User:
         records = dependencies.db_manager.find_records(table_name=User.table, multiple=True)
         return [User(**record) for record in records] if records else []
 
+    @staticmethod
+    def iter_all() -> Iterator['User']:
+        """Перебирает всех пользователей, читая их из БД порциями (см. DatabaseManager.iter_records)."""
+        for record in dependencies.db_manager.iter_records(table_name=User.table):
+            yield User(**record)
+
     @staticmethod
     def get_all_directors() -> List['User']:
         """Получает всех пользователей с ролью 'директор'."""
@@ -115,11 +152,11 @@ class User:
     @staticmethod
     def set_role(user_id: int, role_id: int):
         """Устанавливает роль пользователя."""
-        user = User.get_by_id(user_id)
-        if not user:
-            raise RecordNotFoundError(f"Пользователь с ID {user_id} не найден.")
-        if not dependencies.db_manager.update(User.table, ['id_role'], [role_id], condition_columns=['id'], condition_values=[user_id]):
+        records = dependencies.db_manager.update_returning(User.table, ['id_role'], [role_id], condition_columns=['id'], condition_values=[user_id])
+        if records is None:
             raise DatabaseError(f"Ошибка при обновлении роли пользователя с ID {user_id} в БД.")
+        if not records:
+            raise RecordNotFoundError(f"Пользователь с ID {user_id} не найден.")
         return True
 
 
@@ -145,14 +182,23 @@ class Cabinet:
             raise DatabaseError("Ошибка при добавлении кабинета в БД.")
         return True
 
+    async def aadd(self):
+        """Асинхронно добавляет кабинет в БД."""
+        if await Cabinet.aget_by_name(self.name):
+            raise DuplicateRecordError(f"Кабинет с названием '{self.name}' уже существует.")
+        if await dependencies.async_db_manager.insert(Cabinet.table, Cabinet.columns, [self.name, self.active]) is None:
+            raise DatabaseError("Ошибка при добавлении кабинета в БД.")
+        return True
+
     def update(self):
         """Обновляет данные кабинета в БД."""
-        if not Cabinet.get_by_name(self.name): # Проверяем, существует ли запись перед обновлением по имени
-            raise RecordNotFoundError(f"Кабинет с названием '{self.name}' не найден.")
-        if not dependencies.db_manager.update(Cabinet.table, ['active'],
-                                      [self.active],
-                                      condition_columns=['name'], condition_values=[self.name]): # Условие поиска по имени
+        records = dependencies.db_manager.update_returning(Cabinet.table, ['active'],
+                                                           [self.active],
+                                                           condition_columns=['name'], condition_values=[self.name]) # Условие поиска по имени
+        if records is None:
             raise DatabaseError(f"Ошибка при обновлении кабинета с названием '{self.name}' в БД.")
+        if not records:
+            raise RecordNotFoundError(f"Кабинет с названием '{self.name}' не найден.")
         return True
 
     @staticmethod
@@ -163,6 +209,14 @@ class Cabinet:
             return Cabinet(**data)
         return None
 
+    @staticmethod
+    async def aget_by_name(cabinet_name: str) -> Optional['Cabinet']:
+        """Асинхронно получает кабинет по имени."""
+        data = await dependencies.async_db_manager.find_records(table_name=Cabinet.table, search_columns=['name'], search_values=[cabinet_name])
+        if data:
+            return Cabinet(**data)
+        return None
+
     @staticmethod
     def get_all() -> List['Cabinet']:
         """Получает все кабинеты."""
@@ -179,7 +233,7 @@ class Cabinet:
 
 class Device:
     table = "Devices"
-    columns = ['type_device', 'name_cabinet', 'name', 'active']
+    columns = ['type_device', 'name_cabinet', 'name', 'active', 'capacity']
 
     def __init__(
         self,
@@ -187,17 +241,19 @@ class Device:
         name_cabinet: str, # name_cabinet теперь обязательный параметр
         name: str = None,
         active: bool = True,
-        id: int = None # id может быть None при создании нового устройства
+        id: int = None, # id может быть None при создании нового устройства
+        capacity: int = 1 # Сколько параллельных задач (StandartTask.is_parallel) устройство выполняет одновременно
     ):
         self.type_device: Optional[int] = type_device # может быть None
         self.id: Optional[int] = id # id может быть None
         self.name_cabinet: str = name_cabinet
         self.name: Optional[str] = name
         self.active: bool = active
+        self.capacity: int = capacity if capacity else 1
 
     def add(self) -> Optional[int]: # Возвращаем ID добавленного устройства
         """Добавляет устройство в БД."""
-        if dependencies.db_manager.insert(Device.table, Device.columns, [self.type_device, self.name_cabinet, self.name, self.active]) is None:
+        if dependencies.db_manager.insert(Device.table, Device.columns, [self.type_device, self.name_cabinet, self.name, self.active, self.capacity]) is None:
             raise DatabaseError("Ошибка при добавлении устройства в БД.")
         
         # Получаем ID последней добавленной записи с таким же именем
@@ -209,14 +265,25 @@ class Device:
             logging.error("Не удалось получить ID добавленного устройства.")
             return None
 
+    async def aadd(self) -> Optional[int]:
+        """Асинхронно добавляет устройство в БД и возвращает его ID."""
+        device_id = await dependencies.async_db_manager.insert(Device.table, Device.columns,
+                                                               [self.type_device, self.name_cabinet, self.name, self.active, self.capacity],
+                                                               returning='id') # ID именно этой записи, а не последней с таким именем
+        if device_id is None:
+            raise DatabaseError("Ошибка при добавлении устройства в БД.")
+        self.id = device_id
+        return self.id
+
     def update(self):
         """Обновляет данные устройства в БД."""
-        if not Device.get_by_id(self.id):
-            raise RecordNotFoundError(f"Устройство с ID {self.id} не найдено.")
-        if not dependencies.db_manager.update(Device.table, Device.columns,
-                                      [self.type_device, self.name_cabinet, self.name, self.active], # Обновляем только name_cabinet, name, active
-                                      condition_columns=['id'], condition_values=[self.id]):
+        records = dependencies.db_manager.update_returning(Device.table, Device.columns,
+                                                           [self.type_device, self.name_cabinet, self.name, self.active, self.capacity],
+                                                           condition_columns=['id'], condition_values=[self.id])
+        if records is None:
             raise DatabaseError(f"Ошибка при обновлении устройства с ID {self.id} в БД.")
+        if not records:
+            raise RecordNotFoundError(f"Устройство с ID {self.id} не найдено.")
         return True
 
     @staticmethod
@@ -236,6 +303,14 @@ class Device:
             return Device(**data)
         return None
     
+    @staticmethod
+    async def aget_by_id(id_device: int) -> Optional['Device']:
+        """Асинхронно получает устройство по ID."""
+        data = await dependencies.async_db_manager.find_records(table_name=Device.table, search_columns=['id'], search_values=[id_device])
+        if data:
+            return Device(**data)
+        return None
+
     @staticmethod
     def get_by_type_device(type_device: int) -> Optional['Device']:
         """Получает устройство по ID."""
@@ -250,6 +325,18 @@ class Device:
         records = dependencies.db_manager.find_records(table_name=Device.table, multiple=True)
         return [Device(**record) for record in records] if records else []
 
+    @staticmethod
+    def iter_all() -> Iterator['Device']:
+        """Перебирает все устройства, читая их из БД порциями (см. DatabaseManager.iter_records)."""
+        for record in dependencies.db_manager.iter_records(table_name=Device.table):
+            yield Device(**record)
+
+    @staticmethod
+    async def aget_all() -> List['Device']:
+        """Асинхронно получает все устройства."""
+        records = await dependencies.async_db_manager.find_records(table_name=Device.table, multiple=True)
+        return [Device(**record) for record in records] if records else []
+
     @staticmethod
     def find_by_name_cabinet(name_cabinet: str) -> List['Device']:
         """Находит устройства по имени кабинета."""
@@ -271,6 +358,15 @@ class Device:
         if records:
             return Device(**records)
         return None
+
+    @staticmethod
+    async def afind_last_by_name(name: str) -> Optional['Device']:
+        """Асинхронно находит последнее устройство по имени."""
+        query = f"SELECT * FROM \"{Device.table}\" WHERE name = %s ORDER BY id DESC LIMIT 1"
+        records = await dependencies.async_db_manager.find_records(table_name=Device.table, custom_query=query, query_params=(name,), multiple=False)
+        if records:
+            return Device(**records)
+        return None
     
     @staticmethod
     def find_by_cabinet_and_name(name_cabinet: str, name: str) -> Optional['Device']:
@@ -281,39 +377,50 @@ class Device:
         return None
 
     @staticmethod
-    def find_available_device_by_type_and_time(type_device: int, start_time: datetime, end_time: datetime) -> Optional['Device']:
+    def find_by_type_devices(type_devices: List[int]) -> List['Device']:
+        """Находит все устройства с type_device из заданного списка одним запросом."""
+        query = f"SELECT * FROM \"{Device.table}\" WHERE type_device = ANY(%s) ORDER BY id"
+        records = dependencies.db_manager.find_records(table_name=Device.table, custom_query=query, query_params=(list(type_devices),), multiple=True)
+        return [Device(**record) for record in records] if records else []
+
+    @staticmethod
+    def find_by_ids(ids: List[int]) -> List['Device']:
+        """Находит устройства по списку ID одним запросом."""
+        query = f"SELECT * FROM \"{Device.table}\" WHERE id = ANY(%s) ORDER BY id"
+        records = dependencies.db_manager.find_records(table_name=Device.table, custom_query=query, query_params=(list(ids),), multiple=True)
+        return [Device(**record) for record in records] if records else []
+
+    @staticmethod
+    def find_available_device_by_type_and_time(type_device: int, start_time: datetime, end_time: datetime, is_parallel: bool = False) -> Optional['Device']:
         """
         Ищет и возвращает первое доступное устройство заданного type_device на заданный временной интервал.
-        Доступным считается устройство, у которого нет пересекающихся резерваций на это время.
+        Доступным считается устройство, на котором с учетом пересекающихся резерваций задача помещается
+        в его вместимость: параллельная задача занимает одно место, обычная - все устройство.
         """
+        from core.scheduling.occupancy import DeviceOccupancy # Локальный импорт: scheduling импортирует этот модуль
+
+        devices = Device.find_by_type_devices([type_device])
+        if not devices:
+            return None
+        occupancy = DeviceOccupancy(devices)
         query = f"""
-            SELECT d.*
-            FROM "{Device.table}" d
-            WHERE d.type_device = %s
-              AND NOT EXISTS (
-                  SELECT 1
-                  FROM "{Reservation.table}" r
-                  JOIN "{StandartTask.table}" st ON r.name_task = st.name
-                  WHERE st.type_device = d.type_device
-                    AND r.id_device = d.id  -- Проверяем id_device
-                    AND (
-                        (r.start_date <= %s AND r.end_date > %s)
-                        OR (r.start_date < %s AND r.end_date >= %s)
-                        OR (r.start_date >= %s AND r.end_date <= %s)
-                    )
-              )
-            LIMIT 1
-        """
-        query_params = (type_device, start_time, start_time, end_time, end_time, start_time, end_time)
-        record = dependencies.db_manager.find_records(
-            table_name=Device.table,
+            SELECT r.id_device, r.start_date, r.end_date, COALESCE(st.is_parallel, FALSE) AS is_parallel
+            FROM "{Reservation.table}" r
+            LEFT JOIN "{StandartTask.table}" st ON st.name = r.name_task
+            WHERE r.id_device = ANY(%s)
+              AND r.start_date < %s AND r.end_date > %s
+        """
+        query_params = ([device.id for device in devices], end_time, start_time)
+        records = dependencies.db_manager.find_records(
+            table_name=Reservation.table,
             custom_query=query,
             query_params=query_params,
-            multiple=False
+            multiple=True
         )
-        if record:
-            return Device(**record)
-        return None
+        for record in records or []:
+            occupancy.reserve(record['id_device'], record['start_date'], record['end_date'], record['is_parallel'])
+        id_device = occupancy.find_available_device(type_device, start_time, end_time, is_parallel)
+        return next((device for device in devices if device.id == id_device), None)
 
 
 
@@ -347,15 +454,24 @@ class StandartTask:
             raise DatabaseError("Ошибка при добавлении стандартной задачи в БД.")
         return True # Или можно вернуть None, так как id не генерируется
 
+    async def aadd(self):
+        """Асинхронно добавляет стандартную задачу в БД."""
+        if await StandartTask.aget_by_name(self.name):
+            raise DuplicateRecordError(f"Стандартная задача с именем '{self.name}' уже существует.")
+        if await dependencies.async_db_manager.insert(StandartTask.table, StandartTask.columns, [self.name, self.type_device, self.is_parallel, self.time_task]) is None:
+            raise DatabaseError("Ошибка при добавлении стандартной задачи в БД.")
+        return True
+
     def update(self):
         """Обновляет данные стандартной задачи в БД."""
-        if not StandartTask.get_by_name(self.name): # Ищем задачу по имени (PK)
-            raise RecordNotFoundError(f"Стандартная задача с именем '{self.name}' не найдена.")
-        if not dependencies.db_manager.update(StandartTask.table,
-                                      ['type_device', 'is_parallel', 'time_task'], # Обновляем все поля, кроме name (PK)
-                                      [self.type_device, self.is_parallel, self.time_task],
-                                      condition_columns=['name'], condition_values=[self.name]): # Условие поиска по имени
+        records = dependencies.db_manager.update_returning(StandartTask.table,
+                                                           ['type_device', 'is_parallel', 'time_task'], # Обновляем все поля, кроме name (PK)
+                                                           [self.type_device, self.is_parallel, self.time_task],
+                                                           condition_columns=['name'], condition_values=[self.name]) # Условие поиска по имени
+        if records is None:
             raise DatabaseError(f"Ошибка при обновлении стандартной задачи с именем '{self.name}' в БД.")
+        if not records:
+            raise RecordNotFoundError(f"Стандартная задача с именем '{self.name}' не найдена.")
         return True
 
     @staticmethod
@@ -370,6 +486,16 @@ class StandartTask:
                 return StandartTask(**data)
         return None
 
+    @staticmethod
+    async def aget_by_name(task_name: str) -> Optional['StandartTask']:
+        """Асинхронно получает стандартную задачу по имени (PK)."""
+        data = await dependencies.async_db_manager.find_records(table_name=StandartTask.table, search_columns=['name'], search_values=[task_name])
+        if data:
+            if data['time_task']:
+                data['time_task'] = timedelta(seconds=data['time_task'].total_seconds())
+            return StandartTask(**data)
+        return None
+
     @staticmethod
     def get_all() -> List['StandartTask']:
         """Получает все стандартные задачи."""
@@ -386,6 +512,19 @@ class StandartTask:
         records = dependencies.db_manager.find_records(table_name=StandartTask.table, search_columns=['type_device'], search_values=[type_device], multiple=True)
         return [StandartTask(**record) for record in records] if records else []
 
+    @staticmethod
+    def find_by_names(names: List[str]) -> List['StandartTask']:
+        """Находит стандартные задачи по списку имен одним запросом."""
+        query = f"SELECT * FROM \"{StandartTask.table}\" WHERE name = ANY(%s)"
+        records = dependencies.db_manager.find_records(table_name=StandartTask.table, custom_query=query, query_params=(list(names),), multiple=True)
+        tasks = []
+        for record in records:
+            if record['time_task']:
+                interval_val = record['time_task'] # Получаем объект psycopg2.extras.Interval
+                record['time_task'] = timedelta(seconds=interval_val.total_seconds()) # Создаем timedelta из компонентов INTERVAL
+            tasks.append(StandartTask(**record))
+        return tasks
+
     @staticmethod
     def find_by_cabinet_and_type_device(name_cabinet: str, type_device: int) -> List['StandartTask']:
         """Находит стандартные задачи по имени кабинета и ID устройства."""
@@ -452,14 +591,54 @@ class Reservation:
 
     def update(self):
         """Обновляет данные резервации в БД."""
-        if not Reservation.get_by_id(self.id):
-            raise RecordNotFoundError(f"Резервация с ID {self.id} не найдена.")
         assistants_json = json.dumps(self.assistants)
-        if not dependencies.db_manager.update(Reservation.table,
-                                      ['number_protocol', 'type_protocol', 'id_device', 'name_task', 'assistants', 'start_date', 'end_date', 'active'], # added 'id_device'
-                                      [self.number_protocol, self.type_protocol, self.id_device, self.name_task, assistants_json, self.start_date, self.end_date, self.active], # added self.id_device
-                                      condition_columns=['id'], condition_values=[self.id]):
+        records = dependencies.db_manager.update_returning(Reservation.table,
+                                                           ['number_protocol', 'type_protocol', 'id_device', 'name_task', 'assistants', 'start_date', 'end_date', 'active'], # added 'id_device'
+                                                           [self.number_protocol, self.type_protocol, self.id_device, self.name_task, assistants_json, self.start_date, self.end_date, self.active], # added self.id_device
+                                                           condition_columns=['id'], condition_values=[self.id])
+        if records is None:
             raise DatabaseError(f"Ошибка при обновлении резервации с ID {self.id} в БД.")
+        if not records:
+            raise RecordNotFoundError(f"Резервация с ID {self.id} не найдена.")
+        return True
+
+    async def aupdate(self):
+        """Асинхронно обновляет данные резервации в БД."""
+        if not await dependencies.async_db_manager.update(Reservation.table,
+                                                          ['number_protocol', 'type_protocol', 'id_device', 'name_task', 'assistants', 'start_date', 'end_date', 'active'],
+                                                          [self.number_protocol, self.type_protocol, self.id_device, self.name_task, json.dumps(self.assistants), self.start_date, self.end_date, self.active],
+                                                          condition_columns=['id'], condition_values=[self.id]):
+            raise RecordNotFoundError(f"Резервация с ID {self.id} не найдена или не обновлена.")
+        return True
+
+    @staticmethod
+    def add_many(reservations: List['Reservation'], next_protocol_number) -> List[int]:
+        """
+        Добавляет все резервации протокола одним INSERT ... RETURNING id в одной транзакции
+        и присваивает сгенерированные ID объектам.
+        """
+        rows = []
+        for reservation in reservations:
+            reservation.number_protocol = next_protocol_number
+            rows.append([reservation.number_protocol, reservation.type_protocol, reservation.id_device, reservation.name_task,
+                         json.dumps(reservation.assistants), reservation.start_date, reservation.end_date, reservation.active])
+
+        ids = dependencies.db_manager.insert_many(Reservation.table, Reservation.columns, rows, returning='id')
+        if ids is None:
+            raise DatabaseError("Ошибка при добавлении резерваций в БД.")
+        for reservation, reservation_id in zip(reservations, ids):
+            reservation.id = reservation_id
+        return ids
+
+    @staticmethod
+    def update_many(reservations: List['Reservation']):
+        """Обновляет несколько резерваций в БД одной транзакцией."""
+        columns = ['number_protocol', 'type_protocol', 'id_device', 'name_task', 'assistants', 'start_date', 'end_date', 'active']
+        rows = [[r.number_protocol, r.type_protocol, r.id_device, r.name_task, json.dumps(r.assistants), r.start_date, r.end_date, r.active]
+                for r in reservations]
+        if not dependencies.db_manager.update_many(Reservation.table, columns, rows,
+                                                   condition_columns=['id'], rows_condition_values=[[r.id] for r in reservations]):
+            raise DatabaseError("Ошибка при пакетном обновлении резерваций в БД.")
         return True
 
     @staticmethod
@@ -473,6 +652,17 @@ class Reservation:
             return Reservation(**data)
         return None
 
+    @staticmethod
+    async def aget_by_id(reservation_id: int) -> Optional['Reservation']:
+        """Асинхронно получает резервацию по ID."""
+        data = await dependencies.async_db_manager.find_records(table_name=Reservation.table, search_columns=['id'], search_values=[reservation_id])
+        if data:
+            if isinstance(data['assistants'], str):  # Проверяем, является ли значение строкой
+                if data['assistants']:
+                    data['assistants'] = json.loads(data['assistants'])
+            return Reservation(**data)
+        return None
+
     @staticmethod
     def get_all() -> List['Reservation']:
         """Получает все резервации."""
@@ -485,6 +675,34 @@ class Reservation:
             reservations.append(Reservation(**record))
         return reservations
 
+    @staticmethod
+    def iter_all() -> Iterator['Reservation']:
+        """Перебирает все резервации, читая их из БД порциями (см. DatabaseManager.iter_records)."""
+        for record in dependencies.db_manager.iter_records(table_name=Reservation.table):
+            yield Reservation._from_record(record)
+
+    @staticmethod
+    def iter_by_period(first_day: date, last_day: date) -> Iterator['Reservation']:
+        """
+        Перебирает резервации, начинающиеся в периоде [first_day, last_day), по времени начала,
+        читая их из БД порциями: подходит для отчетов и выгрузки за длинный период.
+        """
+        query = f"""
+            SELECT * FROM "{Reservation.table}"
+            WHERE start_date >= %s AND start_date < %s
+            ORDER BY start_date, id
+        """
+        query_params = (datetime.combine(first_day, datetime.min.time()), datetime.combine(last_day, datetime.min.time()))
+        for record in dependencies.db_manager.iter_records(table_name=Reservation.table, custom_query=query, query_params=query_params):
+            yield Reservation._from_record(record)
+
+    @staticmethod
+    def _from_record(record: dict) -> 'Reservation':
+        """Создает резервацию из записи БД."""
+        if isinstance(record['assistants'], str):  # Проверяем, является ли значение строкой
+            record['assistants'] = json.loads(record['assistants']) if record['assistants'] else []
+        return Reservation(**record)
+
     @staticmethod
     def find_by_task_name(name_task: str) -> List['Reservation']:
         """Находит резервации по имени задачи."""
@@ -532,6 +750,15 @@ class Reservation:
             return list(record.values())[0] # Возвращаем первое значение из словаря record (независимо от имени ключа)
         return 1
 
+    @staticmethod
+    def _day_bounds(day: date) -> Tuple[datetime, datetime]:
+        """
+        Возвращает полуоткрытый интервал [начало дня, начало следующего дня) для фильтра
+        start_date >= %s AND start_date < %s: в отличие от DATE(start_date) = %s он использует индекс по start_date.
+        """
+        day_start = datetime.combine(day, datetime.min.time())
+        return day_start, day_start + timedelta(days=1)
+
     @staticmethod
     def find_by_assistant_and_date(user_id: int, date_reservation: date = None) -> List['Reservation']:
         """
@@ -543,10 +770,10 @@ class Reservation:
 
         query = f"""
             SELECT * FROM "{Reservation.table}"
-            WHERE assistants::jsonb @> %s
-              AND DATE(start_date) = %s
+            WHERE assistants @> %s
+              AND start_date >= %s AND start_date < %s
         """
-        query_params = (json.dumps([user_id]), date_reservation)
+        query_params = (json.dumps([user_id]), *Reservation._day_bounds(date_reservation))
 
         records = dependencies.db_manager.find_records(
             table_name=Reservation.table,
@@ -559,6 +786,25 @@ class Reservation:
             reservations.append(Reservation(**record))
         return reservations
 
+    @staticmethod
+    async def afind_by_assistant_and_date(user_id: int, date_reservation: date = None) -> List['Reservation']:
+        """Асинхронный вариант find_by_assistant_and_date."""
+        if date_reservation is None:
+            date_reservation = date.today()
+
+        query = f"""
+            SELECT * FROM "{Reservation.table}"
+            WHERE assistants @> %s
+              AND start_date >= %s AND start_date < %s
+        """
+        records = await dependencies.async_db_manager.find_records(
+            table_name=Reservation.table,
+            custom_query=query,
+            query_params=(json.dumps([user_id]), *Reservation._day_bounds(date_reservation)),
+            multiple=True
+        )
+        return [Reservation(**record) for record in records]
+
     @staticmethod
     def find_overlapping_reservations(id_device: int, start_time: datetime, end_time: datetime) -> List['Reservation']: # updated to filter by id_device
         """
@@ -568,13 +814,9 @@ class Reservation:
             SELECT r.*
             FROM "{Reservation.table}" r
             WHERE r.id_device = %s  -- Фильтрация по id_device
-              AND (
-                  (r.start_date <= %s AND r.end_date > %s)
-                  OR (r.start_date < %s AND r.end_date >= %s)
-                  OR (r.start_date >= %s AND r.end_date <= %s)
-              )
+              AND r.start_date < %s AND r.end_date > %s  -- Интервалы пересекаются (индекс по id_device, start_date, end_date)
         """
-        query_params = (id_device, start_time, start_time, end_time, end_time, start_time, end_time) # updated query_params
+        query_params = (id_device, end_time, start_time)
         records = dependencies.db_manager.find_records(
             table_name=Reservation.table,
             custom_query=query,
@@ -597,9 +839,9 @@ class Reservation:
         today_date = date.today()
         query = f"""
             SELECT * FROM "{Reservation.table}"
-            WHERE DATE(start_date) = %s
+            WHERE start_date >= %s AND start_date < %s
         """
-        query_params = (today_date,)
+        query_params = Reservation._day_bounds(today_date)
         records = dependencies.db_manager.find_records(
             table_name=Reservation.table,
             custom_query=query,
@@ -614,6 +856,55 @@ class Reservation:
             reservations.append(Reservation(**record))
         return reservations
       
+    @staticmethod
+    async def aget_all_by_today() -> List['Reservation']:
+        """Асинхронно получает все резервации на текущий день."""
+        query = f"""
+            SELECT * FROM "{Reservation.table}"
+            WHERE start_date >= %s AND start_date < %s
+        """
+        records = await dependencies.async_db_manager.find_records(
+            table_name=Reservation.table,
+            custom_query=query,
+            query_params=Reservation._day_bounds(date.today()),
+            multiple=True
+        )
+        reservations = []
+        for record in records:
+            if isinstance(record['assistants'], str):  # Проверяем, является ли значение строкой
+                if record['assistants']:
+                    record['assistants'] = json.loads(record['assistants'])
+            reservations.append(Reservation(**record))
+        return reservations
+
+    @staticmethod
+    def get_device_intervals_by_period(first_day: date, last_day: date, type_devices: List[int]) -> List[Tuple[int, int, datetime, datetime, bool]]:
+        """
+        Получает интервалы резерваций, начинающихся в периоде [first_day, last_day), для устройств
+        с type_device из заданного списка одним запросом: (id, id_device, start_date, end_date, is_parallel).
+        is_parallel берется из стандартной задачи резервации и нужен для учета вместимости устройства.
+        """
+        query = f"""
+            SELECT r.id, r.id_device, r.start_date, r.end_date, COALESCE(st.is_parallel, FALSE) AS is_parallel
+            FROM "{Reservation.table}" r
+            JOIN "{Device.table}" d ON d.id = r.id_device
+            LEFT JOIN "{StandartTask.table}" st ON st.name = r.name_task
+            WHERE d.type_device = ANY(%s)
+              AND r.start_date >= %s AND r.start_date < %s
+            ORDER BY r.id_device, r.start_date
+        """
+        query_params = (list(type_devices), first_day, last_day)
+        records = dependencies.db_manager.find_records(
+            table_name=Reservation.table,
+            custom_query=query,
+            query_params=query_params,
+            multiple=True
+        )
+        return [
+            (record['id'], record['id_device'], record['start_date'], record['end_date'], record['is_parallel'])
+            for record in records or []
+        ]
+
     @staticmethod
     def get_all_by_today_with_protocol_numbers() -> List[Tuple[int, List['Reservation']]]:
         """
@@ -627,10 +918,10 @@ class Reservation:
         today_date = date.today()
         query = f"""
             SELECT * FROM "{Reservation.table}"
-            WHERE DATE(start_date) = %s
+            WHERE start_date >= %s AND start_date < %s
             ORDER BY number_protocol, start_date
         """
-        query_params = (today_date,)
+        query_params = Reservation._day_bounds(today_date)
         records = dependencies.db_manager.find_records(
             table_name=Reservation.table,
             custom_query=query,
@@ -661,10 +952,10 @@ class Reservation:
         today_date = date.today()
         query = f"""
             SELECT * FROM "{Reservation.table}"
-            WHERE DATE(start_date) = %s
+            WHERE start_date >= %s AND start_date < %s
             ORDER BY number_protocol, start_date
         """
-        query_params = (today_date,)
+        query_params = Reservation._day_bounds(today_date)
         records = dependencies.db_manager.find_records(
             table_name=Reservation.table,
             custom_query=query,
@@ -705,21 +996,26 @@ class Reservation:
 
         standart_tasks_names = protocol.list_standart_tasks
         today_date = reservation_to_replan.start_date.date() if reservation_to_replan.start_date else date.today() # Берем дату из резервации или текущую
-        schedule_start_datetime = datetime.combine(today_date, WORKING_DAY_START)
-        schedule_end_datetime = datetime.combine(today_date, WORKING_DAY_END)
 
         # Начинаем поиск времени для перепланирования с момента окончания текущей задачи, если возможно, или с начала рабочего дня
-        current_task_start_time = reservation_to_replan.end_date if reservation_to_replan.end_date and reservation_to_replan.end_date > datetime.now() else schedule_start_datetime
+        current_task_start_time = reservation_to_replan.end_date if reservation_to_replan.end_date and reservation_to_replan.end_date > datetime.now() else None
         next_protocol_number = reservation_to_replan.number_protocol # Сохраняем номер протокола, чтобы не менять его
 
-        tasks_not_scheduled = []
         replan_reservations = [] # Список для хранения перепланированных резерваций
 
-        task_index_to_start = -1
-        for index, task_name in enumerate(standart_tasks_names):
-            if task_name == reservation_to_replan.name_task:
-                task_index_to_start = index
-                break
+        # Резервации этого протокола по порядку начала, сопоставленные позициям задач в протоколе
+        # (задача может повторяться в протоколе, поэтому сопоставление по позиции, а не по названию)
+        protocol_reservations = sorted(
+            (reservation for reservation in Reservation.find_by_protocol_name(protocol_name)
+             if reservation.number_protocol == next_protocol_number),
+            key=lambda reservation: (reservation.start_date or datetime.min, reservation.id)
+        )
+        reservations_by_position = Reservation._match_task_positions(standart_tasks_names, protocol_reservations)
+
+        task_index_to_start = next((position for position, reservation in reservations_by_position.items()
+                                    if reservation.id == reservation_to_replan.id), -1)
+        if task_index_to_start == -1 and reservation_to_replan.name_task in standart_tasks_names:
+            task_index_to_start = standart_tasks_names.index(reservation_to_replan.name_task)
 
         if task_index_to_start == -1:
             logging.warning(f"Задача '{reservation_to_replan.name_task}' не найдена в списке задач протокола '{protocol_name}'. Перепланирование отменено.")
@@ -728,84 +1024,53 @@ class Reservation:
         # Начинаем перепланирование с задачи, следующей за указанной в reservation_id
         tasks_to_replan = standart_tasks_names[task_index_to_start:]
 
-        for task_name in tasks_to_replan:
-            standart_task = StandartTask.get_by_name(task_name)
-            if not standart_task:
-                logging.warning(f"Стандартная задача '{task_name}' не найдена, пропуск.")
-                tasks_not_scheduled.append(task_name)
-                continue
-
-            task_duration = standart_task.time_task
-            if task_duration is None:
-                logging.warning(f"Для задачи '{task_name}' не указано время выполнения (time_task), пропуск.")
-                tasks_not_scheduled.append(task_name)
-                continue
-
-            device_type = standart_task.type_device
-
-            if device_type is None:
-                logging.warning(f"У задачи '{task_name}' не указан type_device, пропуск.")
-                tasks_not_scheduled.append(task_name)
-                continue
-
-            # Поиск доступного времени и устройства
-            available_slot_found = False
-            schedule_attempt_time = current_task_start_time
-            while schedule_attempt_time + task_duration <= schedule_end_datetime:
-                available_device = Device.find_available_device_by_type_and_time(
-                    type_device=device_type,
-                    start_time=schedule_attempt_time,
-                    end_time=schedule_attempt_time + task_duration
-                )
-                if available_device:
-                    # Найдено доступное устройство и время
-                    device_id = available_device.id
-                    task_end_time = schedule_attempt_time + task_duration
-
-                    # Ищем существующую резервацию для обновления или создаем новую, если не найдена для перепланирования
-                    existing_reservation = Reservation.find_by_protocol_task_device_dates(
-                        number_protocol=next_protocol_number,
-                        type_protocol=protocol_name,
-                        id_device=device_id,
-                        name_task=task_name,
-                        start_date=current_task_start_time, # Используем current_task_start_time для поиска
-                        end_date=task_end_time # Используем task_end_time для поиска
-                    )
-
-                    if existing_reservation:
-                        # Обновляем время существующей резервации
-                        existing_reservation.start_date = schedule_attempt_time
-                        existing_reservation.end_date = task_end_time
-                        existing_reservation.update()
-                        replan_reservations.append(existing_reservation)
-                    else:
-                        # Создаем новую резервацию, если не найдена существующая (в теории не должно происходить при перепланировании)
-                        reservation = Reservation(
-                            type_protocol=protocol_name,
-                            name_task=task_name,
-                            id_device=device_id,
-                            start_date=schedule_attempt_time,
-                            end_date=task_end_time,
-                            number_protocol=next_protocol_number
-                        )
-                        reservation.add(next_protocol_number) # Используем существующий номер протокола
-                        replan_reservations.append(reservation)
-
-                    current_task_start_time = task_end_time
-                    available_slot_found = True
-                    break # Переходим к следующей задаче
-                else:
-                    # Нет доступных устройств, сдвигаем время и пробуем снова
-                    schedule_attempt_time += timedelta(minutes=5) # Шаг сдвига времени, можно настроить
-                    if schedule_attempt_time.time() > WORKING_DAY_END:
-                        break # Вышли за пределы рабочего дня
-
-            if not available_slot_found:
-                logging.warning(f"Не удалось запланировать задачу '{task_name}' на сегодня из-за занятости оборудования.")
-                tasks_not_scheduled.append(task_name)
-
+        # Резервации, которые сейчас перепланируются (по позиции в tasks_to_replan): они не должны занимать устройства в индексе
+        existing_reservations = {position - task_index_to_start: reservation
+                                 for position, reservation in reservations_by_position.items()
+                                 if position >= task_index_to_start}
+
+        from core.scheduling.engine import ScheduleEngine # Локальный импорт: модуль планирования сам зависит от core.classes
+        engine = ScheduleEngine.load_for_day(today_date, tasks_to_replan, exclude_ids=[r.id for r in existing_reservations.values()])
+        plan = engine.plan_protocol(protocol_name, tasks_to_replan, number_protocol=next_protocol_number, not_before=current_task_start_time)
+
+        new_reservations = []
+        planned_by_position = Reservation._match_task_positions(tasks_to_replan, plan.to_reservations())
+        for position, planned_reservation in sorted(planned_by_position.items()):
+            existing_reservation = existing_reservations.pop(position, None)
+            if existing_reservation:
+                # Обновляем время и устройство существующей резервации
+                existing_reservation.id_device = planned_reservation.id_device
+                existing_reservation.start_date = planned_reservation.start_date
+                existing_reservation.end_date = planned_reservation.end_date
+                existing_reservation.update()
+                replan_reservations.append(existing_reservation)
+            else:
+                # Создаем новую резервацию, если не найдена существующая (в теории не должно происходить при перепланировании)
+                new_reservations.append(planned_reservation)
+        if new_reservations:
+            Reservation.add_many(new_reservations, next_protocol_number) # Используем существующий номер протокола
+            replan_reservations.extend(new_reservations)
+
+        tasks_not_scheduled = plan.tasks_not_scheduled
         return replan_reservations, tasks_not_scheduled
 
+    @staticmethod
+    def _match_task_positions(task_names: List[str], reservations: List['Reservation']) -> Dict[int, 'Reservation']:
+        """
+        Сопоставляет резервации (в порядке выполнения) позициям задач в task_names: каждая резервация
+        занимает ближайшую следующую позицию с тем же названием задачи, пропущенные задачи остаются без резерваций.
+        """
+        reservations_by_position = {}
+        position = 0
+        for reservation in reservations:
+            while position < len(task_names) and task_names[position] != reservation.name_task:
+                position += 1
+            if position == len(task_names):
+                break
+            reservations_by_position[position] = reservation
+            position += 1
+        return reservations_by_position
+
     @staticmethod
     def _remove_assistant(reservation_id: int, assistant_id: int):
         """
@@ -848,27 +1113,24 @@ class Reservation:
         today_date = date.today()
         query = f"""
             DELETE FROM "{Reservation.table}"
-            WHERE DATE(start_date) = %s
+            WHERE start_date >= %s AND start_date < %s
         """
-        Reservation.delete_records_by_date(Reservation.table, query, (today_date,))
+        Reservation.delete_records_by_date(Reservation.table, query, Reservation._day_bounds(today_date))
 
     @staticmethod
     def delete_records_by_date(table_name, query, query_params):
         """
         Удаляет записи из таблицы по дате.
         """
-        conn = dependencies.db_manager._connect() # Используем _connect для получения соединения из пула
         try:
-            with conn.cursor() as cursor:
-                cursor.execute(query, query_params)
-                conn.commit()
-                logging.info(f"Успешно удалены записи из таблицы {table_name} за указанную дату.")
-                return True
+            with dependencies.db_manager.transaction() as conn: # Присоединяется к открытой транзакции, если она есть
+                with conn.cursor() as cursor:
+                    cursor.execute(query, query_params)
+            logging.info(f"Успешно удалены записи из таблицы {table_name} за указанную дату.")
+            return True
         except psycopg2.Error as e:
             logging.error(f"Ошибка при удалении записей из таблицы {table_name}: {e}")
             return False
-        finally:
-            dependencies.db_manager._db_conn.return_connection(conn) # Возвращаем соединение в пул
 
 class Protocol:
     table = "Protocols"
@@ -893,14 +1155,23 @@ class Protocol:
 
         return self.name
 
+    async def aadd(self) -> Optional[str]:
+        """Асинхронно добавляет протокол в БД."""
+        if await Protocol.aget_by_name(self.name):
+            raise DuplicateRecordError(f"Протокол с именем '{self.name}' уже существует.")
+        if await dependencies.async_db_manager.insert(Protocol.table, Protocol.columns, [self.name, json.dumps(self.list_standart_tasks)]) is None:
+            raise DatabaseError("Ошибка при добавлении протокола в БД.")
+        return self.name
+
     def update(self):
         """Обновляет данные протокола в БД."""
-        if not Protocol.get_by_name(self.name):
-            raise RecordNotFoundError(f"Протокол с именем '{self.name}' не найден.")
-        if not dependencies.db_manager.update(Protocol.table, columns=['list_standart_tasks'],
-                                      values=[json.dumps(self.list_standart_tasks, ensure_ascii=False)],
-                                      condition_columns=['name'], condition_values=[self.name]):
+        records = dependencies.db_manager.update_returning(Protocol.table, ['list_standart_tasks'],
+                                                           [json.dumps(self.list_standart_tasks, ensure_ascii=False)],
+                                                           condition_columns=['name'], condition_values=[self.name])
+        if records is None:
             raise DatabaseError(f"Ошибка при обновлении протокола с именем '{self.name}' в БД.")
+        if not records:
+            raise RecordNotFoundError(f"Протокол с именем '{self.name}' не найден.")
         return True
 
     @staticmethod
@@ -927,6 +1198,17 @@ class Protocol:
             return Protocol(**data)
         return None
 
+    @staticmethod
+    async def aget_by_name(protocol_name: str) -> Optional['Protocol']:
+        """Асинхронно получает протокол по имени."""
+        data = await dependencies.async_db_manager.find_records(table_name=Protocol.table, search_columns=['name'], search_values=[protocol_name])
+        if data:
+            if isinstance(data['list_standart_tasks'], str):  # Проверяем, является ли значение строкой
+                if data['list_standart_tasks']:
+                    data['list_standart_tasks'] = json.loads(data['list_standart_tasks'])
+            return Protocol(**data)
+        return None
+
     @staticmethod
     def get_all() -> List['Protocol']:
         """Получает все протоколы."""
@@ -939,6 +1221,26 @@ class Protocol:
             protocols.append(Protocol(**record))
         return protocols
 
+    @staticmethod
+    def iter_all() -> Iterator['Protocol']:
+        """Перебирает все протоколы, читая их из БД порциями (см. DatabaseManager.iter_records)."""
+        for record in dependencies.db_manager.iter_records(table_name=Protocol.table):
+            if isinstance(record['list_standart_tasks'], str) and record['list_standart_tasks']:
+                record['list_standart_tasks'] = json.loads(record['list_standart_tasks'])
+            yield Protocol(**record)
+
+    @staticmethod
+    async def aget_all() -> List['Protocol']:
+        """Асинхронно получает все протоколы."""
+        records = await dependencies.async_db_manager.find_records(table_name=Protocol.table, multiple=True)
+        protocols = []
+        for record in records:
+            if isinstance(record['list_standart_tasks'], str):  # Проверяем, является ли значение строкой
+                if record['list_standart_tasks']:
+                    record['list_standart_tasks'] = json.loads(record['list_standart_tasks'])
+            protocols.append(Protocol(**record))
+        return protocols
+
     @staticmethod
     def find_last_by_name(name: str) -> Optional['Protocol']:
         """Находит последний протокол по имени."""
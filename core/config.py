@@ -3,9 +3,46 @@ from datetime import time
 WORKING_DAY_START = time(16, 0)   # Начало рабочего дня - 9:00
 WORKING_DAY_END = time(23, 0)    # Конец рабочего дня - 18:00
 
+WORKING_DAYS = (0, 1, 2, 3, 4, 5, 6)  # Рабочие дни недели (0 - понедельник), на которые переносятся задачи
+SCHEDULE_HORIZON_DAYS = 7  # На сколько дней вперед можно переносить задачи, не поместившиеся в сегодняшний день
+
+SCHEDULE_OPTIMIZER_TIME_BUDGET = 2.0  # Секунд на улучшение пакетного плана (0 - только жадный план)
+
 PG_FSM_DBNAME = "bio_fsm_state_3"
 PG_DBNAME = "bio_3"
 
 PG_USER = "postgres"
 PG_HOST = "localhost"
 PG_PORT = 5432
+
+PG_POOL_MIN_SIZE = 1  # Минимум соединений в пуле psycopg2 (core/pool.py), открываются при запуске
+PG_POOL_MAX_SIZE = 10  # Максимум одновременно открытых соединений
+PG_POOL_ACQUIRE_TIMEOUT = 5.0  # Сколько секунд ждать свободного соединения, прежде чем выбросить PoolTimeoutError
+PG_POOL_HEALTH_CHECK_IDLE = 30.0  # Соединение, простаивавшее дольше (секунд), проверяется перед выдачей
+PG_PREPARED_STATEMENTS = True  # Выполнять типовые запросы DatabaseManager как подготовленные на сервере (PREPARE/EXECUTE)
+PG_ITERSIZE = 2000  # Сколько строк за раз читает с сервера DatabaseManager.iter_records
+
+# Строка подключения к реплике только для чтения, например "host=localhost port=5433 dbname=bio_3 user=postgres"
+# (пароль - PG_PASSWORD, если не указан в строке). None - все запросы идут на основной сервер
+PG_REPLICA_DSN = None
+PG_REPLICA_CONNECT_TIMEOUT = 3  # Сколько секунд ждать подключения к реплике
+PG_REPLICA_RETRY_INTERVAL = 30.0  # Сколько секунд после сбоя реплики читать только с основного сервера
+
+PG_ASYNC_POOL_MIN_SIZE = 1  # Минимум соединений в асинхронном пуле (AsyncDatabaseManager)
+PG_ASYNC_POOL_MAX_SIZE = 10  # Максимум соединений в асинхронном пуле
+
+PG_FSM_POOL_MIN_SIZE = 1  # Минимум соединений в пуле хранилища состояний FSM (AsyncPostgreSQLStorage)
+PG_FSM_POOL_MAX_SIZE = 10  # Максимум соединений в пуле хранилища состояний FSM
+
+FSM_STORAGE_BACKEND = 'postgres'  # Хранилище состояний FSM: 'postgres' (БД PG_FSM_DBNAME), 'sqlite' (файл FSM_SQLITE_PATH) или 'memory' (в памяти, теряется при перезапуске)
+FSM_SQLITE_PATH = 'fsm_states.sqlite3'  # Файл хранилища состояний FSM для FSM_STORAGE_BACKEND = 'sqlite'
+FSM_SQLITE_BUSY_TIMEOUT = 5.0  # Сколько секунд поток хранилища FSM SQLite ждет блокировки файла другим процессом
+
+FSM_CACHE_MAX_SIZE = 10000  # Сколько пользователей держать в кэше состояний FSM (0 - кэш отключен)
+FSM_CACHE_TTL = 600.0  # Через сколько секунд неизмененная запись кэша перечитывается из хранилища
+FSM_CACHE_DURABILITY = 'end_of_update'  # Когда записывать изменения FSM: 'write_through', 'end_of_update' или 'periodic'
+FSM_CACHE_FLUSH_INTERVAL = 5.0  # Период фоновой записи изменений FSM, секунд
+
+FSM_STATE_TTL_DAYS = 30  # Через сколько дней без изменений состояние и данные FSM пользователя удаляются (0 - не удалять)
+FSM_SWEEP_INTERVAL = 3600.0  # Как часто (секунд) удалять устаревшие состояния FSM
+FSM_SWEEP_BATCH_SIZE = 500  # Сколько устаревших записей FSM удалять одним запросом
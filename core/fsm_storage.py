@@ -0,0 +1,549 @@
+import asyncio
+import copy
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Set, Tuple
+
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+from core.config import (FSM_CACHE_DURABILITY, FSM_CACHE_FLUSH_INTERVAL, FSM_CACHE_MAX_SIZE, FSM_CACHE_TTL,
+                         FSM_SQLITE_BUSY_TIMEOUT, FSM_SQLITE_PATH, FSM_STATE_TTL_DAYS, FSM_SWEEP_BATCH_SIZE, FSM_SWEEP_INTERVAL)
+
+# Режимы надежности записи:
+# 'write_through' - каждое изменение сразу записывается в хранилище, из памяти обслуживается только чтение;
+# 'end_of_update' - изменения записываются один раз в конце обработки обновления (flush из middleware);
+# 'periodic' - изменения записываются по таймеру, при сбое теряются изменения за последний интервал.
+DURABILITY_MODES = ('write_through', 'end_of_update', 'periodic')
+
+
+class FSMStorage(BaseStorage):
+    """
+    Общий интерфейс хранилищ состояний FSM бота (AsyncPostgreSQLStorage, SQLiteFSMStorage, MemoryFSMStorage).
+    Кроме методов BaseStorage хранилище читает и записывает состояние и данные пользователя одной операцией
+    (get_snapshot/set_snapshot, их использует CustomFSMContext), update_data дописывает ключи и возвращает
+    итоговые данные, а sweep_expired удаляет записи, не изменявшиеся дольше FSM_STATE_TTL_DAYS дней.
+    Семантика у всех хранилищ одна: set_state(None) удаляет и состояние, и данные.
+    """
+    _sweep_task: Optional[asyncio.Task] = None
+
+    async def initialize(self):
+        """Открывает хранилище и запускает фоновое удаление устаревших записей."""
+        self._start_sweeping()
+
+    async def get_snapshot(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Возвращает состояние и данные пользователя."""
+        return await self.get_state(key), await self.get_data(key)
+
+    async def set_snapshot(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]) -> None:
+        """Заменяет состояние и данные пользователя (без состояния и данных запись удаляется)."""
+        await self.set_state(key, state)
+        if state is not None or data:
+            await self.set_data(key, data)
+
+    async def sweep_expired(self, ttl_days: int = FSM_STATE_TTL_DAYS, batch_size: int = FSM_SWEEP_BATCH_SIZE) -> int:
+        """Удаляет записи, не изменявшиеся дольше ttl_days дней. Возвращает число удаленных записей."""
+        return 0
+
+    def _start_sweeping(self):
+        """Запускает периодическое удаление устаревших записей (если задан FSM_STATE_TTL_DAYS)."""
+        if FSM_STATE_TTL_DAYS and self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_periodically())
+
+    def _stop_sweeping(self):
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            self._sweep_task = None
+
+    async def _sweep_periodically(self):
+        """Фоновая задача: раз в FSM_SWEEP_INTERVAL секунд удаляет устаревшие состояния FSM."""
+        while True:
+            try:
+                await self.sweep_expired()
+            except Exception as e:
+                logging.error(f"Ошибка при периодическом удалении состояний FSM: {e}")
+            await asyncio.sleep(FSM_SWEEP_INTERVAL)
+
+
+class _CacheEntry:
+    """Состояние и данные FSM одного пользователя в кэше."""
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any]):
+        self.state: Optional[str] = state
+        self.data: Dict[str, Any] = data
+        self.state_dirty: bool = False # Состояние изменено и еще не записано в хранилище
+        self.data_dirty: bool = False # Данные заменены целиком и еще не записаны в хранилище
+        self.changed_keys: Set[str] = set() # Ключи, дописанные update_data и еще не записанные в хранилище
+        self.loaded_at: float = time.monotonic()
+
+    @property
+    def dirty(self) -> bool:
+        return self.state_dirty or self.data_dirty or bool(self.changed_keys)
+
+
+class WriteBackStorage(FSMStorage):
+    """
+    Кэш LRU+TTL перед хранилищем состояний FSM (например, AsyncPostgreSQLStorage).
+    Чтение состояния и данных обслуживается из памяти: хранилище читается один раз при промахе
+    или после истечения ttl. Изменения копятся в памяти и записываются в хранилище в зависимости
+    от durability (см. DURABILITY_MODES): сразу, один раз в конце обработки обновления (flush)
+    или по таймеру раз в flush_interval секунд. Перед вытеснением из кэша измененная запись сохраняется.
+    Если запись изменялась только через update_data, в хранилище передаются только дописанные ключи
+    (backend.update_data, слияние на стороне хранилища), и ключи, записанные другими процессами, не затираются.
+    Семантика совпадает с хранилищем: set_state(None) удаляет и состояние, и данные.
+    """
+
+    def __init__(self, backend: BaseStorage, durability: str = FSM_CACHE_DURABILITY, max_size: int = FSM_CACHE_MAX_SIZE,
+                 ttl: float = FSM_CACHE_TTL, flush_interval: float = FSM_CACHE_FLUSH_INTERVAL):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Неизвестный режим надежности '{durability}', ожидается одно из {DURABILITY_MODES}.")
+        self.backend: BaseStorage = backend
+        self.durability: str = durability
+        self.max_size: int = max_size
+        self.ttl: float = ttl
+        self.flush_interval: float = flush_interval
+        self._entries: "OrderedDict[StorageKey, _CacheEntry]" = OrderedDict() # Последняя использованная запись - в конце
+        self._flush_task: Optional[asyncio.Task] = None
+        self.hits: int = 0
+        self.misses: int = 0
+        self.flushes: int = 0 # Сколько раз измененная запись сохранена в хранилище
+
+    async def initialize(self):
+        """Инициализирует хранилище и запускает периодическую запись изменений."""
+        initialize = getattr(self.backend, 'initialize', None)
+        if initialize is not None:
+            await initialize()
+        if self.durability != 'write_through' and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        """Фоновая задача: раз в flush_interval секунд сохраняет все измененные записи."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush_all()
+            except Exception as e:
+                logging.error(f"Ошибка при периодической записи состояний FSM: {e}")
+
+    async def _entry(self, key: StorageKey) -> _CacheEntry:
+        """Возвращает запись кэша, при промахе или истекшем ttl загружая ее из хранилища."""
+        entry = self._entries.get(key)
+        if entry is not None and (entry.dirty or time.monotonic() - entry.loaded_at < self.ttl):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        get_snapshot = getattr(self.backend, 'get_snapshot', None)
+        if get_snapshot is not None:
+            state, data = await get_snapshot(key) # Один запрос вместо двух
+        else:
+            state = await self.backend.get_state(key)
+            data = await self.backend.get_data(key)
+        entry = self._entries.get(key)
+        if entry is not None and entry.dirty:
+            return entry # Запись изменили, пока шла загрузка: изменения новее загруженного
+        entry = _CacheEntry(state, data)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        await self._evict()
+        return entry
+
+    async def _evict(self):
+        """Вытесняет давно не использовавшиеся записи сверх max_size, сохраняя измененные."""
+        while len(self._entries) > self.max_size:
+            key, entry = next(iter(self._entries.items()))
+            if entry.dirty:
+                await self._write(key, entry)
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+
+    async def _write(self, key: StorageKey, entry: _CacheEntry):
+        """Сохраняет измененные состояние и данные записи в хранилище."""
+        state_dirty, data_dirty, changed_keys = entry.state_dirty, entry.data_dirty, entry.changed_keys
+        entry.state_dirty = entry.data_dirty = False
+        entry.changed_keys = set()
+        set_snapshot = getattr(self.backend, 'set_snapshot', None)
+        try:
+            if not state_dirty and not data_dirty:
+                # Только update_data: дописываем измененные ключи, не перезаписывая данные целиком
+                await self.backend.update_data(key, {data_key: entry.data[data_key] for data_key in changed_keys})
+            elif set_snapshot is not None:
+                await set_snapshot(key, entry.state, entry.data) # Состояние и данные одним запросом
+            else:
+                if state_dirty:
+                    await self.backend.set_state(key, entry.state)
+                    if entry.state is None:
+                        data_dirty = bool(entry.data) # Хранилище удалило запись вместе с данными
+                if data_dirty:
+                    await self.backend.set_data(key, entry.data)
+                elif changed_keys and entry.state is not None:
+                    await self.backend.update_data(key, {data_key: entry.data[data_key] for data_key in changed_keys})
+        except Exception:
+            entry.state_dirty = entry.state_dirty or state_dirty
+            entry.data_dirty = entry.data_dirty or data_dirty
+            entry.changed_keys |= changed_keys
+            raise
+        self.flushes += 1
+
+    async def _changed(self, key: StorageKey, entry: _CacheEntry):
+        """Вызывается после изменения записи: в режиме write_through сразу сохраняет ее."""
+        if self.durability == 'write_through':
+            await self._write(key, entry)
+
+    async def flush(self, key: StorageKey):
+        """Сохраняет изменения одного пользователя. Вызывается в конце обработки обновления."""
+        entry = self._entries.get(key)
+        if entry is not None and entry.dirty and self.durability == 'end_of_update':
+            await self._write(key, entry)
+
+    async def flush_all(self):
+        """Сохраняет все измененные записи."""
+        for key, entry in list(self._entries.items()):
+            if entry.dirty:
+                await self._write(key, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key)).state
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key)
+        entry.state = state.state if hasattr(state, 'state') else state
+        if entry.state is None:
+            entry.data = {} # Как и в хранилище: сброс состояния удаляет и данные
+            entry.changed_keys = set()
+        entry.state_dirty = True
+        await self._changed(key, entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return copy.deepcopy((await self._entry(key)).data) # Копия: изменения без set_data не должны попадать в кэш
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = await self._entry(key)
+        entry.data = copy.deepcopy(data)
+        entry.data_dirty = True
+        entry.changed_keys = set() # Данные записываются целиком
+        await self._changed(key, entry)
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        entry = await self._entry(key)
+        entry.data = {**entry.data, **copy.deepcopy(data)}
+        entry.changed_keys.update(data)
+        await self._changed(key, entry)
+        return copy.deepcopy(entry.data)
+
+    async def get_snapshot(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Возвращает состояние и копию данных пользователя."""
+        entry = await self._entry(key)
+        return entry.state, copy.deepcopy(entry.data)
+
+    async def set_snapshot(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]) -> None:
+        """Заменяет состояние и данные пользователя (без состояния и данных запись удаляется)."""
+        entry = await self._entry(key)
+        entry.state = state
+        entry.data = copy.deepcopy(data)
+        entry.state_dirty = entry.data_dirty = True
+        entry.changed_keys = set()
+        await self._changed(key, entry)
+
+    async def reset_state(self, key: StorageKey, with_data: bool = True) -> None:
+        # Хранилище при сбросе очищает и данные (в том числе при with_data=False), поэтому это тот же set_state(None)
+        await self.set_state(key, None)
+
+    def stats(self) -> Dict[str, float]:
+        """Счетчики кэша: записей, измененных, попаданий, промахов, сохранений."""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'dirty': sum(1 for entry in self._entries.values() if entry.dirty),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'flushes': self.flushes,
+        }
+
+    async def close(self) -> None:
+        """Останавливает периодическую запись, сохраняет все изменения и закрывает хранилище."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        try:
+            await self.flush_all()
+        finally:
+            await self.backend.close()
+
+    async def wait_closed(self) -> None:
+        await self.backend.wait_closed()
+
+
+class MemoryFSMStorage(FSMStorage):
+    """
+    Хранилище состояний FSM в памяти процесса: без запросов к БД, для установки на одном узле и для тестов.
+    Состояния и данные теряются при перезапуске бота.
+    """
+
+    def __init__(self):
+        self._records: Dict[Tuple[int, int], Tuple[Optional[str], Dict[str, Any], float]] = {} # (состояние, данные, время изменения)
+
+    @staticmethod
+    def _key(key: StorageKey) -> Tuple[int, int]:
+        return key.chat_id, key.user_id
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._records.get(self._key(key))
+        return record[0] if record else None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if hasattr(state, 'state') else state
+        if state:
+            record = self._records.get(self._key(key))
+            self._records[self._key(key)] = (state, record[1] if record else {}, time.time())
+        else:
+            self._records.pop(self._key(key), None)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._records.get(self._key(key))
+        return copy.deepcopy(record[1]) if record else {}
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = self._records.get(self._key(key))
+        self._records[self._key(key)] = (record[0] if record else '', copy.deepcopy(data), time.time())
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        record = self._records.get(self._key(key))
+        merged = {**(record[1] if record else {}), **copy.deepcopy(data)}
+        self._records[self._key(key)] = (record[0] if record else '', merged, time.time())
+        return copy.deepcopy(merged)
+
+    async def get_snapshot(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        record = self._records.get(self._key(key))
+        return (record[0], copy.deepcopy(record[1])) if record else (None, {})
+
+    async def set_snapshot(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]) -> None:
+        if state is None and not data:
+            self._records.pop(self._key(key), None)
+        else:
+            self._records[self._key(key)] = (state, copy.deepcopy(data), time.time())
+
+    async def reset_state(self, key: StorageKey, with_data: bool = True) -> None:
+        if with_data:
+            self._records.pop(self._key(key), None)
+        elif self._key(key) in self._records:
+            self._records[self._key(key)] = (None, {}, time.time())
+
+    async def sweep_expired(self, ttl_days: int = FSM_STATE_TTL_DAYS, batch_size: int = FSM_SWEEP_BATCH_SIZE) -> int:
+        cutoff = time.time() - ttl_days * 86400
+        expired = [record_key for record_key, record in self._records.items() if record[2] < cutoff]
+        for record_key in expired:
+            del self._records[record_key]
+        return len(expired)
+
+    async def close(self) -> None:
+        self._stop_sweeping()
+
+    async def wait_closed(self) -> None:
+        pass
+
+
+# Таблица состояний FSM в SQLite: та же схема, что и в PostgreSQL, данные - текст JSON, время изменения - unix time
+SQLITE_FSM_SCHEMA_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        chat_id INTEGER,
+        user_id INTEGER,
+        state TEXT,
+        data TEXT NOT NULL DEFAULT '{}',
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (chat_id, user_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS fsm_states_updated_at_idx ON fsm_states (updated_at)",
+)
+
+
+class SQLiteFSMStorage(FSMStorage):
+    """
+    Хранилище состояний FSM в файле SQLite (журнал WAL): для установки на одном узле без отдельной БД PG_FSM_DBNAME.
+    Запросы выполняются в отдельном потоке хранилища (по одному, на одном соединении), а не в цикле событий:
+    если файл заблокирован другим процессом, до FSM_SQLITE_BUSY_TIMEOUT секунд ждет только этот поток.
+    Без блокировки запись по первичному ключу занимает микросекунды, а synchronous=NORMAL в режиме WAL
+    не ждет записи на диск при каждой фиксации.
+    """
+
+    def __init__(self, path: str = FSM_SQLITE_PATH, busy_timeout: float = FSM_SQLITE_BUSY_TIMEOUT):
+        self.path: str = path
+        self.busy_timeout: float = busy_timeout
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def initialize(self):
+        """Открывает файл БД, включает WAL и создает таблицу."""
+        if self._executor is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm-sqlite') # Соединение используется одним потоком
+        await self._run(self._open)
+        logging.info(f"Хранилище FSM SQLite открыто: {self.path}.")
+        self._start_sweeping()
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None) # Автофиксация: каждый запрос - своя транзакция
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SQLITE_FSM_SCHEMA_SQL:
+            self._conn.execute(statement)
+
+    async def _run(self, func, *args):
+        """Выполняет func в потоке хранилища, не блокируя цикл событий."""
+        if self._executor is None:
+            raise RuntimeError("SQLiteFSMStorage не инициализировано: вызовите await initialize().")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _fetch(self, key: StorageKey) -> Optional[Tuple[Optional[str], Dict[str, Any]]]:
+        row = self._conn.execute("SELECT state, data FROM fsm_states WHERE chat_id = ? AND user_id = ?",
+                                 (key.chat_id, key.user_id)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def _delete(self, key: StorageKey):
+        self._conn.execute("DELETE FROM fsm_states WHERE chat_id = ? AND user_id = ?", (key.chat_id, key.user_id))
+
+    def _upsert_state(self, key: StorageKey, state: str):
+        self._conn.execute("""
+            INSERT INTO fsm_states (chat_id, user_id, state, data, updated_at) VALUES (?, ?, ?, '{}', ?)
+            ON CONFLICT (chat_id, user_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+        """, (key.chat_id, key.user_id, state, time.time()))
+
+    def _upsert_data(self, key: StorageKey, data: Dict[str, Any]):
+        self._conn.execute("""
+            INSERT INTO fsm_states (chat_id, user_id, state, data, updated_at) VALUES (?, ?, '', ?, ?)
+            ON CONFLICT (chat_id, user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+        """, (key.chat_id, key.user_id, json.dumps(data), time.time()))
+
+    def _merge_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Дописывает ключи data к данным пользователя в одной транзакции BEGIN IMMEDIATE: файл может
+        использовать и другой процесс, а слияние (как и data || ... в PostgreSQL) - поверхностное.
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            record = self._fetch(key)
+            merged = {**(record[1] if record else {}), **data}
+            self._upsert_data(key, merged)
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        return merged
+
+    def _set_snapshot(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        if state is None and not data:
+            self._delete(key)
+        else:
+            self._conn.execute("""
+                INSERT INTO fsm_states (chat_id, user_id, state, data, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (chat_id, user_id) DO UPDATE
+                SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+            """, (key.chat_id, key.user_id, state, json.dumps(data), time.time()))
+
+    def _clear(self, key: StorageKey):
+        self._conn.execute("UPDATE fsm_states SET state = NULL, data = '{}', updated_at = ? WHERE chat_id = ? AND user_id = ?",
+                           (time.time(), key.chat_id, key.user_id))
+
+    def _sweep_batch(self, cutoff: float, batch_size: int) -> int:
+        return self._conn.execute("""
+            DELETE FROM fsm_states WHERE rowid IN (
+                SELECT rowid FROM fsm_states WHERE updated_at < ? ORDER BY updated_at LIMIT ?
+            )
+        """, (cutoff, batch_size)).rowcount
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        try:
+            record = await self._run(self._fetch, key)
+            return record[0] if record else None
+        except sqlite3.Error as e:
+            logging.error(f"Ошибка при получении состояния пользователя {key.user_id} в чате {key.chat_id}: {e}")
+            return None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if hasattr(state, 'state') else state
+        try:
+            if state:
+                await self._run(self._upsert_state, key, state)
+            else:
+                await self._run(self._delete, key)
+        except sqlite3.Error as e:
+            logging.error(f"Ошибка при установке состояния пользователя {key.user_id} в чате {key.chat_id}: {e}")
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        try:
+            record = await self._run(self._fetch, key)
+            return record[1] if record else {}
+        except sqlite3.Error as e:
+            logging.error(f"Ошибка при получении данных пользователя {key.user_id} в чате {key.chat_id}: {e}")
+            return {}
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        try:
+            await self._run(self._upsert_data, key, data)
+        except sqlite3.Error as e:
+            logging.error(f"Ошибка при установке данных пользователя {key.user_id} в чате {key.chat_id}: {e}")
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Дописывает ключи data к данным пользователя (см. _merge_data). Возвращает итоговые данные."""
+        try:
+            return await self._run(self._merge_data, key, data)
+        except sqlite3.Error as e:
+            logging.error(f"Ошибка при обновлении данных пользователя {key.user_id} в чате {key.chat_id}: {e}")
+            return {}
+
+    async def get_snapshot(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        try:
+            return await self._run(self._fetch, key) or (None, {})
+        except sqlite3.Error as e:
+            logging.error(f"Ошибка при получении состояния и данных пользователя {key.user_id} в чате {key.chat_id}: {e}")
+            return None, {}
+
+    async def set_snapshot(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]) -> None:
+        try:
+            await self._run(self._set_snapshot, key, state, data)
+        except sqlite3.Error as e:
+            logging.error(f"Ошибка при записи состояния и данных пользователя {key.user_id} в чате {key.chat_id}: {e}")
+
+    async def reset_state(self, key: StorageKey, with_data: bool = True) -> None:
+        try:
+            await self._run(self._delete if with_data else self._clear, key)
+        except sqlite3.Error as e:
+            logging.error(f"Ошибка при сбросе состояния пользователя {key.user_id} в чате {key.chat_id}: {e}")
+
+    async def sweep_expired(self, ttl_days: int = FSM_STATE_TTL_DAYS, batch_size: int = FSM_SWEEP_BATCH_SIZE) -> int:
+        """Удаляет записи, не изменявшиеся дольше ttl_days дней, пачками по batch_size. Возвращает число удаленных."""
+        cutoff = time.time() - ttl_days * 86400
+        deleted = 0
+        while True:
+            try:
+                count = await self._run(self._sweep_batch, cutoff, batch_size) # Между пачками поток свободен для других запросов
+            except sqlite3.Error as e:
+                logging.error(f"Ошибка при удалении устаревших состояний FSM: {e}")
+                break
+            deleted += count
+            if count < batch_size:
+                break
+        if deleted:
+            logging.info(f"Удалено устаревших состояний FSM: {deleted}.")
+        return deleted
+
+    async def close(self) -> None:
+        """Останавливает удаление устаревших состояний, закрывает файл БД и поток хранилища."""
+        self._stop_sweeping()
+        if self._executor is not None:
+            if self._conn is not None:
+                await self._run(self._conn.close)
+                self._conn = None
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            logging.info("Хранилище FSM SQLite закрыто.")
+
+    async def wait_closed(self) -> None:
+        pass
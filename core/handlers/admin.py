@@ -11,6 +11,7 @@ import logging
 
 from core.utils import dependencies
 from core.classes import User, DatabaseError, RecordNotFoundError, DuplicateRecordError
+from core.sql import run_in_thread
 
 router = Router()
 
@@ -21,11 +22,11 @@ class AdminState(StatesGroup):
     # waiting_for_director_for_assistant - удалено, теперь директор выбирается через callback
 
 
-def is_admin(user_id: int) -> bool:
+async def is_admin(user_id: int) -> bool:
     """
     Проверяет, является ли пользователь администратором, проверяя его роль в БД.
     """
-    user = User.get_by_id(user_id)
+    user = await User.aget_by_id(user_id)
     if user and user.id_role == User.ROLE_ADMIN:
         return True
     return False
@@ -38,7 +39,7 @@ async def cmd_add_director(message: types.Message, state: FSMContext):
     Ожидает пересылку сообщения от пользователя, которого нужно назначить директором.
     Проверяет права администратора через БД.
     """
-    if not is_admin(message.from_user.id): # Используем функцию is_admin, проверяющую БД
+    if not await is_admin(message.from_user.id): # Используем функцию is_admin, проверяющую БД
         return await message.answer("Только администраторы могут использовать эту команду.")
 
     await state.set_state(AdminState.waiting_for_director_forward)
@@ -52,11 +53,11 @@ async def cmd_add_assistant(message: types.Message, state: FSMContext):
     Сначала предлагает выбрать директора из списка.
     Проверяет права администратора через БД.
     """
-    if not is_admin(message.from_user.id): # Используем функцию is_admin, проверяющую БД
+    if not await is_admin(message.from_user.id): # Используем функцию is_admin, проверяющую БД
         return await message.answer("Только администраторы могут использовать эту команду.")
 
     await state.set_state(AdminState.choosing_director_for_assistant) # Переходим к состоянию выбора директора
-    directors = User.get_all_directors() # Получаем список всех директоров из БД
+    directors = await run_in_thread(User.get_all_directors) # Получаем список всех директоров из БД
     if directors:
         markup = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text=d.fio, callback_data=f"choose_director_{d.id}")]
@@ -92,11 +93,11 @@ async def process_director_forward(message: types.Message, state: FSMContext):
     if forward_from:
         director_user_id = forward_from.id
         try:
-            user = User.get_or_create(director_user_id)
+            user = await User.aget_or_create(director_user_id)
             if user.id_role != User.ROLE_ASSISTANT:
                 await message.answer(f"Пользователь с ID {director_user_id} уже имеет роль '{'директор' if user.id_role == User.ROLE_DIRECTOR else 'админ' if user.id_role == User.ROLE_ADMIN else 'ассистент' }'. Роль директора не назначена.")
             else:
-                User.set_role(director_user_id, User.ROLE_DIRECTOR)
+                await run_in_thread(User.set_role, director_user_id, User.ROLE_DIRECTOR)
                 await message.answer(f"Пользователь с ID {director_user_id} назначен директором.")
             await state.clear()
         except DuplicateRecordError: # Не должен возникать, но на всякий случай
@@ -129,12 +130,12 @@ async def process_assistant_forward(message: types.Message, state: FSMContext):
             return await state.clear()
 
         try:
-            assistant = User.get_or_create(assistant_user_id) # Получаем или создаем ассистента
+            assistant = await User.aget_or_create(assistant_user_id) # Получаем или создаем ассистента
             if assistant.id_chief != 0: # Проверка, чтобы не переназначить директора
                 await message.answer(f"У ассистента с ID {assistant_user_id} уже назначен директор. Назначение не выполнено.")
             else:
                 assistant.id_chief = chosen_director_id # Устанавливаем id_chief (ID выбранного директора)
-                assistant.update() # Обновляем данные ассистента в БД
+                await assistant.aupdate() # Обновляем данные ассистента в БД
                 await message.answer(f"Ассистент с ID {assistant_user_id} назначен директору с ID {chosen_director_id}.")
             await state.clear()
         except RecordNotFoundError: # Хотя get_or_create не должен вызывать RecordNotFoundError
@@ -146,4 +147,31 @@ async def process_assistant_forward(message: types.Message, state: FSMContext):
             await state.clear()
     else:
         await message.answer("Не удалось получить ID пользователя из пересланного сообщения ассистента. Убедитесь, что пересылаете сообщение от пользователя.")
-        await state.clear()
\ No newline at end of file
+        await state.clear()
+
+@router.message(Command("pool_stats"))
+async def cmd_pool_stats(message: types.Message):
+    """
+    Обработчик команды /pool_stats.
+    Показывает администратору счетчики пула соединений с БД.
+    """
+    if not await is_admin(message.from_user.id):
+        return await message.answer("Только администраторы могут использовать эту команду.")
+
+    stats = dependencies.db_manager.pool_stats()
+    if not stats:
+        return await message.answer("Пул соединений еще не создан.")
+    statements = dependencies.db_manager.statement_stats()
+    replica = dependencies.db_manager.replica_pool_stats()
+    replica_line = (f"\nПул реплики: открыто {replica['size']} из {replica['max_size']}, занято {replica['in_use']}, "
+                    f"выдано соединений: {replica['acquired']}, таймаутов: {replica['timeouts']}." if replica else "")
+    await message.answer(
+        f"Пул соединений: открыто {stats['size']} из {stats['max_size']}, занято {stats['in_use']}, свободно {stats['idle']}, ожидают {stats['waiting']}.\n"
+        f"Выдано соединений: {stats['acquired']}, таймаутов: {stats['timeouts']}.\n"
+        f"Ожидание соединения: среднее {stats['acquire_time_avg_ms']:.1f} мс, максимальное {stats['acquire_time_max_ms']:.1f} мс.\n"
+        f"Открыто соединений: {stats['created']}, закрыто неисправных: {stats['discarded']}, проверок простаивавших: {stats['health_checks']}.\n"
+        f"Кэш запросов: {statements['statements']} запросов, попаданий {statements['hit_rate']:.0%} ({statements['hits']} из {statements['hits'] + statements['misses']}).\n"
+        f"Подготовлено на сервере (PREPARE): {statements['prepares']}, среднее время подготовки {statements['prepare_time_avg_ms']:.1f} мс, "
+        f"выполнено подготовленных: {statements['prepared_executions']}."
+        + replica_line
+    )
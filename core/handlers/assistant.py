@@ -2,12 +2,14 @@ from aiogram import Router, F
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from core.classes import User, Reservation, Device, Protocol, StandartTask
+from core.classes import User, Reservation, Device, Protocol, StandartTask, DatabaseError
 from core.keyboards.keyboards import assistant_keyboard
 from datetime import date, datetime, time, timedelta
 import logging
 from core.utils import dependencies
 from core.config import WORKING_DAY_START,  WORKING_DAY_END
+from core.scheduling.delay import apply_delay
+from core.sql import TransactionAbortedError, run_in_thread
 
 router = Router()
 
@@ -28,6 +30,36 @@ def is_assistant(user_id: int) -> bool:
     return False
 
 
+def add_assistant_to_reservations(reservations: list[Reservation], user_id: int, day: date) -> bool:
+    """
+    Добавляет ассистента к резервациям протокола на day одной транзакцией.
+    Возвращает True, если ассистент добавлен хотя бы к одной резервации.
+    """
+    added = False
+    with dependencies.db_manager.transaction(): # Все резервации протокола обновляются одной транзакцией
+        for reservation in reservations:
+            if reservation.start_date and reservation.start_date.date() == day:
+                if user_id not in reservation.assistants:
+                    reservation.assistants.append(user_id)
+                    reservation.update()
+                    added = True
+    return added
+
+
+def remove_assistant_from_reservations(reservations: list[Reservation], user_id: int) -> bool:
+    """
+    Удаляет ассистента из резерваций протокола одной транзакцией.
+    Возвращает True, если ассистент был привязан хотя бы к одной резервации.
+    """
+    removed = False
+    with dependencies.db_manager.transaction(): # Все резервации протокола обновляются одной транзакцией
+        for reservation in reservations:
+            if user_id in reservation.assistants:
+                reservation.remove_assistant(user_id) # Удаляем ассистента из списка и обновляем резервацию
+                removed = True
+    return removed
+
+
 async def format_assistant_task_info(reservation: Reservation) -> str:
     """
     Функция для формирования информации о задаче для ассистента в расписании.
@@ -35,7 +67,7 @@ async def format_assistant_task_info(reservation: Reservation) -> str:
     task_name = reservation.name_task
     start_time = reservation.start_date.strftime("%H:%M") if reservation.start_date else "Не задано"
     end_time = reservation.end_date.strftime("%H:%M") if reservation.end_date else "Не задано"
-    device = Device.get_by_id(reservation.id_device)
+    device = await Device.aget_by_id(reservation.id_device)
     cabinet_name = device.name_cabinet if device else "Неизвестно"
     device_name = device.name if device else "Неизвестно"
     protocol_name = reservation.type_protocol
@@ -78,7 +110,7 @@ async def wrapper_cmd_show_protocols_to_add(message: Message, state: FSMContext)
     """
     user_id = message.from_user.id
     # Проверяем, есть ли у ассистента уже протокол на сегодня
-    existing_protocol = Reservation.find_by_assistant_and_date(user_id, date.today())
+    existing_protocol = await Reservation.afind_by_assistant_and_date(user_id, date.today())
 
     if existing_protocol:
         await message.answer("Вы уже добавили протокол на сегодня. Для просмотра вашего расписания нажмите кнопку 'Мое расписание'.", reply_markup=assistant_keyboard(has_protocol=True)) # Изменим клавиатуру
@@ -101,7 +133,7 @@ async def cmd_show_protocols_to_add(state: FSMContext, user_id):
     #     return await dependencies.bot.edit_message_text(chat_id=user_id, message_id=msg_id_protocol_to_add, text="Только ассистенты могут использовать эту команду.")
 
     await state.set_state(AssistantState.choosing_protocol_to_add)
-    all_protocol_reservations_by_number = Reservation.get_all_by_today_with_protocol_numbers() # Получаем все протоколы на день
+    all_protocol_reservations_by_number = await run_in_thread(Reservation.get_all_by_today_with_protocol_numbers) # Получаем все протоколы на день
 
     available_protocols = []
     for number_protocol, reservations in all_protocol_reservations_by_number:
@@ -131,7 +163,7 @@ async def callback_show_protocol_info(query: CallbackQuery, state: FSMContext):
     """
     number_protocol = int(query.data.split("_")[3])
 
-    protocol_reservations_by_number = Reservation.get_all_by_today_with_protocol_numbers()
+    protocol_reservations_by_number = await run_in_thread(Reservation.get_all_by_today_with_protocol_numbers)
     selected_reservations = []
     for protocol_num, reservations in protocol_reservations_by_number:
         if protocol_num == number_protocol:
@@ -169,7 +201,7 @@ async def callback_confirm_add_protocol(query: CallbackQuery, state: FSMContext)
     if number_protocol is None:
         return await query.message.edit_text("Ошибка: номер протокола не найден.", show_alert=True)
 
-    protocol_reservations_by_number = Reservation.get_all_by_today_with_protocol_numbers()
+    protocol_reservations_by_number = await run_in_thread(Reservation.get_all_by_today_with_protocol_numbers)
     selected_reservations = []
     protocol_type_name = ""
 
@@ -183,13 +215,11 @@ async def callback_confirm_add_protocol(query: CallbackQuery, state: FSMContext)
     if not selected_reservations:
         return await query.message.edit_text(f"Брони для протокола №{number_protocol} не найдены.", show_alert=True)
 
-    added_to_protocol = False
-    for reservation in selected_reservations:
-        if reservation.start_date and reservation.start_date.date() == today_date:
-            if user_id not in reservation.assistants:
-                reservation.assistants.append(user_id)
-                reservation.update()
-                added_to_protocol = True
+    try:
+        added_to_protocol = await run_in_thread(add_assistant_to_reservations, selected_reservations, user_id, today_date)
+    except (DatabaseError, TransactionAbortedError) as e:
+        logging.error(f"Ошибка при добавлении ассистента {user_id} к протоколу №{number_protocol}: {e}")
+        return await query.message.edit_text("Не удалось добавить вас к протоколу. Попробуйте еще раз.")
 
     if added_to_protocol:
         await query.message.edit_text(f"Вы добавлены к протоколу №{number_protocol} ({protocol_type_name}) на сегодня.") # Передаем has_protocol=True
@@ -222,7 +252,7 @@ async def cmd_view_my_schedule(message: Message, state: FSMContext):
 
     user_id = message.from_user.id
     today_date = date.today()
-    reservations_today = Reservation.find_by_assistant_and_date(user_id, today_date)
+    reservations_today = await Reservation.afind_by_assistant_and_date(user_id, today_date)
 
     schedule_info = f"<b>Ваше расписание на {today_date.strftime('%d.%m.%Y')}:</b>\n\n"
     tasks_info = []
@@ -281,123 +311,30 @@ async def cmd_view_my_schedule(message: Message, state: FSMContext):
 async def callback_delay_task(query: CallbackQuery, state: FSMContext):
     """
     Обработчик кнопки "Опоздание - 10 минут".
-    ПЕРЕЗАПИСЫВАЕТ все расписание на день, с учетом увеличенного времени задачи.
-    Исправленная версия, учитывающая ошибки и требования пользователя.
+    Продлевает задачу на 10 минут и сдвигает только зависящие от нее резервации:
+    следующие задачи того же протокола и конфликтующие резервации на тех же устройствах.
+    Чтение, расчет сдвигов и запись выполняются одной транзакцией с блокировкой резерваций (см. apply_delay).
     """
     reservation_id = int(query.data.split("_")[2])
-    delayed_reservation = Reservation.get_by_id(reservation_id)
-    if not delayed_reservation:
+    logging.info(f"Нажата кнопка 'Опоздание' для задачи ID: {reservation_id}")
+    try:
+        changed_reservations = await run_in_thread(apply_delay, reservation_id, timedelta(minutes=10))
+    except DatabaseError as e:
+        logging.error(f"Ошибка базы данных при сдвиге расписания: {e}")
+        await query.message.edit_text("Произошла ошибка при сдвиге расписания. Попробуйте позже.")
+        return await query.answer()
+    if not changed_reservations:
         return await query.message.edit_text("Задача не найдена.", show_alert=True)
+    delayed_reservation = changed_reservations[0]
+
+    logging.info(f"Задача ID: {reservation_id} продлена на 10 минут, сдвинуто резерваций: {len(changed_reservations) - 1}")
 
-    logging.info(f"Нажата кнопка 'Опоздание' для задачи ID: {reservation_id}, задача: {delayed_reservation.name_task}, протокол: {delayed_reservation.type_protocol}")
-
-    # 1. Увеличиваем время задержанной задачи в памяти и БД
-    delayed_reservation.delay_task(10)
-    logging.info(f"Время задачи ID: {reservation_id} увеличено на 10 минут. Новое время окончания: {delayed_reservation.end_date}")
-
-    # 2. Получаем все протоколы на сегодня (вместе с резервациями, сгруппированные по номеру протокола)
-    all_protocols_today_reservations = Reservation.get_all_by_today_with_protocol_numbers()
-    if not all_protocols_today_reservations:
-        return await query.message.edit_text("На сегодня нет запланированных протоколов.")
-
-    logging.info(f"Получены все протоколы на сегодня: {len(all_protocols_today_reservations)} протоколов")
-
-    # 3. Очищаем все резервации на сегодня из БД
-    Reservation.delete_all_by_today()
-    logging.info("Все резервации на сегодня удалены из БД для перепланирования.")
-
-    await query.message.edit_text("Расписание на сегодня перепланируется с учетом задержки...")
-
-    total_tasks_rescheduled = 0
-    tasks_not_scheduled = []
-    next_protocol_number = 1  # Начинаем нумерацию протоколов с 1
-
-    # 4. Перепланируем все протоколы заново
-    for protocol_number, protocol_reservations in all_protocols_today_reservations:
-        protocol_name = protocol_reservations[0].type_protocol # Имя протокола берем из первой резервации списка
-        protocol = Protocol.get_by_name(protocol_name)
-        if not protocol:
-            logging.warning(f"Протокол '{protocol_name}' не найден, пропуск.")
-            continue
-
-        standart_tasks_names = protocol.list_standart_tasks
-        current_task_start_time = datetime.combine(date.today(), WORKING_DAY_START) # **Начинаем с начала рабочего дня для каждого протокола!**
-        schedule_end_datetime = datetime.combine(date.today(), WORKING_DAY_END)
-
-        logging.info(f"Перепланирование протокола '{protocol_name}', номер протокола: {protocol_number}")
-
-        for task_name in standart_tasks_names:
-            standart_task = StandartTask.get_by_name(task_name)
-            if not standart_task:
-                logging.warning(f"Стандартная задача '{task_name}' не найдена, пропуск.")
-                tasks_not_scheduled.append(task_name)
-                continue
-
-            task_duration = standart_task.time_task
-            if task_duration is None:
-                logging.warning(f"Для задачи '{task_name}' не указано время выполнения, пропуск.")
-                tasks_not_scheduled.append(task_name)
-                continue
-
-            device_type = standart_task.type_device
-
-            available_slot_found = False
-            schedule_attempt_time = current_task_start_time
-
-            logging.info(f"Поиск слота для задачи '{task_name}', длительность: {task_duration}, type_device: {device_type}")
-
-            while schedule_attempt_time + task_duration <= schedule_end_datetime:
-                available_device = Device.find_available_device_by_type_and_time(
-                    type_device=device_type,
-                    start_time=schedule_attempt_time,
-                    end_time=schedule_attempt_time + task_duration
-                )
-                if available_device:
-                    device_id = available_device.id
-                    task_end_time = schedule_attempt_time + task_duration
-
-                    # **Важно**: Создаем НОВУЮ резервацию для каждой задачи, даже для задержанной, чтобы пересчитать время
-                    reservation_to_reschedule = Reservation(
-                        type_protocol=protocol_name,
-                        name_task=task_name,
-                        id_device=device_id,
-                        number_protocol=next_protocol_number # Используем текущий номер протокола
-                    )
-
-                    reservation_to_reschedule.id_device = device_id
-                    reservation_to_reschedule.start_date = schedule_attempt_time
-                    reservation_to_reschedule.end_date = task_end_time
-                    reservation_to_reschedule.assistants = protocol_reservations[0].assistants
-
-                    # **Специальная обработка для задержанной задачи**: Проверяем ID, а не имя задачи
-                    if (delayed_reservation.number_protocol == protocol_number) and (task_name == delayed_reservation.name_task) and (protocol_name == delayed_reservation.type_protocol):
-                        reservation_to_reschedule = delayed_reservation # Используем УЖЕ задержанную резервацию, но нужно пересчитать время начала/конца
-
-                    reservation_id_added = reservation_to_reschedule.add(next_protocol_number) # Добавляем в БД и получаем ID
-                    if reservation_id_added:
-                        total_tasks_rescheduled += 1
-                        logging.info(f"Задача '{task_name}' (ID: {reservation_id_added}) запланирована на {schedule_attempt_time.strftime('%H:%M')}-{task_end_time.strftime('%H:%M')}, устройство ID: {device_id}")
-                    else:
-                        logging.error(f"Не удалось добавить резервацию для задачи '{task_name}'.")
-                        tasks_not_scheduled.append(task_name)
-
-                    current_task_start_time = reservation_to_reschedule.end_date
-                    available_slot_found = True
-                    break # Переходим к следующей задаче протокола
-                else:
-                    schedule_attempt_time += timedelta(minutes=5)
-                    if schedule_attempt_time.time() > WORKING_DAY_END:
-                        break
-
-            if not available_slot_found:
-                logging.warning(f"Не удалось запланировать задачу '{task_name}' из протокола '{protocol_name}'. Нет доступного времени/устройств.")
-                tasks_not_scheduled.append(task_name)
-        next_protocol_number += 1 # Увеличиваем номер протокола для следующего протокола в списке
-
-    message_text = f"✅ Расписание на сегодня полностью перепланировано. Успешно запланировано {total_tasks_rescheduled} задач."
-    if tasks_not_scheduled:
-        not_scheduled_tasks_str = "\n".join([f"- {task_name}" for task_name in tasks_not_scheduled])
-        message_text += f"\n\n⚠️ Не удалось запланировать следующие задачи:\n{not_scheduled_tasks_str}"
+    message_text = f"✅ Задача '{delayed_reservation.name_task}' продлена до {delayed_reservation.end_date.strftime('%H:%M')}. Сдвинуто зависимых задач: {len(changed_reservations) - 1}."
+    schedule_end_datetime = datetime.combine(date.today(), WORKING_DAY_END)
+    overflow_tasks = [r for r in changed_reservations if r.end_date > schedule_end_datetime]
+    if overflow_tasks:
+        overflow_tasks_str = "\n".join([f"- {r.name_task} (протокол №{r.number_protocol}, до {r.end_date.strftime('%H:%M')})" for r in overflow_tasks])
+        message_text += f"\n\n⚠️ Следующие задачи теперь выходят за пределы рабочего дня:\n{overflow_tasks_str}"
 
     await query.message.edit_text(message_text)
 
@@ -414,7 +351,7 @@ async def callback_return_protocol(query: CallbackQuery, state: FSMContext):
     number_protocol = int(query.data.split("_")[2])
     user_id = query.from_user.id
 
-    protocol_reservations_by_number = Reservation.get_all_by_today_with_protocol_numbers()
+    protocol_reservations_by_number = await run_in_thread(Reservation.get_all_by_today_with_protocol_numbers)
     selected_reservations = []
     for protocol_num, reservations in protocol_reservations_by_number:
         if protocol_num == number_protocol:
@@ -424,12 +361,11 @@ async def callback_return_protocol(query: CallbackQuery, state: FSMContext):
     if not selected_reservations:
         return await query.message.edit_text(f"Резервации для протокола №{number_protocol} не найдены.", show_alert=True)
 
-    protocol_returned = False
-    for reservation in selected_reservations:
-        if user_id in reservation.assistants:
-            reservation.remove_assistant(user_id) # Удаляем ассистента из списка
-            reservation.update()
-            protocol_returned = True
+    try:
+        protocol_returned = await run_in_thread(remove_assistant_from_reservations, selected_reservations, user_id)
+    except (DatabaseError, TransactionAbortedError) as e:
+        logging.error(f"Ошибка при возврате протокола №{number_protocol} ассистентом {user_id}: {e}")
+        return await query.message.edit_text("Не удалось вернуть протокол. Попробуйте еще раз.")
 
     if protocol_returned:
         await query.message.edit_text(f"Протокол №{number_protocol} возвращен в общий список.") # Возвращаем обычную клавиатуру
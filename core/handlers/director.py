@@ -13,9 +13,13 @@ from aiogram import Router
 import logging
 
 from core.utils import dependencies
-from core.classes import User, DatabaseError, RecordNotFoundError, DuplicateRecordError, Cabinet, Device, StandartTask, Protocol, Reservation
+from core.classes import User, DatabaseError, RecordNotFoundError, DuplicateRecordError, ScheduleConflictError, Cabinet, Device, StandartTask, Protocol, Reservation
 from core.keyboards.keyboards import director_keyboard, add_menu_keyboard # Импорт клавиатуры директора
-from core.config import WORKING_DAY_END, WORKING_DAY_START
+from core.config import WORKING_DAY_END, WORKING_DAY_START, SCHEDULE_OPTIMIZER_TIME_BUDGET
+from core.scheduling.engine import ProtocolPlan, ScheduleEngine
+from core.scheduling import planner
+from core.scheduling.optimizer import MakespanOptimizer
+from core.sql import run_in_thread
 
 router = Router()
 
@@ -27,6 +31,7 @@ class DirectorState(StatesGroup):
 
     choosing_cabinet_for_device = State() 
     waiting_for_device_name = State()
+    waiting_for_device_capacity = State() # Ожидание вместимости устройства (сколько параллельных задач одновременно)
 
     choosing_cabinet_for_task = State() # Новое состояние - выбор кабинета для задачи
     choosing_device_for_task = State() # Новое состояние - выбор устройства для задачи
@@ -40,8 +45,10 @@ class DirectorState(StatesGroup):
 
     # Добавляем состояния для расписания
     choosing_protocol_for_schedule = State()  # Состояние выбора протокола
+    confirming_schedule_plan = State() # Состояние предпросмотра плана протокола перед записью
     waiting_for_schedule_date = State()  # Состояние ожидания даты выполнения
     choosing_protocol_to_view_schedule = State() # Состояние выбора протокола для просмотра расписания
+    choosing_protocols_for_batch = State() # Состояние выбора набора протоколов для пакетного планирования
 
 def is_director(user_id: int) -> bool:
     """
@@ -91,12 +98,12 @@ async def process_assistant_forward_director(message: Message, state: FSMContext
             return await state.clear()
 
         try:
-            assistant = User.get_or_create(assistant_user_id) # Получаем или создаем ассистента
+            assistant = await User.aget_or_create(assistant_user_id) # Получаем или создаем ассистента
             if assistant.id_chief != 0: # Проверка, чтобы не переназначить директора
                 await message.answer(f"У ассистента с ID {assistant_user_id} уже назначен директор. Назначение не выполнено.")
             else:
                 assistant.id_chief = chosen_director_id # Устанавливаем id_chief (ID текущего директора)
-                assistant.update() # Обновляем данные ассистента в БД
+                await assistant.aupdate() # Обновляем данные ассистента в БД
                 await message.answer(f"Ассистент с ID {assistant_user_id} назначен вам (директору с ID {chosen_director_id}).")
             await state.clear()
         except RecordNotFoundError: # Хотя get_or_create не должен вызывать RecordNotFoundError
@@ -167,7 +174,7 @@ async def process_cabinet_name(message: Message, state: FSMContext):
     
     try:
         cabinet = Cabinet(name=cabinet_name)
-        cabinet.add() # Добавляем кабинет в БД
+        await cabinet.aadd() # Добавляем кабинет в БД
         await dependencies.bot.edit_message_text(chat_id=message.chat.id, message_id=msg_id_add_cabinet, text=f"Кабинет '{cabinet_name}' успешно добавлен.")
         await state.clear()
     except DuplicateRecordError: # Обработка ошибки, если кабинет с таким именем уже существует
@@ -205,7 +212,7 @@ async def cmd_add_device_director_callback(query: CallbackQuery, state: FSMConte
     #     return await query.message.answer("Только директора могут использовать эту команду.")
 
     await state.set_state(DirectorState.choosing_cabinet_for_device)  # Переход в состояние выбора кабинета для устройства
-    cabinets = Cabinet.get_all()  # Получаем список всех кабинетов из БД
+    cabinets = await run_in_thread(Cabinet.get_all)  # Получаем список всех кабинетов из БД
 
     if cabinets:
         markup = InlineKeyboardMarkup(inline_keyboard=[
@@ -241,40 +248,62 @@ async def callback_choose_cabinet_for_device(query: CallbackQuery, state: FSMCon
 async def process_device_name(message: Message, state: FSMContext):
     """
     Обработчик получения названия устройства от директора.
-    Создает и добавляет новое устройство в БД, привязанное к выбранному кабинету.
+    Сохраняет название и запрашивает вместимость устройства.
     """
     device_name = message.text.strip()
     state_data = await state.get_data()
+    msg_id_add_device = state_data.get('msg_id_add_device')
+
+    await state.update_data(device_name=device_name)
+    await state.set_state(DirectorState.waiting_for_device_capacity)
+    await dependencies.bot.edit_message_text(chat_id=message.chat.id, message_id=msg_id_add_device, text=f"Введите вместимость устройства '{device_name}' - сколько параллельных задач оно может выполнять одновременно (1, если устройство занимается одной задачей):")
+    await message.delete()
+
+
+@router.message(DirectorState.waiting_for_device_capacity, F.text) # Обработчик ожидания вместимости устройства
+async def process_device_capacity(message: Message, state: FSMContext):
+    """
+    Обработчик получения вместимости устройства от директора.
+    Создает и добавляет новое устройство в БД, привязанное к выбранному кабинету.
+    """
+    capacity_str = message.text.strip()
+    state_data = await state.get_data()
     chosen_cabinet_name = state_data.get('chosen_cabinet_name') # Получаем название кабинета из FSM
+    device_name = state_data.get('device_name')
 
     msg_id_add_device = state_data.get('msg_id_add_device')
 
-    if not chosen_cabinet_name:
-        await dependencies.bot.edit_message_text(chat_id=message.chat.id, message_id=msg_id_add_device, text="Ошибка: Название кабинета не найдено в текущем состоянии. Попробуйте начать процесс добавления устройства заново.")
+    if not chosen_cabinet_name or not device_name:
+        await dependencies.bot.edit_message_text(chat_id=message.chat.id, message_id=msg_id_add_device, text="Ошибка: Название кабинета или устройства не найдено в текущем состоянии. Попробуйте начать процесс добавления устройства заново.")
         return await state.clear()
 
+    if not capacity_str.isdigit() or int(capacity_str) < 1:
+        await message.delete()
+        return await dependencies.bot.edit_message_text(chat_id=message.chat.id, message_id=msg_id_add_device, text="Некорректная вместимость. Введите целое число не меньше 1:")
+    capacity = int(capacity_str)
+
     try:
-        cabinet = Cabinet.get_by_name(chosen_cabinet_name) # Находим кабинет по имени
+        cabinet = await Cabinet.aget_by_name(chosen_cabinet_name) # Находим кабинет по имени
         if not cabinet:
             await dependencies.bot.edit_message_text(chat_id=message.chat.id, message_id=msg_id_add_device, text=f"Кабинет с названием '{chosen_cabinet_name}' не найден в базе данных. Попробуйте выбрать кабинет заново.")
             return await state.clear()
 
         # Получаем количество типов устройств, чтобы определить id_device для нового устройства
         # Следующий ID типа устройства будет равен текущему количеству
-        next_device_id = Device.count_device_types() + 1
+        next_device_id = await run_in_thread(Device.count_device_types) + 1
 
         # Проверяем, не существует ли уже устройство с таким именем в этом кабинете
-        existing_device = Device.find_last_by_name(device_name)
+        existing_device = await Device.afind_last_by_name(device_name)
         if existing_device:
             await dependencies.bot.edit_message_text(chat_id=message.chat.id, message_id=msg_id_add_device, text=f"Устройство с названием '{device_name}' уже существует в кабинете '{chosen_cabinet_name}'. Будет добавлено еще один экземпляр прибора.")
             next_device_id = existing_device.type_device
 
 
-        device = Device(type_device=next_device_id, name_cabinet=chosen_cabinet_name, name=device_name) # Создаем объект Device, используя name_cabinet и name
-        added_device_id = device.add() # Добавляем устройство в БД и получаем сгенерированный ID
+        device = Device(type_device=next_device_id, name_cabinet=chosen_cabinet_name, name=device_name, capacity=capacity) # Создаем объект Device, используя name_cabinet и name
+        added_device_id = await device.aadd() # Добавляем устройство в БД и получаем сгенерированный ID
 
         if added_device_id:
-            await dependencies.bot.edit_message_text(chat_id=message.chat.id, message_id=msg_id_add_device, text=f"Устройство '{device_name}' (тип ID Device: {next_device_id}, ID в базе данных: {added_device_id}) успешно добавлено в кабинет '{chosen_cabinet_name}'.") # Сообщаем об успехе и возвращаем клавиатуру директора
+            await dependencies.bot.edit_message_text(chat_id=message.chat.id, message_id=msg_id_add_device, text=f"Устройство '{device_name}' (тип ID Device: {next_device_id}, ID в базе данных: {added_device_id}, вместимость: {capacity}) успешно добавлено в кабинет '{chosen_cabinet_name}'.") # Сообщаем об успехе и возвращаем клавиатуру директора
         else:
             await dependencies.bot.edit_message_text(chat_id=message.chat.id, message_id=msg_id_add_device, text="Не удалось добавить устройство. Произошла ошибка.")
 
@@ -311,7 +340,7 @@ async def cmd_add_task_director_callback(query: CallbackQuery, state: FSMContext
     #     return await query.message.edit_text("Только директора могут использовать эту команду.")
 
     await state.set_state(DirectorState.choosing_cabinet_for_task)  # Переход в состояние выбора кабинета для задачи
-    cabinets = Cabinet.get_all()  # Получаем список всех кабинетов из БД
+    cabinets = await run_in_thread(Cabinet.get_all)  # Получаем список всех кабинетов из БД
 
     if cabinets:
         markup = InlineKeyboardMarkup(inline_keyboard=[
@@ -336,7 +365,7 @@ async def callback_choose_cabinet_for_task(query: CallbackQuery, state: FSMConte
     await state.update_data(chosen_cabinet_name_task=cabinet_name) # Сохраняем название кабинета в FSM
     await state.set_state(DirectorState.choosing_device_for_task) # Переходим к состоянию выбора устройства для задачи
 
-    devices = Device.find_by_name_cabinet(cabinet_name) # Получаем список устройств в выбранном кабинете
+    devices = await run_in_thread(Device.find_by_name_cabinet, cabinet_name) # Получаем список устройств в выбранном кабинете
     if devices:
         markup = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text=d.name, callback_data=f"choose_type_device_task_{d.type_device}")] # Используем ID устройства в callback_data
@@ -425,8 +454,8 @@ async def process_task_time(message: Message, state: FSMContext):
         return await state.clear()
 
     try:
-        cabinet = Cabinet.get_by_name(chosen_cabinet_name_task)
-        device = Device.get_by_type_device(chosen_type_device_task)
+        cabinet = await Cabinet.aget_by_name(chosen_cabinet_name_task)
+        device = await run_in_thread(Device.get_by_type_device, chosen_type_device_task)
         if not cabinet or not device:
             await dependencies.bot.edit_message_text(chat_id=message.chat.id, message_id=msg_id_add_task, text="Ошибка: Кабинет или устройство не найдены в базе данных. Попробуйте выбрать кабинет и устройство заново.")
             return await state.clear()
@@ -447,7 +476,7 @@ async def process_task_time(message: Message, state: FSMContext):
             is_parallel=task_is_parallel,
             time_task=task_timedelta # Передаем timedelta объект
         )
-        standart_task.add()
+        await standart_task.aadd()
         await dependencies.bot.edit_message_text(chat_id=message.chat.id, message_id=msg_id_add_task, text=f"Стандартная задача '{task_name}' (длительность: {task_time_str}) успешно добавлена в кабинет '{chosen_cabinet_name_task}' для устройства '{device.name}'.")
         await state.clear()
     except DuplicateRecordError:
@@ -506,7 +535,7 @@ async def show_tasks_for_protocol_choice(message: Message, state: FSMContext):
     """
     Функция для отображения кнопок выбора стандартных задач для протокола.
     """
-    standart_tasks = StandartTask.get_all()  # Получаем список всех стандартных задач
+    standart_tasks = await run_in_thread(StandartTask.get_all)  # Получаем список всех стандартных задач
     state_data = await state.get_data()
     msg_id_add_protocol = state_data.get('msg_id_add_protocol')
 
@@ -555,7 +584,7 @@ async def callback_protocol_tasks_done(query: CallbackQuery, state: FSMContext):
 
     try:
         protocol = Protocol(name=protocol_name, list_standart_tasks=protocol_tasks)  # Создаем объект Protocol
-        protocol_id = protocol.add()  # Добавляем протокол в БД
+        protocol_id = await protocol.aadd()  # Добавляем протокол в БД
 
         if protocol_id:
             tasks_str = "\n".join([f"- {task_name}" for task_name in protocol_tasks])  # Формируем список задач
@@ -592,7 +621,7 @@ async def cmd_add_to_schedule(message: Message, state: FSMContext):
     #     return await message.answer("Только директора могут использовать эту команду.")
 
     await state.set_state(DirectorState.choosing_protocol_for_schedule) # Переходим в состояние выбора протокола
-    protocols = Protocol.get_all() # Получаем список всех протоколов из БД
+    protocols = await Protocol.aget_all() # Получаем список всех протоколов из БД
 
     if protocols:
         markup = InlineKeyboardMarkup(inline_keyboard=[
@@ -607,89 +636,220 @@ async def cmd_add_to_schedule(message: Message, state: FSMContext):
     await message.delete()
 
 
+def format_plan_preview(plan: ProtocolPlan) -> str:
+    """
+    Формирует текст предпросмотра плана протокола: размещения, статистику и неразмещенные задачи.
+    """
+    today_date = datetime.date.today()
+    message_text = f"📋 План протокола '{plan.type_protocol}': {len(plan.placements)} задач.\n"
+    for placement in plan.placements:
+        day_str = "" if placement.start_date.date() == today_date else f"{placement.start_date.strftime('%d.%m')} "
+        message_text += f"- {day_str}{placement.start_date.strftime('%H:%M')}-{placement.end_date.strftime('%H:%M')} {placement.name_task} (устройство {placement.id_device})\n"
+    if plan.placements:
+        busy_minutes = int(plan.busy_time.total_seconds() // 60)
+        message_text += f"\nНачало: {plan.start_date.strftime('%d.%m %H:%M')}, окончание: {plan.end_date.strftime('%d.%m %H:%M')}, работа оборудования: {busy_minutes // 60} ч {busy_minutes % 60} мин."
+    tasks_by_day = plan.tasks_by_day
+    if any(day != today_date for day in tasks_by_day):
+        days_str = "\n".join([f"- {day.strftime('%d.%m.%Y')}: {count} задач" for day, count in tasks_by_day.items()])
+        message_text += f"\n\nСегодня места не хватает, задачи распределены по дням:\n{days_str}"
+    if plan.tasks_not_scheduled:
+        not_scheduled_tasks_str = "\n".join([f"- {task_name}" for task_name in plan.tasks_not_scheduled])
+        message_text += f"\n\n⚠️ Не удастся запланировать следующие задачи (из-за занятости оборудования, отсутствия данных о времени выполнения или type_device):\n{not_scheduled_tasks_str}"
+    return message_text
+
+
+async def show_plan_preview(query: CallbackQuery, state: FSMContext, protocol_name: str, note: str = ""):
+    """
+    Строит план протокола в памяти (без записи в БД), сохраняет его в FSM и показывает директору
+    с кнопками подтверждения.
+    """
+    try:
+        plan = await run_in_thread(planner.plan, protocol_name, datetime.date.today())
+    except RecordNotFoundError:
+        await query.message.edit_text(f"Протокол '{protocol_name}' не найден.")
+        return await state.clear()
+
+    if not plan.placements:
+        await query.message.edit_text(note + format_plan_preview(plan) + "\n\nНечего добавлять в расписание.")
+        return await state.clear()
+
+    markup = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✅ Подтвердить", callback_data="schedule_plan_confirm"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="schedule_plan_cancel")
+    ]])
+    await state.set_state(DirectorState.confirming_schedule_plan)
+    await state.update_data(schedule_plan=plan.to_dict())
+    await query.message.edit_text(note + format_plan_preview(plan), reply_markup=markup)
+
+
 @router.callback_query(DirectorState.choosing_protocol_for_schedule, F.data.startswith("schedule_protocol_"))
 async def callback_choose_protocol_for_schedule(query: CallbackQuery, state: FSMContext):
     """
     Обработчик callback-запроса после выбора протокола для расписания.
-    Добавляет задачи из выбранного протокола в расписание на текущий день,
-    выбирая свободное устройство (Device) и учитывая занятость.
+    Строит план протокола на текущий день (с переносом на следующие рабочие дни) без записи в БД
+    и показывает его директору для подтверждения.
     """
     protocol_name = query.data.split("_")[2]
-    protocol = Protocol.get_by_name(protocol_name)
+    await show_plan_preview(query, state, protocol_name)
+    await query.answer()
 
-    if not protocol:
-        await query.message.edit_text(f"Протокол '{protocol_name}' не найден.")
+
+@router.callback_query(DirectorState.confirming_schedule_plan, F.data == "schedule_plan_confirm")
+async def callback_confirm_schedule_plan(query: CallbackQuery, state: FSMContext):
+    """
+    Обработчик кнопки "Подтвердить" предпросмотра плана.
+    Записывает план одной транзакцией; если занятость оборудования изменилась, пересчитывает план и показывает его снова.
+    """
+    state_data = await state.get_data()
+    plan_data = state_data.get('schedule_plan')
+    if not plan_data:
+        await query.message.edit_text("План не найден. Выберите протокол заново.")
+        await state.clear()
+        return await query.answer()
+
+    plan = ProtocolPlan.from_dict(plan_data)
+    try:
+        await run_in_thread(planner.commit, plan)
+    except ScheduleConflictError as e:
+        logging.info(f"План протокола '{plan.type_protocol}' устарел: {e}")
+        await show_plan_preview(query, state, plan.type_protocol, note="⚠️ Пока вы смотрели план, расписание изменилось. План пересчитан:\n\n")
+        return await query.answer()
+    except DatabaseError as e:
+        logging.error(f"Ошибка базы данных при добавлении протокола в расписание: {e}")
+        await query.message.edit_text("Произошла ошибка при добавлении протокола в расписание. Попробуйте позже.")
+        await state.clear()
+        return await query.answer()
+
+    message_text = f"✅ В расписание добавлено {len(plan.placements)} задач из протокола '{plan.type_protocol}' (протокол №{plan.number_protocol})."
+    if plan.tasks_not_scheduled:
+        not_scheduled_tasks_str = "\n".join([f"- {task_name}" for task_name in plan.tasks_not_scheduled])
+        message_text += f"\n\n⚠️ Не удалось запланировать следующие задачи:\n{not_scheduled_tasks_str}"
+
+    await query.message.edit_text(message_text)
+    await state.clear()
+    await query.answer()
+
+
+@router.callback_query(DirectorState.confirming_schedule_plan, F.data == "schedule_plan_cancel")
+async def callback_cancel_schedule_plan(query: CallbackQuery, state: FSMContext):
+    """
+    Обработчик кнопки "Отмена" предпросмотра плана. В БД ничего не записывается.
+    """
+    await query.message.edit_text("Добавление протокола в расписание отменено.")
+    await state.clear()
+    await query.answer()
+
+
+@router.message(F.text == "Пакетное планирование")
+async def cmd_batch_schedule(message: Message, state: FSMContext):
+    """
+    Обработчик кнопки "Пакетное планирование".
+    Директор выбирает несколько протоколов (можно с повторами), которые затем планируются на сегодня совместно.
+    """
+    protocols = await Protocol.aget_all()
+    if not protocols:
+        await message.answer("В системе нет зарегистрированных протоколов. Сначала добавьте протокол.", reply_markup=director_keyboard())
+        await message.delete()
         return await state.clear()
 
-    standart_tasks_names = protocol.list_standart_tasks
-    today_date = datetime.datetime.now() # Используем текущую дату и время для расписания на день
-    schedule_start_datetime = datetime.datetime.combine(today_date, WORKING_DAY_START)
-    schedule_end_datetime = datetime.datetime.combine(today_date, WORKING_DAY_END)
-    current_task_start_time = schedule_start_datetime
-    next_protocol_number = Reservation.count_protocol_numbers()
-
-    added_tasks_count = 0
-    tasks_not_scheduled = []
-
-    for task_name in standart_tasks_names:
-        standart_task = StandartTask.get_by_name(task_name)
-        if not standart_task:
-            logging.warning(f"Стандартная задача '{task_name}' не найдена, пропуск.")
-            tasks_not_scheduled.append(task_name)
-            continue
-
-        task_duration = standart_task.time_task
-        if task_duration is None:
-            logging.warning(f"Для задачи '{task_name}' не указано время выполнения (time_task), пропуск.")
-            tasks_not_scheduled.append(task_name)
-            continue
-
-        device_type = standart_task.type_device
-
-        if device_type is None:
-            logging.warning(f"У задачи '{task_name}' не указан type_device, пропуск.")
-            tasks_not_scheduled.append(task_name)
-            continue
-
-        # Поиск доступного времени и устройства
-        available_slot_found = False
-        schedule_attempt_time = current_task_start_time
-        while schedule_attempt_time + task_duration <= schedule_end_datetime:
-            available_device = Device.find_available_device_by_type_and_time(
-                type_device=device_type,
-                start_time=schedule_attempt_time,
-                end_time=schedule_attempt_time + task_duration
-            )
-            if available_device:
-                # Найдено доступное устройство и время
-                device_id = available_device.id # Получаем ID доступного устройства
-                task_end_time = schedule_attempt_time + task_duration
-                reservation = Reservation(
-                    type_protocol=protocol_name,
-                    name_task=task_name,
-                    id_device=device_id, # Assign device_id to reservation
-                    start_date=schedule_attempt_time,
-                    end_date=task_end_time
-                )
-                reservation.add(next_protocol_number)
-                current_task_start_time = task_end_time
-                added_tasks_count += 1
-                available_slot_found = True
-                break # Переходим к следующей задаче
-            else:
-                # Нет доступных устройств, сдвигаем время и пробуем снова
-                schedule_attempt_time += timedelta(minutes=5) # Шаг сдвига времени, можно настроить
-                if schedule_attempt_time.time() > WORKING_DAY_END:
-                    break # Вышли за пределы рабочего дня
+    markup = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=p.name, callback_data=f"batch_protocol_{p.name}")]
+        for p in protocols
+    ] + [[InlineKeyboardButton(text="✅ Готово", callback_data="batch_protocols_done")]])
+
+    await state.set_state(DirectorState.choosing_protocols_for_batch)
+    await state.update_data(batch_protocols=[])
+    await message.answer("Выберите протоколы для совместного планирования на сегодня (каждое нажатие добавляет еще один экземпляр протокола), затем нажмите '✅ Готово':", reply_markup=markup)
+    await message.delete()
+
 
-        if not available_slot_found:
-            logging.warning(f"Не удалось запланировать задачу '{task_name}' на сегодня из-за занятости оборудования.")
-            tasks_not_scheduled.append(task_name)
+@router.callback_query(DirectorState.choosing_protocols_for_batch, F.data.startswith("batch_protocol_"))
+async def callback_choose_protocol_for_batch(query: CallbackQuery, state: FSMContext):
+    """
+    Обработчик выбора протокола для пакетного планирования.
+    """
+    protocol_name = query.data.split("_")[2]
+    state_data = await state.get_data()
+    batch_protocols = state_data.get('batch_protocols', [])
+    batch_protocols.append(protocol_name)
+    await state.update_data(batch_protocols=batch_protocols)
+    await query.answer(f"Протокол '{protocol_name}' добавлен (всего выбрано: {len(batch_protocols)}).")
+
+
+@router.callback_query(DirectorState.choosing_protocols_for_batch, F.data == "batch_protocols_done")
+async def callback_batch_protocols_done(query: CallbackQuery, state: FSMContext):
+    """
+    Обработчик кнопки "Готово" пакетного планирования.
+    Размещает все выбранные протоколы совместно и сохраняет резервации.
+    """
+    state_data = await state.get_data()
+    batch_protocols = state_data.get('batch_protocols', [])
+    if not batch_protocols:
+        await query.answer("Не выбрано ни одного протокола.", show_alert=True)
+        return
 
-    message_text = f"✅ В расписание на сегодня добавлено {added_tasks_count} задач из протокола '{protocol_name}'."
-    if tasks_not_scheduled:
-        not_scheduled_tasks_str = "\n".join([f"- {task_name}" for task_name in tasks_not_scheduled])
-        message_text += f"\n\n⚠️ Не удалось запланировать следующие задачи (из-за занятости оборудования, отсутствия данных о времени выполнения или type_device):\n{not_scheduled_tasks_str}"
+    protocols = {}
+    for protocol_name in set(batch_protocols):
+        protocol = await Protocol.aget_by_name(protocol_name)
+        if protocol:
+            protocols[protocol_name] = protocol
+
+    protocol_instances = [(name, protocols[name].list_standart_tasks) for name in batch_protocols if name in protocols]
+    all_task_names = [task_name for protocol in protocols.values() for task_name in protocol.list_standart_tasks]
+
+    engine = await run_in_thread(ScheduleEngine.load_for_day, datetime.date.today(), all_task_names)
+    first_number_protocol = None # Номера протоколов присваиваются при записи плана
+    optimization_stats = None
+    if SCHEDULE_OPTIMIZER_TIME_BUDGET > 0:
+        await query.message.edit_text("Подбираю оптимальный порядок протоколов...")
+        optimizer = MakespanOptimizer(engine, time_budget=SCHEDULE_OPTIMIZER_TIME_BUDGET)
+        # Оптимизация занимает до SCHEDULE_OPTIMIZER_TIME_BUDGET секунд процессорного времени, не блокируем цикл событий
+        batch, optimization_stats = await asyncio.get_running_loop().run_in_executor(None, optimizer.optimize, protocol_instances, first_number_protocol)
+    else:
+        batch = await run_in_thread(engine.plan_batch, protocol_instances, first_number_protocol=first_number_protocol)
+    try:
+        reservations_by_plan = await run_in_thread(planner.commit_many, batch.plans) # Все протоколы пакета одной транзакцией; планы без размещений не записываются
+    except ScheduleConflictError as e:
+        logging.info(f"Пакетный план устарел: {e}")
+        await query.message.edit_text("⚠️ Пока строился план, расписание изменилось. Ничего не сохранено, запустите пакетное планирование заново.")
+        await state.clear()
+        return await query.answer()
+    except DatabaseError as e:
+        logging.error(f"Ошибка базы данных при пакетном добавлении протоколов в расписание: {e}")
+        await query.message.edit_text("Произошла ошибка при добавлении протоколов в расписание. Попробуйте позже.")
+        await state.clear()
+        return await query.answer()
+
+    makespan_minutes = int(batch.makespan.total_seconds() // 60)
+    message_text = (
+        f"✅ Совместно запланировано {len(reservations_by_plan)} протоколов, {batch.tasks_scheduled_count} задач.\n"
+        f"Окончание последней задачи через {makespan_minutes // 60} ч {makespan_minutes % 60} мин после начала рабочего дня."
+    )
+    if optimization_stats:
+        gains = []
+        if optimization_stats.scheduled_gain > 0:
+            gains.append(f"запланировано на {optimization_stats.scheduled_gain} задач больше")
+        improvement_minutes = int(optimization_stats.improvement.total_seconds() // 60)
+        if improvement_minutes > 0: # Если размещено больше задач, план может заканчиваться позже
+            gains.append(f"окончание раньше на {improvement_minutes} мин")
+        message_text += (
+            f"\nОптимизация: {optimization_stats.iterations} вариантов за {optimization_stats.elapsed:.1f} с, "
+            + (f"по сравнению с жадным планом {', '.join(gains)}." if gains else "жадный план не удалось улучшить.")
+        )
+    missing_protocols = [name for name in batch_protocols if name not in protocols]
+    if missing_protocols:
+        message_text += "\n\n⚠️ Не найдены протоколы: " + ", ".join(missing_protocols)
+    unplaced_protocols = [plan.type_protocol for plan in batch.plans if not plan.placements]
+    if unplaced_protocols:
+        message_text += "\n\n⚠️ Не удалось разместить ни одной задачи протоколов (в расписание не добавлены): " + ", ".join(unplaced_protocols)
+    if batch.tasks_not_scheduled:
+        # Номер получают только записанные протоколы, неразмещенный протокол называем по имени
+        not_scheduled_tasks_str = "\n".join([
+            f"- {task_name} (протокол №{plan.number_protocol} '{plan.type_protocol}')" if plan.placements
+            else f"- {task_name} (протокол '{plan.type_protocol}', не добавлен в расписание)"
+            for plan, task_name in batch.tasks_not_scheduled
+        ])
+        message_text += f"\n\n⚠️ Не удалось запланировать следующие задачи:\n{not_scheduled_tasks_str}"
 
     await query.message.edit_text(message_text)
     await state.clear()
@@ -706,7 +866,7 @@ async def cmd_view_schedule(message: Message, state: FSMContext):
     #     return await message.answer("Только директора могут использовать эту команду.")
 
     await state.set_state(DirectorState.choosing_protocol_to_view_schedule) # Переходим в состояние выбора протокола
-    reservations_today = Reservation.get_all_by_today()
+    reservations_today = await Reservation.aget_all_by_today()
     protocol_names_today = set()
 
     for res in reservations_today:
@@ -733,7 +893,7 @@ async def callback_view_protocol_schedule(query: CallbackQuery, state: FSMContex
     """
     protocol_name = query.data.split("_")[1] # Извлекаем название протокола из callback_data
     today_date = datetime.datetime.now() # Используем текущую дату и время для расписания на день
-    protocol_reservations = Reservation.find_by_protocol_name(protocol_name) # Получаем резервации для выбранного протокола
+    protocol_reservations = await run_in_thread(Reservation.find_by_protocol_name, protocol_name) # Получаем резервации для выбранного протокола
 
     schedule_info = f"<b>Расписание протокола '{protocol_name}' на {today_date.strftime('%d.%m.%Y')}:</b>\n\n"
     tasks_info = []
@@ -759,7 +919,7 @@ async def format_task_schedule_info(reservation: Reservation) -> str:
     task_name = reservation.name_task
     start_time = reservation.start_date.strftime("%H:%M") if reservation.start_date else "Не задано"
     end_time = reservation.end_date.strftime("%H:%M") if reservation.end_date else "Не задано"
-    device = Device.get_by_id(reservation.id_device)
+    device = await Device.aget_by_id(reservation.id_device)
     cabinet_name = device.name_cabinet if device else "Неизвестно"
     device_name = device.name if device else "Неизвестно"
 
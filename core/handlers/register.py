@@ -28,9 +28,9 @@ async def cmd_start_director_show_register(message: types.Message, state: FSMCon
     logging.info(f"Регистрация через диплинк")
     user_id = 1
 
-    user = User.get_or_create(user_id)
+    user = await User.aget_or_create(user_id)
     user.id_role = 1
-    user.update()
+    await user.aupdate()
     if user.fio:
         return await message.answer(f"Приветствую, директор {user.fio}!", reply_markup=director_keyboard()) # Отправляем клавиатуру директора
 
@@ -49,10 +49,10 @@ async def cmd_start_assistant_show_register(message: types.Message, state: FSMCo
     logging.info(f"Регистрация через диплинк")
     user_id = message.from_user.id
 
-    user = User.get_or_create(user_id)
+    user = await User.aget_or_create(user_id)
     user.id_role = 2
     user.id_chief = 1
-    user.update()
+    await user.aupdate()
     if user.fio:
         return await message.answer(f"Приветствую, ассистент {user.fio}!", reply_markup=assistant_keyboard()) # Отправляем клавиатуру директора
 
@@ -71,9 +71,9 @@ async def cmd_start_director_register(message: types.Message, state: FSMContext)
     logging.info(f"Регистрация через диплинк")
     user_id = message.from_user.id
 
-    user = User.get_or_create(user_id)
+    user = await User.aget_or_create(user_id)
     user.id_role = 1
-    user.update()
+    await user.aupdate()
     if user.fio:
         return await message.answer(f"Приветствую, директор {user.fio}!", reply_markup=director_keyboard()) # Отправляем клавиатуру директора
 
@@ -90,7 +90,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
     Проверяет, зарегистрирован ли пользователь, или начинает процесс регистрации.
     """
     user_id = message.from_user.id
-    user = User.get_by_id(user_id)
+    user = await User.aget_by_id(user_id)
 
     if user:
         if user.fio:
@@ -114,9 +114,9 @@ async def process_fio(message: types.Message, state: FSMContext):
     state_data = await state.get_data()
     user_id = state_data.get('user_id')
     try:
-        user = User.get_or_create(user_id) # Получаем или создаем пользователя
+        user = await User.aget_or_create(user_id) # Получаем или создаем пользователя
         user.fio = fio
-        user.update() # Обновляем ФИО
+        await user.aupdate() # Обновляем ФИО
         await message.answer(f"Спасибо, {fio}! Вы успешно зарегистрированы.", reply_markup=assistant_keyboard()) # Убираем ReplyKeyboardRemove, если хотим оставить клавиатуру директора
         if user.id_role == User.ROLE_DIRECTOR: # Если роль директора, отправляем клавиатуру
             await message.answer("Теперь вы можете использовать команды директора.", reply_markup=director_keyboard())
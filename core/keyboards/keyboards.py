@@ -14,6 +14,9 @@ def director_keyboard():
                 KeyboardButton(text="Добавить в расписание"),
                 KeyboardButton(text="Посмотреть расписание")
             ],
+            [
+                KeyboardButton(text="Пакетное планирование") # Несколько протоколов за один проход
+            ],
         ],
         resize_keyboard=True,  # Автоматически уменьшает размер клавиатуры
         one_time_keyboard=False  # Клавиатура не исчезает после первого использования
@@ -1,33 +1,94 @@
+import copy
 from typing import Any, Dict, Optional, overload
 
 from aiogram.fsm.context import FSMContext as BaseFSMContext
-from aiogram.fsm.storage.base import StorageKey, StateType
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
 from aiogram.fsm.state import State
-from core.sql import PostgreSQLStorage 
 
 
 class CustomFSMContext(BaseFSMContext):
-    def __init__(self, storage: PostgreSQLStorage, key: StorageKey):
+    """
+    Контекст FSM пользователя. После load() состояние и данные читаются из снимка, загруженного
+    одним запросом, а изменения копятся в снимке и записываются одним запросом в save()
+    (load и save вызывает CustomFSMContextMiddleware). Если состояние и данные целиком не заменялись,
+    save() передает хранилищу только ключи из update_data. Без load() все методы обращаются к хранилищу напрямую.
+    """
+
+    def __init__(self, storage: BaseStorage, key: StorageKey):
         super().__init__(storage, key)
-        self.storage: PostgreSQLStorage = storage
+        self.storage: BaseStorage = storage
         self.key: StorageKey = key
+        self._loaded: bool = False # Снимок загружен, методы работают с ним
+        self._replaced: bool = False # Состояние или данные заменены целиком, снимок записывается полностью
+        self._changes: Dict[str, Any] = {} # Ключи из update_data, еще не записанные в хранилище
+        self._state: Optional[str] = None
+        self._data: Dict[str, Any] = {}
+
+    async def load(self) -> None:
+        """Загружает снимок состояния и данных (одним запросом, если хранилище это поддерживает)."""
+        get_snapshot = getattr(self.storage, 'get_snapshot', None)
+        if get_snapshot is not None:
+            self._state, self._data = await get_snapshot(self.key)
+        else:
+            self._state = await self.storage.get_state(key=self.key)
+            self._data = await self.storage.get_data(key=self.key)
+        self._loaded = True
+        self._replaced = False
+        self._changes = {}
+
+    async def save(self) -> None:
+        """Записывает изменения снимка в хранилище (одним запросом, если хранилище это поддерживает)."""
+        if not self._loaded:
+            return
+        if self._replaced:
+            set_snapshot = getattr(self.storage, 'set_snapshot', None)
+            if set_snapshot is not None:
+                await set_snapshot(self.key, self._state, self._data)
+            else:
+                await self.storage.set_state(key=self.key, state=self._state)
+                if self._state is not None or self._data:
+                    await self.storage.set_data(key=self.key, data=self._data) # Сброс состояния уже удалил пустые данные
+        elif self._changes:
+            await self.storage.update_data(key=self.key, data=self._changes) # Слияние на стороне хранилища
+        self._replaced = False
+        self._changes = {}
+
+    @property
+    def raw_state(self) -> Optional[str]:
+        """Строка состояния из снимка (для фильтров состояний), пустая строка означает отсутствие состояния."""
+        return self._state or None
 
     async def set_state(self, state: Optional[StateType] = None) -> None:
         """Устанавливает состояние, всегда преобразуя в строковое представление."""
         state_name = state.state if isinstance(state, State) else state
-        await self.storage.set_state(key=self.key, state=str(state_name) if state_name else None)
+        state_name = str(state_name) if state_name else None
+        if not self._loaded:
+            await self.storage.set_state(key=self.key, state=state_name)
+            return
+        self._state = state_name
+        if state_name is None:
+            self._data = {} # Как и в хранилище: сброс состояния удаляет и данные
+        self._replaced = True
 
     async def get_state(self) -> Optional[StateType]:
-        state_str = await self.storage.get_state(key=self.key)
+        state_str = self._state if self._loaded else await self.storage.get_state(key=self.key)
         return State(state_str) if state_str else None
 
     async def set_data(self, data: Dict[str, Any]) -> None:
-        await self.storage.set_data(key=self.key, data=data)
+        if not self._loaded:
+            await self.storage.set_data(key=self.key, data=data)
+            return
+        self._data = copy.deepcopy(data)
+        self._replaced = True
 
     async def get_data(self) -> Dict[str, Any]:
-        return await self.storage.get_data(key=self.key)
+        if not self._loaded:
+            return await self.storage.get_data(key=self.key)
+        return copy.deepcopy(self._data) # Копия: изменения без set_data не должны попадать в снимок
 
     async def get_value(self, key: str, default: Optional[Any] = None) -> Optional[Any]:
+        if self._loaded:
+            return copy.deepcopy(self._data.get(key, default))
         data = await self.get_data()
         return data.get(key, default)
 
@@ -36,11 +97,12 @@ class CustomFSMContext(BaseFSMContext):
     ) -> Dict[str, Any]:
         if data:
             kwargs.update(data)
-        current_data = await self.get_data()
-        current_data.update(kwargs)
-        await self.storage.set_data(key=self.key, data=current_data)  # Вернули key=self.key
-        return current_data.copy()
+        if not self._loaded:
+            return await self.storage.update_data(key=self.key, data=kwargs)
+        self._data.update(copy.deepcopy(kwargs))
+        self._changes.update(copy.deepcopy(kwargs))
+        return copy.deepcopy(self._data)
 
     async def clear(self) -> None:
-        await self.storage.set_state(key=self.key, state=None)
-        await self.storage.set_data(key=self.key, data={})
\ No newline at end of file
+        await self.set_state(None)
+        await self.set_data({})
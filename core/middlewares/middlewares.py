@@ -1,12 +1,12 @@
 from typing import Any, Awaitable, Callable, Dict
 from aiogram import BaseMiddleware
-from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
 from aiogram.types import TelegramObject, Update
 from core.middlewares.context import CustomFSMContext
-from core.sql import PostgreSQLStorage
+from core.fsm_storage import WriteBackStorage
 
 class CustomFSMContextMiddleware(BaseMiddleware):
-    def __init__(self, storage: PostgreSQLStorage): 
+    def __init__(self, storage: BaseStorage):
         self.storage = storage
 
     async def __call__(
@@ -33,6 +33,15 @@ class CustomFSMContextMiddleware(BaseMiddleware):
             if chat and user:
                 key = StorageKey(bot_id=bot_id, chat_id=chat.id, user_id=user.id)
                 fsm_context = CustomFSMContext(storage=self.storage, key=key)
+                await fsm_context.load() # Состояние и данные одним запросом на обновление
                 data["state"] = fsm_context
+                data["raw_state"] = fsm_context.raw_state # Для фильтров состояний (FSM aiogram отключен в Dispatcher)
+                data["fsm_storage"] = self.storage
+                try:
+                    return await handler(event, data)
+                finally:
+                    await fsm_context.save() # Изменения за обновление - одним запросом
+                    if isinstance(self.storage, WriteBackStorage):
+                        await self.storage.flush(key) # Изменения FSM за обновление записываются одним сбросом
 
         return await handler(event, data)
\ No newline at end of file
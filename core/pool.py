@@ -0,0 +1,218 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Set
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+from core.statements import deallocate_pending
+
+
+class PoolTimeoutError(PoolError):
+    """Исключение, если за отведенное время не удалось получить соединение из пула."""
+    pass
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """
+    Соединение пула: помнит, когда его последний раз возвращали в пул,
+    и какие запросы подготовлены на нем на сервере (см. core/statements.py).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_used: float = time.monotonic()
+        self.prepared: Set[str] = set() # Имена запросов, подготовленных на соединении (PREPARE)
+        self.deallocate_pending: Set[str] = set() # Устаревшие подготовленные запросы, которые нужно удалить
+
+
+class PoolStats:
+    """Счетчики пула соединений."""
+
+    def __init__(self):
+        self.acquired: int = 0 # Сколько раз соединение выдано из пула
+        self.timeouts: int = 0 # Сколько раз не дождались свободного соединения
+        self.created: int = 0 # Сколько соединений открыто
+        self.discarded: int = 0 # Сколько соединений закрыто как неисправные
+        self.health_checks: int = 0 # Сколько раз проверялось долго простаивавшее соединение
+        self.acquire_time_total: float = 0.0 # Суммарное время ожидания соединения, секунд
+        self.acquire_time_max: float = 0.0 # Максимальное время ожидания соединения, секунд
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений psycopg2 с интерфейсом psycopg2.pool (getconn/putconn/closeall).
+    - Держит не меньше minconn и не больше maxconn соединений.
+    - Если все соединения заняты, getconn ждет освобождения не дольше timeout секунд
+      и выбрасывает PoolTimeoutError.
+    - Соединение, простаивавшее дольше health_check_idle секунд, перед выдачей проверяется
+      запросом SELECT 1 и при ошибке заменяется новым.
+    - Возвращаемое соединение с незавершенной транзакцией откатывается, неисправное закрывается.
+    Счетчики доступны через stats().
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float = 5.0, health_check_idle: float = 30.0, **connection_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Некорректные размеры пула: требуется 0 <= minconn <= maxconn, maxconn >= 1.")
+        self.minconn: int = minconn
+        self.maxconn: int = maxconn
+        self.timeout: float = timeout
+        self.health_check_idle: float = health_check_idle
+        self._connection_kwargs: Dict = connection_kwargs
+        self._idle: Deque[PooledConnection] = deque() # Свободные соединения (последнее возвращенное - справа)
+        self._in_use: Set[PooledConnection] = set()
+        self._opening: int = 0 # Соединения, которые сейчас открываются вне блокировки
+        self._waiting: int = 0
+        self._closed: bool = False
+        self._condition = threading.Condition()
+        self._stats = PoolStats()
+        for _ in range(minconn):
+            self._idle.append(self._open())
+
+    def _open(self) -> PooledConnection:
+        """Открывает новое соединение."""
+        conn = psycopg2.connect(connection_factory=PooledConnection, **self._connection_kwargs)
+        with self._condition:
+            self._stats.created += 1
+        return conn
+
+    def _is_healthy(self, conn: PooledConnection) -> bool:
+        """Проверяет соединение, если оно простаивало дольше health_check_idle секунд."""
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used < self.health_check_idle:
+            return True
+        with self._condition:
+            self._stats.health_checks += 1
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            logging.warning(f"Соединение пула не прошло проверку и будет заменено: {e}")
+            return False
+
+    def _discard(self, conn: PooledConnection):
+        """Закрывает неисправное соединение."""
+        with self._condition: # Условие построено на RLock, повторный захват безопасен
+            self._stats.discarded += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self) -> PooledConnection:
+        """Выдает соединение из пула, ожидая освобождения не дольше timeout секунд."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            with self._condition:
+                if self._closed:
+                    raise PoolError("Пул соединений закрыт.")
+                self._waiting += 1
+                try:
+                    while not self._idle and len(self._in_use) + self._opening >= self.maxconn:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or not self._condition.wait(remaining):
+                            if self._idle or len(self._in_use) + self._opening < self.maxconn:
+                                break # Соединение освободилось одновременно с истечением времени
+                            self._stats.timeouts += 1
+                            raise PoolTimeoutError(f"Не удалось получить соединение из пула за {self.timeout} с (занято {len(self._in_use)} из {self.maxconn}).")
+                        if self._closed:
+                            raise PoolError("Пул соединений закрыт.")
+                finally:
+                    self._waiting -= 1
+                conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    self._opening += 1
+
+            if conn is None:
+                try:
+                    conn = self._open() # Открываем вне блокировки, чтобы не задерживать другие потоки
+                finally:
+                    with self._condition:
+                        self._opening -= 1
+                        if conn is None:
+                            self._condition.notify()
+            elif not self._is_healthy(conn):
+                self._discard(conn)
+                with self._condition:
+                    self._condition.notify()
+                continue
+
+            with self._condition:
+                self._in_use.add(conn)
+                waited = time.monotonic() - started
+                self._stats.acquired += 1
+                self._stats.acquire_time_total += waited
+                self._stats.acquire_time_max = max(self._stats.acquire_time_max, waited)
+            return conn
+
+    def putconn(self, conn: PooledConnection, close: bool = False):
+        """Возвращает соединение в пул (незавершенная транзакция откатывается)."""
+        with self._condition:
+            if self._closed:
+                return # Пул уже закрыт, closeall закрыл и это соединение
+            if conn not in self._in_use:
+                raise PoolError("Соединение не принадлежит пулу или уже возвращено.")
+
+        if not close and not conn.closed:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+            if not close and not deallocate_pending(conn):
+                close = True
+
+        with self._condition:
+            self._in_use.discard(conn)
+            if close or conn.closed or self._closed or len(self._idle) + len(self._in_use) >= self.maxconn:
+                self._discard(conn)
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+            self._condition.notify()
+
+    def owns(self, conn: PooledConnection) -> bool:
+        """Проверяет, что соединение выдано этим пулом и еще не возвращено."""
+        with self._condition:
+            return conn in self._in_use
+
+    def closeall(self):
+        """Закрывает все соединения и пул."""
+        with self._condition:
+            self._closed = True
+            connections = list(self._idle) + list(self._in_use)
+            self._idle.clear()
+            self._in_use.clear()
+            self._condition.notify_all()
+        for conn in connections:
+            if not conn.closed:
+                conn.close()
+
+    def stats(self) -> Dict[str, float]:
+        """Возвращает снимок счетчиков пула."""
+        with self._condition:
+            acquired = self._stats.acquired
+            return {
+                'size': len(self._idle) + len(self._in_use),
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'max_size': self.maxconn,
+                'acquired': acquired,
+                'timeouts': self._stats.timeouts,
+                'created': self._stats.created,
+                'discarded': self._stats.discarded,
+                'health_checks': self._stats.health_checks,
+                'acquire_time_avg_ms': self._stats.acquire_time_total / acquired * 1000 if acquired else 0.0,
+                'acquire_time_max_ms': self._stats.acquire_time_max * 1000,
+            }
@@ -0,0 +1,111 @@
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import psycopg2
+
+from core.classes import DatabaseError, Device, Reservation, StandartTask
+from core.scheduling.occupancy import DeviceOccupancy
+from core.utils import dependencies
+
+
+def _device_shift(following: Reservation, group: List[Reservation], capacity: int, parallel_tasks: set) -> timedelta:
+    """
+    Возвращает, на сколько нужно сдвинуть резервацию following, чтобы она поместилась во вместимость
+    устройства с учетом резерваций, стоящих перед ней на этом устройстве (group отсортирован по исходному началу).
+    """
+    occupancy = DeviceOccupancy()
+    occupancy.add_device(following.id_device, 0, capacity)
+    for other in group:
+        if other is following:
+            break
+        occupancy.reserve(other.id_device, other.start_date, other.end_date, other.name_task in parallel_tasks)
+    start = occupancy.earliest_start(following.id_device, following.start_date,
+                                     following.end_date - following.start_date, following.name_task in parallel_tasks)
+    return start - following.start_date
+
+
+def propagate_delay(reservations: List[Reservation], delayed_id: int, delay: timedelta, now: Optional[datetime] = None,
+                    capacities: Optional[Dict[int, int]] = None, parallel_tasks: Iterable[str] = ()) -> List[Reservation]:
+    """
+    Продлевает резервацию delayed_id на delay и сдвигает только те резервации, которые из-за этого
+    начинают конфликтовать: следующие задачи того же протокола и следующие резервации на тех же устройствах
+    (каскадно). Резервация на устройстве сдвигается, только если вместе с предшествующими ей резервациями
+    она не помещается во вместимость устройства (capacities, по умолчанию 1); задачи из parallel_tasks
+    занимают одно место, остальные - все устройство.
+    Порядок задач в протоколе сохраняется, задачи, которые уже начались (start_date <= now), не двигаются.
+    Работает в памяти и изменяет переданные объекты; возвращает список измененных резерваций
+    (первой идет задержанная).
+    """
+    now = now or datetime.now()
+    capacities = capacities or {}
+    parallel_tasks = set(parallel_tasks)
+    by_id: Dict[int, Reservation] = {r.id: r for r in reservations if r.start_date and r.end_date}
+    delayed = by_id.get(delayed_id)
+    if delayed is None:
+        return []
+
+    # Для каждой резервации находим следующую в том же протоколе; резервации устройств упорядочиваем по началу
+    protocol_successors: Dict[int, List[Reservation]] = {r_id: [] for r_id in by_id}
+    protocols: Dict[int, List[Reservation]] = {}
+    devices: Dict[int, List[Reservation]] = {}
+    for reservation in by_id.values():
+        protocols.setdefault(reservation.number_protocol, []).append(reservation)
+        devices.setdefault(reservation.id_device, []).append(reservation)
+    for group in list(protocols.values()) + list(devices.values()):
+        group.sort(key=lambda r: (r.start_date, r.id))
+    for group in protocols.values():
+        for previous, following in zip(group, group[1:]):
+            protocol_successors[previous.id].append(following)
+    device_position = {r.id: index for group in devices.values() for index, r in enumerate(group)}
+
+    delayed.end_date += delay
+    changed = {delayed.id: delayed}
+    queue = deque([delayed])
+    while queue:
+        reservation = queue.popleft()
+        group = devices[reservation.id_device]
+        capacity = max(capacities.get(reservation.id_device, 1) or 1, 1)
+        for following in protocol_successors[reservation.id] + group[device_position[reservation.id] + 1:]:
+            if following.start_date <= now or following.start_date >= reservation.end_date:
+                continue # Задача уже началась или конфликта нет
+            if following in protocol_successors[reservation.id]:
+                shift = reservation.end_date - following.start_date
+            else:
+                shift = _device_shift(following, group, capacity, parallel_tasks)
+            if shift <= timedelta():
+                continue # На устройстве хватает места
+            following.start_date += shift
+            following.end_date += shift
+            changed[following.id] = following
+            queue.append(following)
+
+    return list(changed.values())
+
+
+def apply_delay(reservation_id: int, delay: timedelta, now: Optional[datetime] = None) -> List[Reservation]:
+    """
+    Задерживает резервацию reservation_id на delay (см. propagate_delay) одной транзакцией на основном сервере:
+    блокирует запись резерваций, читает расписание на сегодня, сдвигает зависимые резервации и записывает их.
+    Одновременные задержки и записи планов (planner.commit_many) выполняются по очереди и не затирают сдвиги друг друга.
+    Возвращает измененные резервации (первой идет задержанная) или пустой список, если резервация на сегодня не найдена.
+    """
+    try:
+        # Присоединяется к транзакции вызывающего кода, если она открыта (db_manager.transaction())
+        with dependencies.db_manager.transaction() as conn:
+            with conn.cursor() as cursor:
+                # Та же блокировка, что и в planner.commit_many: запись резерваций ждет окончания сдвига
+                cursor.execute(f"LOCK TABLE \"{Reservation.table}\" IN SHARE ROW EXCLUSIVE MODE")
+            reservations = Reservation.get_all_by_today() # Внутри транзакции - с основного сервера, уже после блокировки
+            if not any(reservation.id == reservation_id for reservation in reservations):
+                return []
+            capacities = {device.id: device.capacity for device in Device.find_by_ids({r.id_device for r in reservations})}
+            parallel_tasks = [task.name for task in StandartTask.find_by_names(list({r.name_task for r in reservations})) if task.is_parallel]
+            changed_reservations = propagate_delay(reservations, reservation_id, delay, now=now,
+                                                   capacities=capacities, parallel_tasks=parallel_tasks)
+            Reservation.update_many(changed_reservations)
+    except psycopg2.Error as e:
+        logging.error(f"Ошибка при сдвиге расписания в таблице {Reservation.table}: {e}")
+        raise DatabaseError("Ошибка при сдвиге расписания в БД.") from e
+    return changed_reservations
@@ -0,0 +1,291 @@
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from core.classes import Reservation, StandartTask
+from core.config import WORKING_DAY_END, WORKING_DAY_START, WORKING_DAYS
+from core.scheduling.occupancy import CalendarOccupancy, DeviceOccupancy
+
+
+class PlannedTask:
+    """Размещение одной задачи протокола: устройство и интервал [start_date, end_date)."""
+
+    def __init__(self, name_task: str, id_device: int, start_date: datetime, end_date: datetime, parallel: bool = False):
+        self.name_task: str = name_task
+        self.id_device: int = id_device
+        self.start_date: datetime = start_date
+        self.end_date: datetime = end_date
+        self.parallel: bool = parallel # Задача занимает одно место устройства, а не все устройство
+
+
+class ProtocolPlan:
+    """Результат планирования одного протокола: размещенные задачи и задачи, которые не удалось разместить."""
+
+    def __init__(self, type_protocol: str, number_protocol: Optional[int] = None):
+        self.type_protocol: str = type_protocol
+        self.number_protocol: Optional[int] = number_protocol
+        self.placements: List[PlannedTask] = []
+        self.tasks_not_scheduled: List[str] = []
+
+    def to_reservations(self, assistants: List[int] = None) -> List[Reservation]:
+        """Преобразует размещения в (еще не сохраненные) объекты Reservation."""
+        return [
+            Reservation(
+                type_protocol=self.type_protocol,
+                name_task=placement.name_task,
+                id_device=placement.id_device,
+                assistants=list(assistants) if assistants else [],
+                start_date=placement.start_date,
+                end_date=placement.end_date,
+                number_protocol=self.number_protocol
+            )
+            for placement in self.placements
+        ]
+
+    @property
+    def start_date(self) -> Optional[datetime]:
+        """Начало первой размещенной задачи."""
+        return min((placement.start_date for placement in self.placements), default=None)
+
+    @property
+    def end_date(self) -> Optional[datetime]:
+        """Окончание последней размещенной задачи."""
+        return max((placement.end_date for placement in self.placements), default=None)
+
+    @property
+    def busy_time(self) -> timedelta:
+        """Суммарная длительность размещенных задач."""
+        return sum((placement.end_date - placement.start_date for placement in self.placements), timedelta())
+
+    @property
+    def tasks_by_day(self) -> Dict[date, int]:
+        """Количество размещенных задач по дням."""
+        tasks_by_day = {}
+        for placement in self.placements:
+            tasks_by_day[placement.start_date.date()] = tasks_by_day.get(placement.start_date.date(), 0) + 1
+        return dict(sorted(tasks_by_day.items()))
+
+    def to_dict(self) -> dict:
+        """Сериализует план в словарь, пригодный для json (например, для хранения в данных FSM)."""
+        return {
+            'type_protocol': self.type_protocol,
+            'number_protocol': self.number_protocol,
+            'placements': [
+                [placement.name_task, placement.id_device, placement.start_date.isoformat(), placement.end_date.isoformat(), placement.parallel]
+                for placement in self.placements
+            ],
+            'tasks_not_scheduled': list(self.tasks_not_scheduled)
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> 'ProtocolPlan':
+        """Восстанавливает план, сериализованный to_dict."""
+        plan = ProtocolPlan(data['type_protocol'], data.get('number_protocol'))
+        plan.placements = [
+            PlannedTask(name_task, id_device, datetime.fromisoformat(start_date), datetime.fromisoformat(end_date), parallel)
+            for name_task, id_device, start_date, end_date, parallel in data.get('placements', [])
+        ]
+        plan.tasks_not_scheduled = list(data.get('tasks_not_scheduled', []))
+        return plan
+
+
+class ScheduleEngine:
+    """
+    Общий жадный планировщик для всех сценариев: добавление протокола директором,
+    перепланирование протокола и перепланирование дня после опоздания.
+    Работает только в памяти: задачи, устройства и их занятость передаются извне,
+    найденные размещения сразу учитываются в индексе занятости.
+    При horizon_days > 1 задача, которая не помещается в текущий день, переносится
+    на следующие рабочие дни (WORKING_DAYS) в пределах горизонта.
+    """
+
+    def __init__(self, standart_tasks: Dict[str, StandartTask], calendar: CalendarOccupancy, day: date, horizon_days: int = 1):
+        self.standart_tasks: Dict[str, StandartTask] = standart_tasks
+        self.calendar: CalendarOccupancy = calendar
+        self.day: date = day
+        self.day_start: datetime = datetime.combine(day, WORKING_DAY_START)
+        self.day_end: datetime = datetime.combine(day, WORKING_DAY_END)
+        # Первый день планируется всегда, следующие - только если они рабочие
+        self.days: List[date] = [day] + [
+            day + timedelta(days=offset) for offset in range(1, horizon_days)
+            if (day + timedelta(days=offset)).weekday() in WORKING_DAYS
+        ]
+
+    @property
+    def occupancy(self) -> DeviceOccupancy:
+        """Индекс занятости первого дня горизонта."""
+        return self.calendar.for_day(self.day)
+
+    @staticmethod
+    def load_for_day(day: date, task_names: Iterable[str], exclude_ids: Iterable[int] = (), horizon_days: int = 1) -> 'ScheduleEngine':
+        """
+        Загружает стандартные задачи, устройства нужных типов и их занятость на horizon_days дней
+        начиная с day (три запроса) и создает по ним планировщик.
+        """
+        standart_tasks = {task.name: task for task in StandartTask.find_by_names(list(set(task_names)))}
+        device_types = [task.type_device for task in standart_tasks.values() if task.type_device is not None]
+        calendar = CalendarOccupancy.load(day, horizon_days, device_types, exclude_ids=exclude_ids)
+        return ScheduleEngine(standart_tasks, calendar, day, horizon_days)
+
+    def _find_slot(self, device_type: int, not_before: datetime, duration: timedelta, parallel: bool = False) -> Optional[Tuple[int, datetime]]:
+        """
+        Ищет самое раннее окно для задачи в пределах горизонта: сначала в день not_before,
+        затем с начала каждого следующего рабочего дня.
+        """
+        for day in self.days:
+            day_start = datetime.combine(day, WORKING_DAY_START)
+            day_end = datetime.combine(day, WORKING_DAY_END)
+            if day_end <= not_before:
+                continue
+            slot = self.calendar.for_day(day).find_earliest_slot(device_type, max(not_before, day_start), duration, day_end, parallel)
+            if slot is not None:
+                return slot
+        return None
+
+    def _resolve_task(self, task_name: str, duration: Optional[timedelta] = None, quiet: bool = False) -> Optional[Tuple[timedelta, int, bool]]:
+        """
+        Возвращает (длительность, type_device, is_parallel) стандартной задачи или None,
+        если задачу нельзя планировать (нет задачи, длительности или типа устройства).
+        """
+        standart_task = self.standart_tasks.get(task_name)
+        if not standart_task:
+            if not quiet:
+                logging.warning(f"Стандартная задача '{task_name}' не найдена, пропуск.")
+            return None
+
+        task_duration = duration if duration is not None else standart_task.time_task
+        if task_duration is None:
+            if not quiet:
+                logging.warning(f"Для задачи '{task_name}' не указано время выполнения (time_task), пропуск.")
+            return None
+
+        if standart_task.type_device is None:
+            if not quiet:
+                logging.warning(f"У задачи '{task_name}' не указан type_device, пропуск.")
+            return None
+        return task_duration, standart_task.type_device, bool(standart_task.is_parallel)
+
+    def plan_protocol(self, type_protocol: str, task_names: List[str], number_protocol: Optional[int] = None,
+                      not_before: Optional[datetime] = None, durations: Dict[int, timedelta] = None) -> ProtocolPlan:
+        """
+        Последовательно размещает задачи протокола: каждая следующая задача начинается
+        не раньше окончания предыдущей, на самом раннем свободном устройстве нужного типа.
+        durations позволяет переопределить длительность задачи по ее индексу в task_names.
+        """
+        plan = ProtocolPlan(type_protocol, number_protocol)
+        current_task_start_time = max(not_before, self.day_start) if not_before else self.day_start
+        durations = durations or {}
+
+        for index, task_name in enumerate(task_names):
+            resolved = self._resolve_task(task_name, durations.get(index))
+            if resolved is None:
+                plan.tasks_not_scheduled.append(task_name)
+                continue
+            task_duration, device_type, parallel = resolved
+
+            # Поиск самого раннего окна на устройствах нужного типа с учетом их вместимости
+            slot = self._find_slot(device_type, current_task_start_time, task_duration, parallel)
+            if slot is None:
+                logging.warning(f"Не удалось запланировать задачу '{task_name}' протокола '{type_protocol}' из-за занятости оборудования.")
+                plan.tasks_not_scheduled.append(task_name)
+                continue
+
+            device_id, task_start_time = slot
+            task_end_time = task_start_time + task_duration
+            self.calendar.reserve(device_id, task_start_time, task_end_time, parallel) # Учитываем размещение в индексе
+            plan.placements.append(PlannedTask(task_name, device_id, task_start_time, task_end_time, parallel))
+            current_task_start_time = task_end_time
+
+        return plan
+
+    def plan_batch(self, protocols: List[Tuple[str, List[str]]], first_number_protocol: Optional[int] = None,
+                   priorities: Optional[List[int]] = None, occupancy: Optional[DeviceOccupancy] = None, quiet: bool = False) -> 'BatchPlan':
+        """
+        Планирует набор протоколов (возможно, с повторами) совместно эвристикой списочного
+        планирования (алгоритм Гиффлера-Томпсона):
+        - для каждого протокола готова к размещению его следующая задача;
+        - находится готовая задача с самым ранним временем окончания (earliest finish time);
+        - среди готовых задач того же типа устройства, которые могли бы начаться раньше этого окончания,
+          выбирается задача протокола с наибольшей оставшейся длительностью (longest processing time first).
+        protocols - список пар (название протокола, список названий задач), номера протоколов
+        присваиваются по порядку начиная с first_number_protocol.
+        priorities задает фиксированный приоритет каждого экземпляра протокола вместо оставшейся длительности
+        (используется оптимизатором), occupancy - индекс занятости, в котором размещать задачи
+        (по умолчанию индекс планировщика).
+        """
+        occupancy = occupancy if occupancy is not None else self.occupancy
+        batch = BatchPlan(self.day_start)
+        chains = [] # Для каждого экземпляра протокола: список (название задачи, длительность, type_device, is_parallel)
+        for offset, (type_protocol, task_names) in enumerate(protocols):
+            number_protocol = first_number_protocol + offset if first_number_protocol is not None else None
+            plan = ProtocolPlan(type_protocol, number_protocol)
+            chain = []
+            for task_name in task_names:
+                resolved = self._resolve_task(task_name, quiet=quiet)
+                if resolved is None:
+                    plan.tasks_not_scheduled.append(task_name)
+                else:
+                    chain.append((task_name, *resolved))
+            batch.plans.append(plan)
+            chains.append(chain)
+
+        next_task = [0] * len(chains) # Индекс следующей неразмещенной задачи в цепочке
+        ready_time = [self.day_start] * len(chains) # Не раньше окончания предыдущей задачи протокола
+        remaining = [sum((task[1] for task in chain), timedelta()) for chain in chains]
+
+        while True:
+            # Самое раннее окно для следующей задачи каждого протокола
+            candidates = []
+            for index, chain in enumerate(chains):
+                while next_task[index] < len(chain):
+                    task_name, duration, device_type, parallel = chain[next_task[index]]
+                    slot = occupancy.find_earliest_slot(device_type, ready_time[index], duration, self.day_end, parallel)
+                    if slot is not None:
+                        candidates.append((index, slot[0], slot[1], duration, device_type))
+                        break
+                    if not quiet:
+                        logging.warning(f"Не удалось запланировать задачу '{task_name}' протокола '{batch.plans[index].type_protocol}' из-за занятости оборудования.")
+                    batch.plans[index].tasks_not_scheduled.append(task_name)
+                    remaining[index] -= duration
+                    next_task[index] += 1
+            if not candidates:
+                break
+
+            earliest = min(candidates, key=lambda c: (c[2] + c[3], c[0]))
+            earliest_finish = earliest[2] + earliest[3]
+            conflict_set = [c for c in candidates if c[4] == earliest[4] and c[2] < earliest_finish]
+            priority = priorities if priorities is not None else remaining
+            index, device_id, task_start_time, duration, _ = max(conflict_set, key=lambda c: (priority[c[0]], -c[2].timestamp(), -c[0]))
+
+            task_name, _, _, parallel = chains[index][next_task[index]]
+            task_end_time = task_start_time + duration
+            occupancy.reserve(device_id, task_start_time, task_end_time, parallel)
+            batch.plans[index].placements.append(PlannedTask(task_name, device_id, task_start_time, task_end_time, parallel))
+            ready_time[index] = task_end_time
+            remaining[index] -= duration
+            next_task[index] += 1
+
+        return batch
+
+
+class BatchPlan:
+    """Результат совместного планирования нескольких протоколов."""
+
+    def __init__(self, day_start: datetime):
+        self.day_start: datetime = day_start
+        self.plans: List[ProtocolPlan] = []
+
+    @property
+    def makespan(self) -> timedelta:
+        """Время от начала рабочего дня до окончания последней размещенной задачи."""
+        ends = [placement.end_date for plan in self.plans for placement in plan.placements]
+        return max(ends) - self.day_start if ends else timedelta()
+
+    @property
+    def tasks_not_scheduled(self) -> List[Tuple[ProtocolPlan, str]]:
+        """Неразмещенные задачи в виде пар (план протокола, название задачи)."""
+        return [(plan, task_name) for plan in self.plans for task_name in plan.tasks_not_scheduled]
+
+    @property
+    def tasks_scheduled_count(self) -> int:
+        return sum(len(plan.placements) for plan in self.plans)
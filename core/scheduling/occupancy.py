@@ -0,0 +1,204 @@
+import bisect
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from core.classes import Device, Reservation
+
+
+class DeviceOccupancy:
+    """
+    Индекс занятости устройств в памяти.
+    Для каждого устройства хранится отсортированный по началу список интервалов [start, end)
+    и сколько мест вместимости (Device.capacity) занимает каждый из них: параллельная задача
+    (StandartTask.is_parallel) занимает одно место, обычная - все устройство.
+    Задачу можно разместить, если на всем ее интервале суммарная нагрузка вместе с ней
+    не превышает вместимость устройства. Проверка выполняется без обращения к БД.
+    """
+
+    def __init__(self, devices: Iterable[Device] = ()):
+        self._devices_by_type: Dict[int, List[int]] = {} # type_device -> [id_device, ...]
+        self._capacity: Dict[int, int] = {} # id_device -> вместимость
+        self._starts: Dict[int, List[datetime]] = {} # id_device -> начала интервалов (по возрастанию)
+        self._ends: Dict[int, List[datetime]] = {} # id_device -> концы интервалов (в том же порядке)
+        self._units: Dict[int, List[int]] = {} # id_device -> занятые интервалом места (в том же порядке)
+        self._max_length: Dict[int, timedelta] = {} # id_device -> длина самого длинного интервала
+        for device in devices:
+            self.add_device(device.id, device.type_device, device.capacity)
+
+    def add_device(self, id_device: int, type_device: int, capacity: int = 1):
+        """Регистрирует устройство в индексе."""
+        if id_device in self._starts:
+            return
+        self._devices_by_type.setdefault(type_device, []).append(id_device)
+        self._capacity[id_device] = max(capacity or 1, 1)
+        self._starts[id_device] = []
+        self._ends[id_device] = []
+        self._units[id_device] = []
+        self._max_length[id_device] = timedelta()
+
+    def copy(self) -> 'DeviceOccupancy':
+        """Возвращает независимую копию индекса (для пробных размещений)."""
+        clone = DeviceOccupancy()
+        clone._devices_by_type = {type_device: list(ids) for type_device, ids in self._devices_by_type.items()}
+        clone._capacity = dict(self._capacity)
+        clone._starts = {id_device: list(starts) for id_device, starts in self._starts.items()}
+        clone._ends = {id_device: list(ends) for id_device, ends in self._ends.items()}
+        clone._units = {id_device: list(units) for id_device, units in self._units.items()}
+        clone._max_length = dict(self._max_length)
+        return clone
+
+    def devices_of_type(self, type_device: int) -> List[int]:
+        """Возвращает ID устройств заданного типа."""
+        return self._devices_by_type.get(type_device, [])
+
+    def capacity(self, id_device: int) -> int:
+        """Возвращает вместимость устройства."""
+        return self._capacity.get(id_device, 1)
+
+    def _demand(self, id_device: int, parallel: bool) -> int:
+        """Сколько мест на устройстве занимает задача."""
+        return 1 if parallel else self._capacity[id_device]
+
+    def reserve(self, id_device: int, start: datetime, end: datetime, parallel: bool = False):
+        """Отмечает интервал [start, end) на устройстве занятым задачей (параллельной или обычной)."""
+        if start >= end:
+            return
+        index = bisect.bisect_right(self._starts[id_device], start)
+        self._starts[id_device].insert(index, start)
+        self._ends[id_device].insert(index, end)
+        self._units[id_device].insert(index, self._demand(id_device, parallel))
+        self._max_length[id_device] = max(self._max_length[id_device], end - start)
+
+    def _overlapping(self, id_device: int, start: datetime, end: datetime) -> List[Tuple[datetime, datetime, int]]:
+        """
+        Возвращает интервалы устройства, пересекающиеся с [start, end), в виде (start, end, места).
+        Просматриваются только интервалы, начавшиеся не раньше чем за длину самого длинного интервала до start.
+        """
+        starts = self._starts[id_device]
+        ends = self._ends[id_device]
+        units = self._units[id_device]
+        low = bisect.bisect_left(starts, start - self._max_length[id_device])
+        high = bisect.bisect_left(starts, end)
+        return [(starts[i], ends[i], units[i]) for i in range(low, high) if ends[i] > start]
+
+    def _first_overload(self, id_device: int, start: datetime, end: datetime, demand: int) -> Optional[datetime]:
+        """
+        Возвращает первый момент в [start, end), когда нагрузка устройства вместе с demand
+        превышает его вместимость, или None, если такого момента нет.
+        """
+        capacity = self._capacity[id_device]
+        if demand > capacity:
+            return start
+        events = []
+        for interval_start, interval_end, units in self._overlapping(id_device, start, end):
+            events.append((max(interval_start, start), units))
+            events.append((interval_end, -units))
+        events.sort() # При одинаковом времени освобождение мест (-units) обрабатывается раньше занятия
+        load = 0
+        for moment, delta in events:
+            load += delta
+            if delta > 0 and load + demand > capacity:
+                return moment
+        return None
+
+    def is_free(self, id_device: int, start: datetime, end: datetime, parallel: bool = False) -> bool:
+        """Проверяет, можно ли разместить задачу на устройстве на интервале [start, end)."""
+        if id_device not in self._starts:
+            return False
+        return self._first_overload(id_device, start, end, self._demand(id_device, parallel)) is None
+
+    def find_available_device(self, type_device: int, start: datetime, end: datetime, parallel: bool = False) -> Optional[int]:
+        """Возвращает ID первого устройства заданного типа, на котором задачу можно разместить на интервале [start, end)."""
+        for id_device in self.devices_of_type(type_device):
+            if self.is_free(id_device, start, end, parallel):
+                return id_device
+        return None
+
+    def earliest_start(self, id_device: int, not_before: datetime, duration: timedelta, parallel: bool = False,
+                       deadline: Optional[datetime] = None) -> Optional[datetime]:
+        """
+        Возвращает самое раннее время начала не раньше not_before, при котором задачу можно разместить
+        на устройстве на все время duration. Вместо перебора с фиксированным шагом при перегрузке сразу
+        перескакивает на ближайшее освобождение места, поэтому найденное время точное, а не округленное до сетки.
+        Если задан deadline, поиск прекращается, как только задача перестает успевать к нему.
+        """
+        if id_device not in self._starts:
+            return None
+        demand = self._demand(id_device, parallel)
+        candidate = not_before
+        while deadline is None or candidate + duration <= deadline:
+            overload = self._first_overload(id_device, candidate, candidate + duration, demand)
+            if overload is None:
+                return candidate
+            if demand > self._capacity[id_device]:
+                return None
+            active = self._overlapping(id_device, overload, overload + timedelta(microseconds=1))
+            candidate = min(interval_end for _, interval_end, _ in active) # Ждем освобождения хотя бы одного интервала
+        return candidate
+
+    def find_earliest_slot(self, type_device: int, not_before: datetime, duration: timedelta, deadline: datetime,
+                           parallel: bool = False) -> Optional[Tuple[int, datetime]]:
+        """
+        Ищет устройство заданного типа с самым ранним окном длительностью duration,
+        которое начинается не раньше not_before и заканчивается не позже deadline.
+        Возвращает (id_device, start) или None, если окна нет.
+        """
+        best = None
+        for id_device in self.devices_of_type(type_device):
+            start = self.earliest_start(id_device, not_before, duration, parallel, deadline)
+            if start is None or start + duration > deadline:
+                continue
+            if best is None or start < best[1]:
+                best = (id_device, start)
+        return best
+
+    @staticmethod
+    def load_for_day(day: date, device_types: Iterable[int], exclude_ids: Iterable[int] = ()) -> 'DeviceOccupancy':
+        """
+        Загружает устройства нужных типов и их резервации на день двумя запросами
+        и строит по ним индекс занятости. Резервации из exclude_ids не учитываются
+        (например, те, что сейчас перепланируются).
+        """
+        return CalendarOccupancy.load(day, 1, device_types, exclude_ids).for_day(day)
+
+
+class CalendarOccupancy:
+    """
+    Календарь занятости устройств: отдельный DeviceOccupancy на каждый день.
+    Поиск окна в конкретный день работает только с интервалами этого дня,
+    поэтому стоимость запросов не растет с длиной горизонта планирования.
+    """
+
+    def __init__(self, devices: Iterable[Device] = ()):
+        self._devices: List[Device] = list(devices)
+        self._days: Dict[date, DeviceOccupancy] = {}
+
+    def for_day(self, day: date) -> DeviceOccupancy:
+        """Возвращает индекс занятости на день (создает пустой, если резерваций на этот день нет)."""
+        occupancy = self._days.get(day)
+        if occupancy is None:
+            occupancy = DeviceOccupancy(self._devices)
+            self._days[day] = occupancy
+        return occupancy
+
+    def reserve(self, id_device: int, start: datetime, end: datetime, parallel: bool = False):
+        """Отмечает интервал занятым в индексе дня, на который приходится его начало."""
+        self.for_day(start.date()).reserve(id_device, start, end, parallel)
+
+    @staticmethod
+    def load(first_day: date, days: int, device_types: Iterable[int], exclude_ids: Iterable[int] = ()) -> 'CalendarOccupancy':
+        """
+        Загружает устройства нужных типов и интервалы их резерваций на days дней начиная с first_day
+        двумя запросами и раскладывает интервалы по дням.
+        """
+        device_types = list(set(device_types))
+        exclude_ids = set(exclude_ids)
+        calendar = CalendarOccupancy(Device.find_by_type_devices(device_types))
+        device_ids = {device.id for device in calendar._devices}
+        intervals = Reservation.get_device_intervals_by_period(first_day, first_day + timedelta(days=days), device_types)
+        for reservation_id, id_device, start_date, end_date, is_parallel in intervals:
+            if reservation_id in exclude_ids:
+                continue
+            if id_device in device_ids and start_date and end_date:
+                calendar.reserve(id_device, start_date, end_date, bool(is_parallel))
+        return calendar
@@ -0,0 +1,115 @@
+import random
+import time
+from datetime import timedelta
+from typing import List, Optional, Tuple
+
+from core.config import SCHEDULE_OPTIMIZER_TIME_BUDGET
+from core.scheduling.engine import BatchPlan, ScheduleEngine
+
+
+class OptimizationStats:
+    """Статистика работы оптимизатора."""
+
+    def __init__(self, initial_makespan: timedelta):
+        self.iterations: int = 0 # Сколько соседних решений было построено и оценено
+        self.improvements: int = 0 # Сколько раз найдено лучшее решение
+        self.initial_makespan: timedelta = initial_makespan
+        self.best_makespan: timedelta = initial_makespan
+        self.initial_not_scheduled: int = 0
+        self.best_not_scheduled: int = 0
+        self.elapsed: float = 0.0 # Секунд потрачено
+
+    @property
+    def improvement(self) -> timedelta:
+        """
+        На сколько сократилось время окончания последней задачи по сравнению с жадным планом.
+        Может быть отрицательным, если лучший план размещает больше задач, но заканчивается позже.
+        """
+        return self.initial_makespan - self.best_makespan
+
+    @property
+    def scheduled_gain(self) -> int:
+        """На сколько задач меньше осталось не запланировано по сравнению с жадным планом."""
+        return self.initial_not_scheduled - self.best_not_scheduled
+
+
+class MakespanOptimizer:
+    """
+    Улучшает пакетный план локальным поиском по порядку протоколов.
+    Решение кодируется перестановкой экземпляров протоколов: она задает приоритеты
+    при списочном планировании (ScheduleEngine.plan_batch), поэтому порядок задач внутри
+    каждого протокола соблюдается автоматически, а устройство для каждой задачи выбирается
+    по самому раннему окончанию. Соседние решения получаются обменом двух протоколов
+    или переносом протокола на другую позицию. Поиск останавливается по истечении time_budget секунд.
+    """
+
+    def __init__(self, engine: ScheduleEngine, time_budget: float = SCHEDULE_OPTIMIZER_TIME_BUDGET, seed: Optional[int] = None):
+        self.engine: ScheduleEngine = engine
+        self.time_budget: float = time_budget
+        self._random = random.Random(seed)
+
+    @staticmethod
+    def _score(batch: BatchPlan) -> Tuple[int, timedelta]:
+        """Оценка плана: сначала число неразмещенных задач, затем время окончания последней задачи."""
+        return len(batch.tasks_not_scheduled), batch.makespan
+
+    def _decode(self, protocols, first_number_protocol, order: List[int]) -> BatchPlan:
+        """Строит план по перестановке order на копии индекса занятости."""
+        priorities = [0] * len(order)
+        for rank, index in enumerate(order):
+            priorities[index] = len(order) - rank # Чем раньше в перестановке, тем выше приоритет
+        return self.engine.plan_batch(protocols, first_number_protocol, priorities=priorities,
+                                      occupancy=self.engine.occupancy.copy(), quiet=True)
+
+    def _neighbour(self, order: List[int]) -> List[int]:
+        """Случайное соседнее решение: обмен двух позиций или перенос элемента."""
+        neighbour = list(order)
+        first, second = self._random.sample(range(len(neighbour)), 2)
+        if self._random.random() < 0.5:
+            neighbour[first], neighbour[second] = neighbour[second], neighbour[first]
+        else:
+            neighbour.insert(second, neighbour.pop(first))
+        return neighbour
+
+    def optimize(self, protocols: List[Tuple[str, List[str]]], first_number_protocol: Optional[int] = None) -> Tuple[BatchPlan, OptimizationStats]:
+        """
+        Возвращает лучший найденный план и статистику. Исходная точка - жадный план
+        (приоритет по оставшейся длительности). Лучший план учитывается в индексе занятости планировщика.
+        """
+        started = time.monotonic()
+        best = self.engine.plan_batch(protocols, first_number_protocol, occupancy=self.engine.occupancy.copy())
+        best_score = self._score(best)
+        stats = OptimizationStats(best.makespan)
+        stats.initial_not_scheduled = stats.best_not_scheduled = best_score[0]
+
+        # Начальная перестановка - протоколы по убыванию суммарной длительности (LPT)
+        durations = []
+        for _, task_names in protocols:
+            total = timedelta()
+            for task_name in task_names:
+                resolved = self.engine._resolve_task(task_name, quiet=True)
+                if resolved:
+                    total += resolved[0]
+            durations.append(total)
+        current = sorted(range(len(protocols)), key=lambda index: (-durations[index], index))
+        current_score = best_score
+
+        while len(current) > 1 and time.monotonic() - started < self.time_budget:
+            candidate = self._neighbour(current)
+            candidate_batch = self._decode(protocols, first_number_protocol, candidate)
+            candidate_score = self._score(candidate_batch)
+            stats.iterations += 1
+            if candidate_score <= current_score: # Разрешаем "боковые" шаги, чтобы выходить с плато
+                current, current_score = candidate, candidate_score
+            if candidate_score < best_score:
+                best, best_score = candidate_batch, candidate_score
+                stats.improvements += 1
+
+        for plan in best.plans:
+            for placement in plan.placements:
+                self.engine.occupancy.reserve(placement.id_device, placement.start_date, placement.end_date, placement.parallel)
+
+        stats.best_makespan = best.makespan
+        stats.best_not_scheduled = best_score[0]
+        stats.elapsed = time.monotonic() - started
+        return best, stats
@@ -0,0 +1,101 @@
+import logging
+from datetime import date
+from typing import List
+
+import psycopg2
+import psycopg2.extras
+
+from core.classes import (DatabaseError, Device, Protocol, RecordNotFoundError, Reservation,
+                          ScheduleConflictError, StandartTask)
+from core.config import SCHEDULE_HORIZON_DAYS
+from core.scheduling.engine import ProtocolPlan, ScheduleEngine
+from core.scheduling.occupancy import DeviceOccupancy
+from core.utils import dependencies
+
+
+def plan(type_protocol: str, day: date, horizon_days: int = SCHEDULE_HORIZON_DAYS) -> ProtocolPlan:
+    """
+    Строит план протокола на day (с переносом на следующие рабочие дни в пределах horizon_days)
+    только в памяти, ничего не записывая в БД. Номер протокола присваивается при записи (commit).
+    Статистика доступна через свойства плана: placements, tasks_not_scheduled, start_date, end_date, tasks_by_day.
+    """
+    protocol = Protocol.get_by_name(type_protocol)
+    if not protocol:
+        raise RecordNotFoundError(f"Протокол '{type_protocol}' не найден.")
+    engine = ScheduleEngine.load_for_day(day, protocol.list_standart_tasks, horizon_days=horizon_days)
+    return engine.plan_protocol(type_protocol, protocol.list_standart_tasks)
+
+
+def _check_occupancy(cursor, plans: List[ProtocolPlan]):
+    """
+    Проверяет по текущему состоянию БД, что все размещения планов по-прежнему помещаются
+    во вместимость устройств. Выбрасывает ScheduleConflictError, если нет.
+    """
+    placements = [placement for protocol_plan in plans for placement in protocol_plan.placements]
+    device_ids = list({placement.id_device for placement in placements})
+    cursor.execute(f"SELECT id, type_device, capacity FROM \"{Device.table}\" WHERE id = ANY(%s)", (device_ids,))
+    occupancy = DeviceOccupancy()
+    for record in cursor.fetchall():
+        occupancy.add_device(record['id'], record['type_device'], record['capacity'] or 1)
+
+    cursor.execute(f"""
+        SELECT r.id_device, r.start_date, r.end_date, COALESCE(st.is_parallel, FALSE) AS is_parallel
+        FROM "{Reservation.table}" r
+        LEFT JOIN "{StandartTask.table}" st ON st.name = r.name_task
+        WHERE r.id_device = ANY(%s)
+          AND r.start_date < %s AND r.end_date > %s
+    """, (device_ids, max(placement.end_date for placement in placements), min(placement.start_date for placement in placements)))
+    for record in cursor.fetchall():
+        occupancy.reserve(record['id_device'], record['start_date'], record['end_date'], record['is_parallel'])
+
+    for placement in placements:
+        if not occupancy.is_free(placement.id_device, placement.start_date, placement.end_date, placement.parallel):
+            raise ScheduleConflictError(
+                f"Устройство {placement.id_device} уже занято на {placement.start_date.strftime('%d.%m.%Y %H:%M')}-"
+                f"{placement.end_date.strftime('%H:%M')} (задача '{placement.name_task}'). Постройте план заново."
+            )
+        occupancy.reserve(placement.id_device, placement.start_date, placement.end_date, placement.parallel)
+
+
+def commit_many(plans: List[ProtocolPlan], assistants: List[int] = None) -> List[List[Reservation]]:
+    """
+    Записывает планы в БД одной транзакцией: блокирует запись резерваций, заново проверяет
+    занятость устройств, присваивает планам очередные номера протоколов и вставляет резервации
+    каждого плана через Reservation.add_many. Если занятость изменилась после построения планов,
+    ничего не записывает и выбрасывает ScheduleConflictError.
+    Возвращает сохраненные резервации каждого плана.
+    """
+    plans = [protocol_plan for protocol_plan in plans if protocol_plan.placements]
+    if not plans:
+        return []
+
+    try:
+        # Присоединяется к транзакции вызывающего кода, если она открыта (db_manager.transaction())
+        with dependencies.db_manager.transaction() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                # Блокировка конфликтует сама с собой: параллельные записи планов выполняются по очереди,
+                # а чтение расписания при этом не блокируется
+                cursor.execute(f"LOCK TABLE \"{Reservation.table}\" IN SHARE ROW EXCLUSIVE MODE")
+                _check_occupancy(cursor, plans)
+
+                cursor.execute(f"SELECT COALESCE(MAX(number_protocol), 0) + 1 AS next_number FROM \"{Reservation.table}\"")
+                next_number = cursor.fetchone()['next_number']
+
+            reservations_by_plan = []
+            for offset, protocol_plan in enumerate(plans):
+                protocol_plan.number_protocol = next_number + offset
+                reservations = protocol_plan.to_reservations(assistants)
+                Reservation.add_many(reservations, protocol_plan.number_protocol) # Присоединяется к транзакции, присваивает ID
+                reservations_by_plan.append(reservations)
+    except psycopg2.Error as e:
+        logging.error(f"Ошибка при записи плана в таблицу {Reservation.table}: {e}")
+        raise DatabaseError("Ошибка при записи плана в БД.") from e
+
+    logging.info(f"Записано планов: {len(plans)}, резерваций: {sum(len(reservations) for reservations in reservations_by_plan)}.")
+    return reservations_by_plan
+
+
+def commit(protocol_plan: ProtocolPlan, assistants: List[int] = None) -> List[Reservation]:
+    """Записывает план одного протокола в БД одной транзакцией (см. commit_many)."""
+    reservations_by_plan = commit_many([protocol_plan], assistants)
+    return reservations_by_plan[0] if reservations_by_plan else []
@@ -1,25 +1,50 @@
+import asyncio
+import functools
+import itertools
 import json
 import psycopg2
-from psycopg2 import pool  # Для пула соединений
+import psycopg2.extras
+import psycopg
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
 import logging
-from typing import Any, Dict, Optional, overload
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Any, Dict, Iterator, Optional, Tuple, overload
 
 from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.base import StorageKey, StateType
 
-from core.config import PG_DBNAME, PG_FSM_DBNAME, PG_HOST, PG_USER, PG_PORT
+from core.config import (PG_DBNAME, PG_FSM_DBNAME, PG_HOST, PG_USER, PG_PORT, PG_ASYNC_POOL_MIN_SIZE, PG_ASYNC_POOL_MAX_SIZE,
+                         PG_FSM_POOL_MIN_SIZE, PG_FSM_POOL_MAX_SIZE, PG_POOL_MIN_SIZE, PG_POOL_MAX_SIZE,
+                         PG_POOL_ACQUIRE_TIMEOUT, PG_POOL_HEALTH_CHECK_IDLE, PG_PREPARED_STATEMENTS,
+                         PG_ITERSIZE, PG_REPLICA_DSN, PG_REPLICA_CONNECT_TIMEOUT, PG_REPLICA_RETRY_INTERVAL, FSM_STATE_TTL_DAYS, FSM_SWEEP_BATCH_SIZE)
+from core.fsm_storage import FSMStorage
+from core.pool import ConnectionPool
+from core.statements import StatementCache
 from core.settings import PG_PASSWORD
 
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(levelname)s - %(message)s', )
 
 
+# Сессия соединений с репликой только читает: случайная запись на нее завершится ошибкой
+REPLICA_SESSION_OPTIONS = '-c default_transaction_read_only=on'
+
+
 class DatabaseConnection:
-    """Вспомогательный класс для управления подключением к базе данных (Singleton)."""
+    """
+    Вспомогательный класс для управления подключением к базе данных (Singleton).
+    Если задан replica_dsn, держит второй пул соединений с репликой только для чтения:
+    его выдает get_connection(read_only=True). После сбоя реплики чтение PG_REPLICA_RETRY_INTERVAL секунд
+    идет на основной сервер, затем реплика (и при необходимости ее пул) проверяется снова.
+    """
     _instances = {}  # Словарь для хранения экземпляров по имени БД
 
-    def __new__(cls, host, database, user, password, port=None):
-        key = (host, database, user, password, port)
+    def __new__(cls, host, database, user, password, port=None, replica_dsn=None):
+        key = (host, database, user, password, port, replica_dsn)
         if key not in cls._instances:
             instance = super(DatabaseConnection, cls).__new__(cls)
             instance.host = host
@@ -27,7 +52,10 @@ class DatabaseConnection:
             instance.user = user
             instance.password = password
             instance.port = port
+            instance.replica_dsn = replica_dsn
             instance._conn_pool = None
+            instance._replica_pool = None
+            instance._replica_retry_at = 0.0 # До этого момента (time.monotonic) реплика считается недоступной
             cls._instances[key] = instance
         return cls._instances[key]
 
@@ -35,6 +63,11 @@ class DatabaseConnection:
         """Инициализирует пул соединений после создания БД"""
         if self._conn_pool is None:
             self._create_connection_pool()
+        if self.replica_dsn and self._replica_pool is None:
+            try:
+                self._create_replica_pool()
+            except psycopg2.Error as e:
+                self.mark_replica_down(e) # Чтение пойдет на основной сервер, пул будет создан после паузы
 
     def _create_connection_pool(self):
         """Создает пул соединений."""
@@ -51,8 +84,9 @@ class DatabaseConnection:
             # print("Password (repr):", repr(self.password))
             # print("Port (repr):", repr(self.port))
 
-            self._conn_pool = pool.SimpleConnectionPool(
-                minconn=1, maxconn=3,  # Настройте по необходимости
+            self._conn_pool = ConnectionPool(
+                minconn=PG_POOL_MIN_SIZE, maxconn=PG_POOL_MAX_SIZE,
+                timeout=PG_POOL_ACQUIRE_TIMEOUT, health_check_idle=PG_POOL_HEALTH_CHECK_IDLE,
                 host=self.host, database=self.database,
                 user=self.user, password=self.password,
                 port=self.port,
@@ -63,8 +97,33 @@ class DatabaseConnection:
             logging.error(f"Ошибка при создании пула соединений: {e}")
             raise
 
-    def get_connection(self):
-        """Получает соединение из пула."""
+    def _create_replica_pool(self):
+        """Создает пул соединений с репликой только для чтения."""
+        credentials = {} if 'password' in self.replica_dsn else {'password': self.password}
+        try:
+            self._replica_pool = ConnectionPool(
+                minconn=PG_POOL_MIN_SIZE, maxconn=PG_POOL_MAX_SIZE,
+                timeout=PG_POOL_ACQUIRE_TIMEOUT, health_check_idle=PG_POOL_HEALTH_CHECK_IDLE,
+                dsn=self.replica_dsn, client_encoding='utf8', options=REPLICA_SESSION_OPTIONS,
+                connect_timeout=PG_REPLICA_CONNECT_TIMEOUT, **credentials
+            )
+            logging.info("Пул соединений с репликой успешно создан.")
+        except psycopg2.Error as e:
+            logging.error(f"Ошибка при создании пула соединений с репликой: {e}")
+            raise
+
+    def get_connection(self, read_only: bool = False):
+        """
+        Получает соединение из пула. При read_only=True и заданной реплике - соединение с репликой;
+        если реплика недоступна (или недавно была недоступна), соединение с основным сервером.
+        """
+        if read_only and self.replica_dsn and time.monotonic() >= self._replica_retry_at:
+            try:
+                if self._replica_pool is None:
+                    self._create_replica_pool()
+                return self._replica_pool.getconn()
+            except psycopg2.Error as e:
+                self.mark_replica_down(e)
         if self._conn_pool is None:
             self._create_connection_pool()
         try:
@@ -73,17 +132,40 @@ class DatabaseConnection:
             logging.error(f"Ошибка при получении соединения из пула: {e}")
             raise
 
+    def is_replica_connection(self, conn) -> bool:
+        """Проверяет, что conn получено из пула реплики."""
+        return self._replica_pool is not None and self._replica_pool.owns(conn)
+
+    def mark_replica_down(self, error):
+        """Отправляет чтение на основной сервер на PG_REPLICA_RETRY_INTERVAL секунд после сбоя реплики."""
+        self._replica_retry_at = time.monotonic() + PG_REPLICA_RETRY_INTERVAL
+        logging.warning(f"Реплика недоступна, чтение с основного сервера в течение {PG_REPLICA_RETRY_INTERVAL:.0f} с: {error}")
+
     def return_connection(self, conn):
-        """Возвращает соединение в пул."""
-        if self._conn_pool:
+        """Возвращает соединение в пул, из которого оно было получено."""
+        if self._replica_pool and self._replica_pool.owns(conn):
+            self._replica_pool.putconn(conn)
+        elif self._conn_pool:
             self._conn_pool.putconn(conn)
 
+    def pool_stats(self) -> dict:
+        """Возвращает счетчики пула соединений (пустой словарь, если пул не создан)."""
+        return self._conn_pool.stats() if self._conn_pool else {}
+
+    def replica_pool_stats(self) -> dict:
+        """Возвращает счетчики пула соединений с репликой (пустой словарь, если реплика не используется)."""
+        return self._replica_pool.stats() if self._replica_pool else {}
+
     def close_all_connections(self):
         """Закрывает все соединения в пуле."""
         if self._conn_pool:
             self._conn_pool.closeall()
             logging.info("Все соединения пула закрыты.")
             self._conn_pool = None
+        if self._replica_pool:
+            self._replica_pool.closeall()
+            logging.info("Все соединения пула реплики закрыты.")
+            self._replica_pool = None
 
     def create_database_if_not_exists(self):
         """Создает базу данных, если она не существует."""
@@ -120,6 +202,61 @@ class DatabaseConnection:
         self.close_all_connections()
 
 
+# Таблица состояний FSM (общая для PostgreSQLStorage и AsyncPostgreSQLStorage). Данные хранятся в JSONB:
+# драйвер сам разбирает их в dict, а update_data дописывает изменившиеся ключи на сервере (data || ...)
+FSM_STATES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        chat_id BIGINT,
+        user_id BIGINT,
+        state TEXT,
+        data JSONB NOT NULL DEFAULT '{}',
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (chat_id, user_id)
+    )
+"""
+
+# Слияние данных на сервере: для новой записи данные вставляются как есть, для существующей ключи дописываются
+FSM_MERGE_DATA_SQL = """
+    INSERT INTO fsm_states (chat_id, user_id, state, data)
+    VALUES (%s, %s, '', %s::jsonb)
+    ON CONFLICT (chat_id, user_id) DO UPDATE SET data = fsm_states.data || EXCLUDED.data, updated_at = now()
+    RETURNING data
+"""
+
+# Перевод столбца data из TEXT (прежняя схема) в JSONB; для уже переведенной таблицы ничего не делает
+FSM_DATA_TO_JSONB_SQL = """
+    DO $$
+    BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'fsm_states' AND column_name = 'data') = 'text' THEN
+            ALTER TABLE fsm_states ALTER COLUMN data TYPE JSONB USING COALESCE(NULLIF(data, ''), '{}')::jsonb;
+            ALTER TABLE fsm_states ALTER COLUMN data SET DEFAULT '{}';
+            ALTER TABLE fsm_states ALTER COLUMN data SET NOT NULL;
+        END IF;
+    END
+    $$
+"""
+
+# Время последнего изменения записи (прежняя схема без него) и индекс для удаления устаревших записей
+FSM_UPDATED_AT_SQL = "ALTER TABLE fsm_states ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()"
+FSM_UPDATED_AT_INDEX_SQL = "CREATE INDEX IF NOT EXISTS fsm_states_updated_at_idx ON fsm_states (updated_at)"
+
+# Запросы создания и обновления схемы fsm_states, выполняются по порядку при инициализации хранилища
+FSM_STATES_SCHEMA_SQL = (FSM_STATES_TABLE_SQL, FSM_DATA_TO_JSONB_SQL, FSM_UPDATED_AT_SQL, FSM_UPDATED_AT_INDEX_SQL)
+
+# Удаление пачки записей, не изменявшихся дольше заданного числа дней (по индексу fsm_states_updated_at_idx).
+# Записи, которые сейчас изменяются, пропускаются и будут удалены при следующем проходе, если устареют
+FSM_SWEEP_SQL = """
+    DELETE FROM fsm_states WHERE (chat_id, user_id) IN (
+        SELECT chat_id, user_id FROM fsm_states
+        WHERE updated_at < now() - make_interval(days => %s)
+        ORDER BY updated_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+"""
+
+
 class PostgreSQLStorage(BaseStorage):
     """Хранилище состояний FSM (Singleton).""" 
     _instance = None
@@ -154,26 +291,18 @@ class PostgreSQLStorage(BaseStorage):
         return self._db_conn.get_connection()
 
     def _init_tables(self):
-        """Создает таблицу fsm_states, если она не существует."""
+        """Создает таблицу fsm_states, если она не существует, и обновляет ее схему (FSM_STATES_SCHEMA_SQL)."""
         conn = self._connect()
         try:
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS fsm_states (
-                        chat_id BIGINT,
-                        user_id BIGINT,
-                        state TEXT,
-                        data TEXT,
-                        PRIMARY KEY (chat_id, user_id)
-                    )
-                """)
+                for statement in FSM_STATES_SCHEMA_SQL:
+                    cursor.execute(statement)
                 conn.commit()
                 logging.info("Таблица fsm_states успешно создана (если не существовала).")
         except psycopg2.Error as e:
             logging.error(f"Ошибка при создании таблицы fsm_states: {e}")
         finally:
-            if conn:
-                conn.close()
+            self._db_conn.return_connection(conn)
 
     async def get_state(self, key: StorageKey) -> Optional[str]:
         conn = self._connect()
@@ -197,9 +326,9 @@ class PostgreSQLStorage(BaseStorage):
                 if state_name:
                     cursor.execute("""
                         INSERT INTO fsm_states (chat_id, user_id, state, data)
-                        VALUES (%s, %s, %s, COALESCE((SELECT data FROM fsm_states WHERE chat_id = %s AND user_id = %s), '{}'))
-                        ON CONFLICT (chat_id, user_id) DO UPDATE SET state = EXCLUDED.state, data = fsm_states.data;
-                    """, (key.chat_id, key.user_id, state_name, key.chat_id, key.user_id))
+                        VALUES (%s, %s, %s, '{}')
+                        ON CONFLICT (chat_id, user_id) DO UPDATE SET state = EXCLUDED.state, updated_at = now();
+                    """, (key.chat_id, key.user_id, state_name))
                     logging.info(f"Состояние пользователя {key.user_id} в чате {key.chat_id} установлено на '{state_name}'.")
                 else:
                     cursor.execute("DELETE FROM fsm_states WHERE chat_id = %s AND user_id = %s",
@@ -219,7 +348,7 @@ class PostgreSQLStorage(BaseStorage):
                                (key.chat_id, key.user_id))
                 result = cursor.fetchone()
                 if result:
-                    data = json.loads(result[0])
+                    data = result[0] or {}
                     logging.info(f"Данные пользователя {key.user_id} в чате {key.chat_id} получены.")
                     return data
                 else:
@@ -237,9 +366,9 @@ class PostgreSQLStorage(BaseStorage):
             with conn.cursor() as cursor:
                 cursor.execute("""
                     INSERT INTO fsm_states (chat_id, user_id, state, data)
-                    VALUES (%s, %s, COALESCE((SELECT state FROM fsm_states WHERE chat_id = %s AND user_id = %s), ''), %s)
-                    ON CONFLICT (chat_id, user_id) DO UPDATE SET data = EXCLUDED.data;
-                """, (key.chat_id, key.user_id, key.chat_id, key.user_id, json.dumps(data)))
+                    VALUES (%s, %s, '', %s::jsonb)
+                    ON CONFLICT (chat_id, user_id) DO UPDATE SET data = EXCLUDED.data, updated_at = now();
+                """, (key.chat_id, key.user_id, json.dumps(data)))
                 conn.commit()
                 logging.info(f"Данные пользователя {key.user_id} в чате {key.chat_id} установлены: {data}")
         except psycopg2.Error as e:
@@ -247,11 +376,24 @@ class PostgreSQLStorage(BaseStorage):
         finally:
             self._db_conn.return_connection(conn)
 
-    async def update_data(self, key: StorageKey, data: dict) -> None:
-        current_data = await self.get_data(key)
-        updated_data = {**current_data, **data}
-        await self.set_data(key, updated_data)
-        logging.info(f"Данные пользователя {key.user_id} в чате {key.chat_id} обновлены: {data}")
+    async def update_data(self, key: StorageKey, data: dict) -> dict:
+        """
+        Дописывает ключи data к данным пользователя одним запросом на сервере (data || ...),
+        без чтения всех данных: одновременные обновления разных ключей не теряются. Возвращает итоговые данные.
+        """
+        conn = self._connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(FSM_MERGE_DATA_SQL, (key.chat_id, key.user_id, json.dumps(data)))
+                result = cursor.fetchone()
+                conn.commit()
+                logging.info(f"Данные пользователя {key.user_id} в чате {key.chat_id} обновлены: {data}")
+                return result[0] if result else {}
+        except psycopg2.Error as e:
+            logging.error(f"Ошибка при обновлении данных пользователя {key.user_id} в чате {key.chat_id}: {e}")
+            return {}
+        finally:
+            self._db_conn.return_connection(conn)
 
     async def reset_state(self, key: StorageKey, with_data: bool = True) -> None:
         conn = self._connect()
@@ -263,7 +405,7 @@ class PostgreSQLStorage(BaseStorage):
                     logging.info(f"Состояние и данные пользователя {key.user_id} в чате {key.chat_id} сброшены.")
                 else:
                     cursor.execute(
-                        "UPDATE fsm_states SET state = NULL, data = '{}' WHERE chat_id = %s AND user_id = %s",
+                        "UPDATE fsm_states SET state = NULL, data = '{}', updated_at = now() WHERE chat_id = %s AND user_id = %s",
                         (key.chat_id, key.user_id)
                     )
                     logging.info(f"Состояние пользователя {key.user_id} в чате {key.chat_id} сброшено (данные очищены).")
@@ -283,6 +425,248 @@ class PostgreSQLStorage(BaseStorage):
         pass
 
 
+class AsyncPostgreSQLStorage(FSMStorage):
+    """
+    Асинхронное хранилище состояний FSM (Singleton) на psycopg 3 с собственным пулом AsyncConnectionPool.
+    Хранит данные в той же таблице fsm_states и с той же семантикой, что и PostgreSQLStorage,
+    но не блокирует цикл событий: обращения к FSM разных пользователей выполняются одновременно.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(AsyncPostgreSQLStorage, cls).__new__(cls)
+            cls._instance._db_conn = DatabaseConnection(
+                host=PG_HOST,
+                database=PG_FSM_DBNAME,
+                user=PG_USER,
+                password=PG_PASSWORD,
+                port=PG_PORT
+            )
+            cls._instance._pool = None
+        return cls._instance
+
+    def __init__(self):
+        # Инициализация происходит в __new__ только один раз
+        pass
+
+    async def initialize(self):
+        """Создает БД (при необходимости), открывает пул соединений и создает таблицу. Вызывается из работающего цикла событий."""
+        if self._pool is not None:
+            return
+        # Разовая синхронная операция при запуске
+        self._db_conn.create_database_if_not_exists()
+        conninfo = make_conninfo(host=PG_HOST, dbname=PG_FSM_DBNAME, user=PG_USER, password=PG_PASSWORD,
+                                 port=PG_PORT, client_encoding='utf8')
+        self._pool = AsyncConnectionPool(conninfo, min_size=PG_FSM_POOL_MIN_SIZE, max_size=PG_FSM_POOL_MAX_SIZE, open=False)
+        await self._pool.open()
+        await self._init_tables()
+        self._start_sweeping()
+
+    def _connect(self):
+        """Возвращает контекстный менеджер соединения из пула (транзакция фиксируется при выходе без ошибки)."""
+        if self._pool is None:
+            raise RuntimeError("AsyncPostgreSQLStorage не инициализировано: вызовите await initialize().")
+        return self._pool.connection()
+
+    async def _init_tables(self):
+        """Создает таблицу fsm_states, если она не существует, и обновляет ее схему (FSM_STATES_SCHEMA_SQL)."""
+        try:
+            async with self._connect() as conn:
+                for statement in FSM_STATES_SCHEMA_SQL:
+                    await conn.execute(statement)
+            logging.info("Таблица fsm_states успешно создана (если не существовала).")
+        except psycopg.Error as e:
+            logging.error(f"Ошибка при создании таблицы fsm_states: {e}")
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        try:
+            async with self._connect() as conn:
+                cursor = await conn.execute("SELECT state FROM fsm_states WHERE chat_id = %s AND user_id = %s",
+                                            (key.chat_id, key.user_id))
+                result = await cursor.fetchone()
+                return result[0] if result else None
+        except psycopg.Error as e:
+            logging.error(f"Ошибка при получении состояния пользователя {key.user_id} в чате {key.chat_id}: {e}")
+            return None
+
+    async def set_state(self, key: StorageKey, state: Optional[StateType] = None) -> None:
+        try:
+            async with self._connect() as conn:
+                if state:
+                    await conn.execute("""
+                        INSERT INTO fsm_states (chat_id, user_id, state, data)
+                        VALUES (%s, %s, %s, '{}')
+                        ON CONFLICT (chat_id, user_id) DO UPDATE SET state = EXCLUDED.state, updated_at = now();
+                    """, (key.chat_id, key.user_id, state))
+                    logging.info(f"Состояние пользователя {key.user_id} в чате {key.chat_id} установлено на '{state}'.")
+                else:
+                    await conn.execute("DELETE FROM fsm_states WHERE chat_id = %s AND user_id = %s",
+                                       (key.chat_id, key.user_id))
+                    logging.info(f"Состояние пользователя {key.user_id} в чате {key.chat_id} сброшено.")
+        except psycopg.Error as e:
+            logging.error(f"Ошибка при установке состояния пользователя {key.user_id} в чате {key.chat_id}: {e}")
+
+    async def get_data(self, key: StorageKey) -> dict:
+        try:
+            async with self._connect() as conn:
+                cursor = await conn.execute("SELECT data FROM fsm_states WHERE chat_id = %s AND user_id = %s",
+                                            (key.chat_id, key.user_id))
+                result = await cursor.fetchone()
+                if result:
+                    return result[0] or {}
+                return {}
+        except psycopg.Error as e:
+            logging.error(f"Ошибка при получении данных пользователя {key.user_id} в чате {key.chat_id}: {e}")
+            return {}
+
+    async def set_data(self, key: StorageKey, data: dict) -> None:
+        try:
+            async with self._connect() as conn:
+                await conn.execute("""
+                    INSERT INTO fsm_states (chat_id, user_id, state, data)
+                    VALUES (%s, %s, '', %s::jsonb)
+                    ON CONFLICT (chat_id, user_id) DO UPDATE SET data = EXCLUDED.data, updated_at = now();
+                """, (key.chat_id, key.user_id, json.dumps(data)))
+        except psycopg.Error as e:
+            logging.error(f"Ошибка при установке данных пользователя {key.user_id} в чате {key.chat_id}: {e}")
+
+    async def update_data(self, key: StorageKey, data: dict) -> dict:
+        """Дописывает ключи data к данным пользователя одним запросом на сервере. Возвращает итоговые данные."""
+        try:
+            async with self._connect() as conn:
+                cursor = await conn.execute(FSM_MERGE_DATA_SQL, (key.chat_id, key.user_id, json.dumps(data)))
+                result = await cursor.fetchone()
+                return result[0] if result else {}
+        except psycopg.Error as e:
+            logging.error(f"Ошибка при обновлении данных пользователя {key.user_id} в чате {key.chat_id}: {e}")
+            return {}
+
+    async def get_snapshot(self, key: StorageKey) -> Tuple[Optional[str], dict]:
+        """Загружает состояние и данные пользователя одним запросом."""
+        try:
+            async with self._connect() as conn:
+                cursor = await conn.execute("SELECT state, data FROM fsm_states WHERE chat_id = %s AND user_id = %s",
+                                            (key.chat_id, key.user_id))
+                result = await cursor.fetchone()
+                if result:
+                    return result[0], result[1] or {}
+                return None, {}
+        except psycopg.Error as e:
+            logging.error(f"Ошибка при получении состояния и данных пользователя {key.user_id} в чате {key.chat_id}: {e}")
+            return None, {}
+
+    async def set_snapshot(self, key: StorageKey, state: Optional[str], data: dict) -> None:
+        """
+        Записывает состояние и данные пользователя одним запросом. Без состояния и данных
+        запись удаляется, как и при set_state(None).
+        """
+        try:
+            async with self._connect() as conn:
+                if state is None and not data:
+                    await conn.execute("DELETE FROM fsm_states WHERE chat_id = %s AND user_id = %s",
+                                       (key.chat_id, key.user_id))
+                else:
+                    await conn.execute("""
+                        INSERT INTO fsm_states (chat_id, user_id, state, data)
+                        VALUES (%s, %s, %s, %s::jsonb)
+                        ON CONFLICT (chat_id, user_id) DO UPDATE SET state = EXCLUDED.state, data = EXCLUDED.data, updated_at = now();
+                    """, (key.chat_id, key.user_id, state, json.dumps(data)))
+        except psycopg.Error as e:
+            logging.error(f"Ошибка при записи состояния и данных пользователя {key.user_id} в чате {key.chat_id}: {e}")
+
+    async def reset_state(self, key: StorageKey, with_data: bool = True) -> None:
+        try:
+            async with self._connect() as conn:
+                if with_data:
+                    await conn.execute("DELETE FROM fsm_states WHERE chat_id = %s AND user_id = %s",
+                                       (key.chat_id, key.user_id))
+                else:
+                    await conn.execute("UPDATE fsm_states SET state = NULL, data = '{}', updated_at = now() WHERE chat_id = %s AND user_id = %s",
+                                       (key.chat_id, key.user_id))
+        except psycopg.Error as e:
+            logging.error(f"Ошибка при сбросе состояния пользователя {key.user_id} в чате {key.chat_id}: {e}")
+
+    async def sweep_expired(self, ttl_days: int = FSM_STATE_TTL_DAYS, batch_size: int = FSM_SWEEP_BATCH_SIZE) -> int:
+        """
+        Удаляет состояния и данные пользователей, не изменявшиеся дольше ttl_days дней (брошенные на середине диалоги).
+        Удаляет пачками по batch_size записей, каждая пачка - отдельная короткая транзакция,
+        чтобы не держать блокировки и не мешать обработке обновлений. Возвращает число удаленных записей.
+        """
+        deleted = 0
+        while True:
+            try:
+                async with self._connect() as conn:
+                    cursor = await conn.execute(FSM_SWEEP_SQL, (ttl_days, batch_size))
+                    count = cursor.rowcount
+            except psycopg.Error as e:
+                logging.error(f"Ошибка при удалении устаревших состояний FSM: {e}")
+                break
+            deleted += count
+            if count < batch_size:
+                break
+            await asyncio.sleep(0) # Между пачками отдаем цикл событий обработке обновлений
+        if deleted:
+            logging.info(f"Удалено устаревших состояний FSM: {deleted}.")
+        return deleted
+
+    async def close(self) -> None:
+        """Останавливает удаление устаревших состояний и закрывает все соединения пула."""
+        self._stop_sweeping()
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+            logging.info("Пул соединений хранилища FSM закрыт.")
+
+    async def wait_closed(self) -> None:
+        """Позволяет дождаться закрытия хранилища."""
+        pass
+
+
+class TransactionAbortedError(psycopg2.Error):
+    """Исключение, если запрос внутри DatabaseManager.transaction() завершился ошибкой и транзакция откачена."""
+    pass
+
+
+class _Transaction:
+    """Соединение текущей транзакции DatabaseManager.transaction() и признак ошибки в ней."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.failed: bool = False
+
+
+# Транзакция, к которой присоединяются запросы DatabaseManager (своя у каждой задачи asyncio и потока)
+_current_transaction: ContextVar[Optional[_Transaction]] = ContextVar('current_transaction', default=None)
+
+# "Чтение своих записей": после записи чтение в том же обработчике (задаче asyncio) идет на основной сервер,
+# а не на реплику, которая может отставать. Общий для DatabaseManager и AsyncDatabaseManager
+_read_from_primary: ContextVar[bool] = ContextVar('read_from_primary', default=False)
+
+
+@contextmanager
+def read_from_primary():
+    """Направляет чтение внутри блока на основной сервер, даже если записей в нем еще не было."""
+    token = _read_from_primary.set(True)
+    try:
+        yield
+    finally:
+        _read_from_primary.reset(token)
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """
+    Выполняет синхронную единицу работы с DatabaseManager (методы моделей, planner, транзакцию) в потоке,
+    не блокируя цикл событий, как asyncio.to_thread. Если в потоке была запись, дальнейшее чтение
+    в текущем обработчике тоже идет на основной сервер.
+    """
+    context = copy_context()
+    result = await asyncio.get_running_loop().run_in_executor(None, functools.partial(context.run, func, *args, **kwargs))
+    if context.get(_read_from_primary):
+        _read_from_primary.set(True) # Запись в потоке видна только в его копии контекста
+    return result
+
+
 class DatabaseManager:
     _instance = None
 
@@ -294,8 +678,11 @@ class DatabaseManager:
                 database=PG_DBNAME,
                 user=PG_USER,
                 password=PG_PASSWORD,
-                port=PG_PORT
+                port=PG_PORT,
+                replica_dsn=PG_REPLICA_DSN
             )
+            cls._instance._statements = StatementCache(prepare=PG_PREPARED_STATEMENTS)
+            cls._instance._cursor_numbers = itertools.count(1) # Уникальные имена курсоров iter_records
         return cls._instance
 
     def __init__(self):
@@ -311,9 +698,80 @@ class DatabaseManager:
         # Создаем таблицы
         self._init_tables()
 
-    def _connect(self):
-        """Получает соединение из пула."""
-        return self._db_conn.get_connection()
+    def _connect(self, read_only: bool = False):
+        """
+        Получает соединение из пула. Внутри transaction() возвращает соединение текущей транзакции:
+        методы менеджера присоединяются к ней, а фиксация, откат и возврат соединения откладываются до ее завершения.
+        Чтение (read_only=True) идет на реплику, если она задана и в текущем обработчике еще не было записи.
+        """
+        transaction = _current_transaction.get()
+        if transaction is not None:
+            return transaction.conn
+        return self._db_conn.get_connection(read_only=read_only and not _read_from_primary.get())
+
+    def _in_transaction(self, conn) -> bool:
+        """Проверяет, что conn - соединение текущей транзакции transaction()."""
+        transaction = _current_transaction.get()
+        return transaction is not None and transaction.conn is conn
+
+    def _commit(self, conn):
+        """Фиксирует изменения; внутри transaction() фиксация выполняется при выходе из нее."""
+        _read_from_primary.set(True) # Дальнейшее чтение в этом обработчике должно видеть запись
+        if not self._in_transaction(conn):
+            conn.commit()
+
+    def _rollback(self, conn):
+        """
+        Откатывает изменения после ошибки. Внутри transaction() только помечает транзакцию как неудавшуюся:
+        откат выполнится при выходе из нее, а не посреди единицы работы.
+        """
+        if self._in_transaction(conn):
+            _current_transaction.get().failed = True
+        else:
+            conn.rollback()
+
+    def _release(self, conn):
+        """Возвращает соединение в пул; соединение транзакции возвращается при выходе из transaction()."""
+        if not self._in_transaction(conn):
+            self._db_conn.return_connection(conn)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Единица работы: все запросы DatabaseManager и методов моделей внутри блока
+        with db_manager.transaction(): выполняются на одном соединении и фиксируются одним COMMIT
+        при выходе из блока. Если в блоке выброшено исключение или один из запросов завершился ошибкой,
+        все изменения откатываются (во втором случае выбрасывается TransactionAbortedError).
+        Вложенный transaction() присоединяется к внешней транзакции; исключение во вложенном блоке откатывает
+        внешнюю транзакцию, даже если его перехватили. Возвращает соединение транзакции.
+        """
+        current = _current_transaction.get()
+        if current is not None:
+            try:
+                yield current.conn
+            except BaseException:
+                current.failed = True # Ошибку могут перехватить снаружи вложенного блока, внешняя транзакция все равно откатится
+                raise
+            return
+
+        conn = self._db_conn.get_connection()
+        transaction = _Transaction(conn)
+        token = _current_transaction.set(transaction)
+        try:
+            yield conn
+            if transaction.failed:
+                raise TransactionAbortedError("Запрос внутри транзакции завершился ошибкой, изменения отменены.")
+            conn.commit()
+            _read_from_primary.set(True)
+        except BaseException:
+            try:
+                conn.rollback()
+            except psycopg2.Error as e:
+                logging.error(f"Ошибка при откате транзакции: {e}")
+            raise
+        finally:
+            _current_transaction.reset(token)
+            self._db_conn.return_connection(conn)
 
     def _init_tables(self):
         """Создает таблицы в базе данных."""
@@ -347,6 +805,7 @@ class DatabaseManager:
                 name TEXT,
                 name_cabinet TEXT,
                 active BOOLEAN,
+                capacity INTEGER DEFAULT 1,
                 PRIMARY KEY (id, type_device),
                 FOREIGN KEY (name_cabinet) REFERENCES \"Cabinets\"(name)
             )
@@ -380,6 +839,22 @@ class DatabaseManager:
                 FOREIGN KEY (type_protocol) REFERENCES \"Protocols\"(name),
                 FOREIGN KEY (name_task) REFERENCES \"StandartTasks\"(name)
             )
+            """,
+            # Миграция для баз, созданных до появления вместимости устройств
+            """
+            ALTER TABLE \"Devices\" ADD COLUMN IF NOT EXISTS capacity INTEGER DEFAULT 1
+            """,
+            # Индексы резерваций: выборки за день (start_date >= ... AND start_date < ...)
+            """
+            CREATE INDEX IF NOT EXISTS reservations_start_date_idx ON \"Reservations\" (start_date)
+            """,
+            # Проверки пересечения резерваций устройства (id_device = ... AND start_date < ... AND end_date > ...)
+            """
+            CREATE INDEX IF NOT EXISTS reservations_device_period_idx ON \"Reservations\" (id_device, start_date, end_date)
+            """,
+            # Поиск резерваций ассистента (assistants @> '[id]')
+            """
+            CREATE INDEX IF NOT EXISTS reservations_assistants_idx ON \"Reservations\" USING GIN (assistants jsonb_path_ops)
             """
         ]
 
@@ -400,6 +875,18 @@ class DatabaseManager:
         self._db_conn.close_all_connections()
         logging.info("Соединение с базой данных закрыто.")
 
+    def pool_stats(self) -> dict:
+        """Счетчики пула соединений: занято, ожидают, время получения соединения, таймауты."""
+        return self._db_conn.pool_stats()
+
+    def replica_pool_stats(self) -> dict:
+        """Счетчики пула соединений с репликой (пустой словарь, если реплика не используется)."""
+        return self._db_conn.replica_pool_stats()
+
+    def statement_stats(self) -> dict:
+        """Счетчики кэша запросов: попадания, число PREPARE и время подготовки запросов сервером."""
+        return self._statements.stats()
+
     def insert(self, table_name: str, columns: list, values: list, use_id: bool = False):
         if len(columns) != len(values):
             logging.error("Ошибка: Количество столбцов и значений должно совпадать.")
@@ -421,52 +908,137 @@ class DatabaseManager:
                     filtered_columns.insert(0, 'id')
                     filtered_values.insert(0, order_number)
 
-                placeholders = ", ".join("%s" for _ in filtered_columns)
-                insert_query = f"INSERT INTO \"{table_name}\" ({', '.join(filtered_columns)}) VALUES ({placeholders})"
-                cursor.execute(insert_query, filtered_values)
-                conn.commit()
+                statement = self._statements.get('insert', table_name, filtered_columns)
+                self._statements.execute(cursor, statement, filtered_values)
+                self._commit(conn)
                 logging.info(f"Запись успешно добавлена в таблицу {table_name}.")
                 return order_number if table_name == "Orders" else True
         except psycopg2.Error as e:
+            self._rollback(conn)
             logging.error(f"Ошибка при вставке данных в таблицу {table_name}: {e}")
             return None
         finally:
-            self._db_conn.return_connection(conn)
+            self._release(conn)
+
+    def insert_many(self, table_name: str, columns: list, rows: list, returning: str = None):
+        """
+        Вставляет несколько строк одним многострочным INSERT в одной транзакции.
+        Если указан returning, возвращает список значений этого столбца для вставленных строк
+        (в порядке rows), иначе True. При ошибке откатывает транзакцию и возвращает None.
+        """
+        if any(len(row) != len(columns) for row in rows):
+            logging.error("Ошибка: Количество столбцов и значений должно совпадать.")
+            return None
+        if not rows:
+            return [] if returning else True
 
-    def find_records(self, table_name: str, search_columns: list = None, search_values: list = None, multiple: bool = False, custom_query: str = None, query_params: tuple = None):
         conn = self._connect()
         try:
             with conn.cursor() as cursor:
-                if custom_query:
-                    cursor.execute(custom_query, query_params)
-                elif search_columns and search_values:
-                    if len(search_columns) != len(search_values):
-                        raise ValueError("Количество столбцов и значений должно совпадать")
-                    where_conditions = " AND ".join([f"{column} = %s" for column in search_columns])
-                    query = f"SELECT * FROM \"{table_name}\" WHERE {where_conditions}"
-                    cursor.execute(query, tuple(search_values))
-                else:
-                    query = f"SELECT * FROM \"{table_name}\""
-                    cursor.execute(query)
+                insert_query = f"INSERT INTO \"{table_name}\" ({', '.join(columns)}) VALUES %s"
+                if returning:
+                    insert_query += f" RETURNING {returning}"
+                result = psycopg2.extras.execute_values(cursor, insert_query, rows, page_size=len(rows), fetch=bool(returning))
+                self._commit(conn)
+                logging.info(f"{len(rows)} записей успешно добавлено в таблицу {table_name}.")
+                return [record[0] for record in result] if returning else True
+        except psycopg2.Error as e:
+            self._rollback(conn)
+            logging.error(f"Ошибка при пакетной вставке данных в таблицу {table_name}: {e}")
+            return None
+        finally:
+            self._release(conn)
 
-                if multiple:
-                    records = cursor.fetchall()
+    def _fetch_records(self, conn, table_name: str, search_columns: list, search_values: list, multiple: bool,
+                       custom_query: str, query_params: tuple):
+        """Выполняет выборку find_records на соединении conn."""
+        with conn.cursor() as cursor:
+            if custom_query:
+                cursor.execute(custom_query, query_params)
+            elif search_columns and search_values:
+                if len(search_columns) != len(search_values):
+                    raise ValueError("Количество столбцов и значений должно совпадать")
+                statement = self._statements.get('select', table_name, condition_columns=search_columns)
+                self._statements.execute(cursor, statement, tuple(search_values))
+            else:
+                self._statements.execute(cursor, self._statements.get('select', table_name))
+
+            if multiple:
+                records = cursor.fetchall()
+                column_names = [desc[0] for desc in cursor.description]
+                return [dict(zip(column_names, record)) for record in records]
+            else:
+                record = cursor.fetchone()
+                if record:
                     column_names = [desc[0] for desc in cursor.description]
-                    return [dict(zip(column_names, record)) for record in records]
-                else:
-                    record = cursor.fetchone()
-                    if record:
-                        column_names = [desc[0] for desc in cursor.description]
-                        return dict(zip(column_names, record))
-                    return None
+                    return dict(zip(column_names, record))
+                return None
+
+    def find_records(self, table_name: str, search_columns: list = None, search_values: list = None, multiple: bool = False, custom_query: str = None, query_params: tuple = None):
+        conn = self._connect(read_only=True)
+        try:
+            try:
+                return self._fetch_records(conn, table_name, search_columns, search_values, multiple, custom_query, query_params)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if not self._db_conn.is_replica_connection(conn):
+                    raise
+                # Соединение с репликой оборвалось посреди запроса: повторяем чтение на основном сервере
+                self._db_conn.mark_replica_down(e)
+                replica_conn = conn
+                conn = self._db_conn.get_connection()
+                self._db_conn.return_connection(replica_conn) # Пул закроет оборванное соединение
+                return self._fetch_records(conn, table_name, search_columns, search_values, multiple, custom_query, query_params)
         except psycopg2.Error as e:
+            self._rollback(conn)
             logging.error(f"Ошибка при поиске записей в таблице {table_name}: {e}")
             return [] if multiple else None
         finally:
-            self._db_conn.return_connection(conn)
+            self._release(conn)
+
+    def iter_records(self, table_name: str, search_columns: list = None, search_values: list = None,
+                     custom_query: str = None, query_params: tuple = None, itersize: int = PG_ITERSIZE) -> Iterator[dict]:
+        """
+        Генератор записей (словари столбец -> значение) для больших выборок: читает результат
+        именованным курсором на сервере порциями по itersize строк, не загружая его в память целиком.
+        Соединение занято, пока генератор не исчерпан или не закрыт. Внутри transaction() читает на ее соединении.
+        При ошибке записывает ее в лог и выбрасывает psycopg2.Error, чтобы не отдать выборку не полностью.
+        """
+        if custom_query:
+            query = custom_query
+        elif search_columns and search_values:
+            if len(search_columns) != len(search_values):
+                raise ValueError("Количество столбцов и значений должно совпадать")
+            # Именованный курсор объявляется через DECLARE, поэтому используется текст запроса, а не EXECUTE
+            query = self._statements.get('select', table_name, condition_columns=search_columns).sql
+            query_params = tuple(search_values)
+        else:
+            query = self._statements.get('select', table_name).sql
+
+        conn = self._connect(read_only=True)
+        try:
+            with conn.cursor(name=f"bio_iter_{next(self._cursor_numbers)}") as cursor:
+                cursor.itersize = itersize
+                cursor.execute(query, query_params)
+                column_names = None
+                for record in cursor:
+                    if column_names is None:
+                        column_names = [desc[0] for desc in cursor.description]
+                    yield dict(zip(column_names, record))
+        except psycopg2.Error as e:
+            if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)) and self._db_conn.is_replica_connection(conn):
+                self._db_conn.mark_replica_down(e) # Часть записей уже выдана, поэтому без повтора; следующие чтения - с основного сервера
+            self._rollback(conn)
+            logging.error(f"Ошибка при чтении записей из таблицы {table_name}: {e}")
+            raise
+        finally:
+            self._release(conn)
 
     def update(self, table_name: str, set_columns: list, set_values: list,
                condition_columns: list, condition_values: list):
+        """
+        Обновляет записи, подходящие под условие, одним запросом.
+        Возвращает False, если ни одна запись не найдена или произошла ошибка.
+        """
         if len(set_columns) != len(set_values) or len(condition_columns) != len(condition_values):
             logging.error("Ошибка: Количество столбцов и значений для обновления/условия должно совпадать.")
             return False
@@ -474,52 +1046,122 @@ class DatabaseManager:
         conn = self._connect()
         try:
             with conn.cursor() as cursor:
-                where_conditions = " AND ".join([f"{col} = %s" for col in condition_columns])
-                set_clause = ", ".join([f"{col} = %s" for col in set_columns])
-                query = f"UPDATE \"{table_name}\" SET {set_clause} WHERE {where_conditions}"
-                full_values = set_values + condition_values
-
-                cursor.execute(f"SELECT 1 FROM \"{table_name}\" WHERE {where_conditions}", condition_values)
-                if not cursor.fetchone():
-                    logging.warning(f"Запись не найдена в таблице {table_name}.")
-                    return False
-
-                cursor.execute(query, full_values)
-                conn.commit()
+                statement = self._statements.get('update', table_name, set_columns, condition_columns)
+                self._statements.execute(cursor, statement, list(set_values) + list(condition_values))
+                self._commit(conn)
 
                 if cursor.rowcount == 0:
-                    logging.warning(f"Не удалось обновить запись в таблице {table_name}.")
+                    logging.warning(f"Запись не найдена в таблице {table_name}.")
                     return False
 
                 logging.info(f"Успешно обновлено {cursor.rowcount} строк в таблице {table_name}.")
                 return True
         except psycopg2.Error as e:
+            self._rollback(conn)
             logging.error(f"Ошибка при обновлении данных в таблице {table_name}: {e}")
             return False
         finally:
-            self._db_conn.return_connection(conn)
+            self._release(conn)
+
+    def update_returning(self, table_name: str, set_columns: list, set_values: list,
+                         condition_columns: list, condition_values: list):
+        """
+        Обновляет записи одним запросом UPDATE ... RETURNING * и возвращает список обновленных записей
+        (словари столбец -> значение). Пустой список - ни одна запись не подошла под условие,
+        None - ошибка. Отдельная проверка существования записи не нужна.
+        """
+        if len(set_columns) != len(set_values) or len(condition_columns) != len(condition_values):
+            logging.error("Ошибка: Количество столбцов и значений для обновления/условия должно совпадать.")
+            return None
 
-    def delete(self, table_name: str, unique_column: str, unique_value):
         conn = self._connect()
         try:
             with conn.cursor() as cursor:
-                cursor.execute(f"SELECT 1 FROM \"{table_name}\" WHERE {unique_column} = %s", (unique_value,))
-                if not cursor.fetchone():
-                    logging.warning(f"Запись с уникальным значением {unique_value} не найдена в таблице {table_name}.")
-                    return False
+                statement = self._statements.get('update', table_name, set_columns, condition_columns, returning='*')
+                self._statements.execute(cursor, statement, list(set_values) + list(condition_values))
+                records = self._fetch_all(cursor)
+                self._commit(conn)
+                if not records:
+                    logging.warning(f"Запись не найдена в таблице {table_name}.")
+                else:
+                    logging.info(f"Успешно обновлено {len(records)} строк в таблице {table_name}.")
+                return records
+        except psycopg2.Error as e:
+            self._rollback(conn)
+            logging.error(f"Ошибка при обновлении данных в таблице {table_name}: {e}")
+            return None
+        finally:
+            self._release(conn)
 
-                delete_query = f"DELETE FROM \"{table_name}\" WHERE {unique_column} = %s"
-                cursor.execute(delete_query, (unique_value,))
-                conn.commit()
-                logging.info(f"Запись с уникальным значением {unique_value} успешно удалена из таблицы {table_name}.")
+    def upsert(self, table_name: str, columns: list, values: list, conflict_columns: list, update_columns: list = None):
+        """
+        Вставляет запись или, если запись с такими conflict_columns уже есть, обновляет в ней update_columns
+        (по умолчанию - все столбцы, кроме conflict_columns) одним запросом INSERT ... ON CONFLICT ... RETURNING *.
+        При update_columns=[] существующая запись не меняется: ON CONFLICT DO NOTHING, а если запись уже была -
+        ее SELECT по conflict_columns, без записи и блокировки строки. Возвращает итоговую запись (словарь) или None при ошибке.
+        """
+        if len(columns) != len(values):
+            logging.error("Ошибка: Количество столбцов и значений должно совпадать.")
+            return None
+        if update_columns is None:
+            update_columns = [column for column in columns if column not in conflict_columns]
+
+        conn = self._connect()
+        try:
+            with conn.cursor() as cursor:
+                statement = self._statements.get('upsert', table_name, columns, conflict_columns, returning='*', update_columns=update_columns)
+                self._statements.execute(cursor, statement, values)
+                records = self._fetch_all(cursor)
+                if not records: # Запись уже была и не изменялась: читаем ее, чтение после этого может идти с реплики
+                    statement = self._statements.get('select', table_name, condition_columns=conflict_columns)
+                    self._statements.execute(cursor, statement, [values[columns.index(column)] for column in conflict_columns])
+                    records = self._fetch_all(cursor)
+                    return records[0] if records else None
+                self._commit(conn)
+                logging.info(f"Запись успешно сохранена в таблице {table_name}.")
+                return records[0]
+        except psycopg2.Error as e:
+            self._rollback(conn)
+            logging.error(f"Ошибка при сохранении данных в таблице {table_name}: {e}")
+            return None
+        finally:
+            self._release(conn)
+
+    def update_many(self, table_name: str, set_columns: list, rows_set_values: list,
+                    condition_columns: list, rows_condition_values: list):
+        """
+        Обновляет несколько записей одним пакетом в одной транзакции:
+        для каждой строки rows_set_values[i] применяется условие rows_condition_values[i].
+        При ошибке откатываются все изменения.
+        """
+        if len(rows_set_values) != len(rows_condition_values):
+            logging.error("Ошибка: Количество наборов значений и условий должно совпадать.")
+            return False
+        if not rows_set_values:
+            return True
+
+        conn = self._connect()
+        try:
+            with conn.cursor() as cursor:
+                where_conditions = " AND ".join([f"{col} = %s" for col in condition_columns])
+                set_clause = ", ".join([f"{col} = %s" for col in set_columns])
+                query = f"UPDATE \"{table_name}\" SET {set_clause} WHERE {where_conditions}"
+                params = [list(set_values) + list(condition_values)
+                          for set_values, condition_values in zip(rows_set_values, rows_condition_values)]
+                psycopg2.extras.execute_batch(cursor, query, params)
+                self._commit(conn)
+                logging.info(f"Успешно обновлено {len(params)} строк в таблице {table_name} одной транзакцией.")
                 return True
         except psycopg2.Error as e:
-            logging.error(f"Ошибка при удалении данных из таблицы {table_name}: {e}")
+            self._rollback(conn)
+            logging.error(f"Ошибка при пакетном обновлении данных в таблице {table_name}: {e}")
             return False
         finally:
-            self._db_conn.return_connection(conn)
+            self._release(conn)
+
+    def delete(self, table_name: str, unique_column: str, unique_value):
         """
-        Удаляет запись из таблицы по уникальному столбцу.
+        Удаляет запись из таблицы по уникальному столбцу одним запросом.
 
         Args:
             table_name (str): Имя таблицы, из которой нужно удалить запись.
@@ -529,24 +1171,257 @@ class DatabaseManager:
         Returns:
             bool: True, если запись успешно удалена, иначе False.
         """
+        conn = self._connect()
         try:
-            with self._connect() as db:
-                with db.cursor() as cursor:
-                    query = f"SELECT {unique_column} FROM \"{table_name}\" WHERE {unique_column} = %s"
-                    cursor.execute(query, (unique_value,))
-                    existing_record = cursor.fetchone()
+            with conn.cursor() as cursor:
+                self._statements.execute(cursor, self._statements.get('delete', table_name, condition_columns=[unique_column]), (unique_value,))
+                self._commit(conn)
+                if cursor.rowcount == 0:
+                    logging.warning(f"Запись с уникальным значением {unique_value} не найдена в таблице {table_name}.")
+                    return False
+                logging.info(f"Запись с уникальным значением {unique_value} успешно удалена из таблицы {table_name}.")
+                return True
+        except psycopg2.Error as e:
+            self._rollback(conn)
+            logging.error(f"Ошибка при удалении данных из таблицы {table_name}: {e}")
+            return False
+        finally:
+            self._release(conn)
 
-                    if not existing_record:
-                        logging.warning(f"Запись с уникальным значением {unique_value} не найдена в таблице {table_name}.")
-                        return False
+    def delete_returning(self, table_name: str, condition_columns: list, condition_values: list):
+        """
+        Удаляет записи одним запросом DELETE ... RETURNING * и возвращает список удаленных записей.
+        Пустой список - ни одна запись не подошла под условие, None - ошибка.
+        """
+        if len(condition_columns) != len(condition_values):
+            logging.error("Ошибка: Количество столбцов и значений условия должно совпадать.")
+            return None
 
-                    delete_query = f"DELETE FROM \"{table_name}\" WHERE {unique_column} = %s"
-                    cursor.execute(delete_query, (unique_value,))
+        conn = self._connect()
+        try:
+            with conn.cursor() as cursor:
+                statement = self._statements.get('delete', table_name, condition_columns=condition_columns, returning='*')
+                self._statements.execute(cursor, statement, condition_values)
+                records = self._fetch_all(cursor)
+                self._commit(conn)
+                if not records:
+                    logging.warning(f"Запись не найдена в таблице {table_name}.")
+                else:
+                    logging.info(f"Успешно удалено {len(records)} строк из таблицы {table_name}.")
+                return records
+        except psycopg2.Error as e:
+            self._rollback(conn)
+            logging.error(f"Ошибка при удалении данных из таблицы {table_name}: {e}")
+            return None
+        finally:
+            self._release(conn)
 
-                    logging.info(f"Запись с уникальным значением {unique_value} успешно удалена из таблицы {table_name}.")
-                    return True
+    @staticmethod
+    def _fetch_all(cursor) -> list:
+        """Возвращает строки результата запроса как словари столбец -> значение."""
+        column_names = [desc[0] for desc in cursor.description]
+        return [dict(zip(column_names, record)) for record in cursor.fetchall()]
 
-        except psycopg2.Error as e:
+
+class AsyncDatabaseManager:
+    """
+    Асинхронный вариант DatabaseManager (Singleton) на psycopg 3 с пулом AsyncConnectionPool.
+    Запросы не блокируют цикл событий, поэтому обработчики разных пользователей и фоновые задачи
+    выполняют ввод-вывод одновременно. Методы повторяют интерфейс и возвращаемые значения DatabaseManager.
+    Создание БД и таблиц остается за синхронным DatabaseManager.initialize().
+    Если задан PG_REPLICA_DSN, чтение (find_records) идет на реплику по тем же правилам, что и в DatabaseManager.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(AsyncDatabaseManager, cls).__new__(cls)
+            cls._instance._pool = None
+            cls._instance._replica_pool = None
+            cls._instance._replica_retry_at = 0.0 # До этого момента (time.monotonic) реплика считается недоступной
+        return cls._instance
+
+    def __init__(self):
+        # Инициализация происходит в __new__ только один раз
+        pass
+
+    async def initialize(self):
+        """Открывает пул соединений. Вызывается из работающего цикла событий."""
+        if self._pool is not None:
+            return
+        conninfo = make_conninfo(host=PG_HOST, dbname=PG_DBNAME, user=PG_USER, password=PG_PASSWORD,
+                                 port=PG_PORT, client_encoding='utf8')
+        self._pool = AsyncConnectionPool(conninfo, min_size=PG_ASYNC_POOL_MIN_SIZE, max_size=PG_ASYNC_POOL_MAX_SIZE,
+                                         kwargs={'row_factory': dict_row}, open=False)
+        await self._pool.open()
+        logging.info("Асинхронный пул соединений успешно создан.")
+        if PG_REPLICA_DSN:
+            credentials = {} if 'password' in PG_REPLICA_DSN else {'password': PG_PASSWORD}
+            replica_conninfo = make_conninfo(PG_REPLICA_DSN, client_encoding='utf8', options=REPLICA_SESSION_OPTIONS,
+                                             connect_timeout=PG_REPLICA_CONNECT_TIMEOUT, **credentials)
+            # Пул реплики не проверяет соединение при открытии: недоступность выяснится при первом чтении,
+            # поэтому ожидание соединения ограничено PG_POOL_ACQUIRE_TIMEOUT, а не 30 с по умолчанию
+            self._replica_pool = AsyncConnectionPool(replica_conninfo, min_size=PG_ASYNC_POOL_MIN_SIZE, max_size=PG_ASYNC_POOL_MAX_SIZE,
+                                                     kwargs={'row_factory': dict_row}, timeout=PG_POOL_ACQUIRE_TIMEOUT, open=False)
+            await self._replica_pool.open()
+            logging.info("Асинхронный пул соединений с репликой успешно создан.")
+
+    async def close(self):
+        """Закрывает все соединения пула."""
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+            logging.info("Асинхронный пул соединений закрыт.")
+        if self._replica_pool is not None:
+            await self._replica_pool.close()
+            self._replica_pool = None
+            logging.info("Асинхронный пул соединений с репликой закрыт.")
+
+    def _connect(self):
+        """Возвращает контекстный менеджер соединения из пула (транзакция фиксируется при выходе без ошибки)."""
+        if self._pool is None:
+            raise RuntimeError("AsyncDatabaseManager не инициализирован: вызовите await initialize().")
+        return self._pool.connection()
+
+    @staticmethod
+    async def _fetch(pool: AsyncConnectionPool, query: str, params, multiple: bool):
+        async with pool.connection() as conn:
+            cursor = await conn.execute(query, params)
+            if multiple:
+                return await cursor.fetchall()
+            return await cursor.fetchone()
+
+    async def _read(self, query: str, params=None, multiple: bool = False):
+        """
+        Выполняет чтение на реплике, если она задана, доступна и в текущем обработчике еще не было записи.
+        Если реплика не выдала соединение за PG_POOL_ACQUIRE_TIMEOUT (PoolTimeout) или соединение с ней оборвалось,
+        чтение повторяется на основном сервере, а реплика PG_REPLICA_RETRY_INTERVAL секунд не используется.
+        """
+        if self._pool is None:
+            raise RuntimeError("AsyncDatabaseManager не инициализирован: вызовите await initialize().")
+        if self._replica_pool is not None and not _read_from_primary.get() and time.monotonic() >= self._replica_retry_at:
+            try:
+                return await self._fetch(self._replica_pool, query, params, multiple)
+            except psycopg.OperationalError as e: # В том числе PoolTimeout
+                self._replica_retry_at = time.monotonic() + PG_REPLICA_RETRY_INTERVAL
+                logging.warning(f"Реплика недоступна, чтение с основного сервера в течение {PG_REPLICA_RETRY_INTERVAL:.0f} с: {e}")
+        return await self._fetch(self._pool, query, params, multiple)
+
+    async def insert(self, table_name: str, columns: list, values: list, returning: str = None):
+        """
+        Вставляет запись. Если указан returning, возвращает значение этого столбца вставленной записи
+        (например, сгенерированный id), иначе True. При ошибке возвращает None.
+        """
+        if len(columns) != len(values):
+            logging.error("Ошибка: Количество столбцов и значений должно совпадать.")
+            return None
+
+        filtered_columns = [col for col, val in zip(columns, values) if val is not None]
+        filtered_values = [val for val in values if val is not None]
+
+        try:
+            async with self._connect() as conn:
+                placeholders = ", ".join("%s" for _ in filtered_columns)
+                insert_query = f"INSERT INTO \"{table_name}\" ({', '.join(filtered_columns)}) VALUES ({placeholders})"
+                if returning:
+                    insert_query += f" RETURNING {returning}"
+                cursor = await conn.execute(insert_query, filtered_values)
+                record = await cursor.fetchone() if returning else None
+            _read_from_primary.set(True) # Дальнейшее чтение в этом обработчике должно видеть запись
+            logging.info(f"Запись успешно добавлена в таблицу {table_name}.")
+            return record[returning] if returning else True
+        except psycopg.Error as e:
+            logging.error(f"Ошибка при вставке данных в таблицу {table_name}: {e}")
+            return None
+
+    async def upsert(self, table_name: str, columns: list, values: list, conflict_columns: list, update_columns: list = None):
+        """
+        Вставляет запись или, если запись с такими conflict_columns уже есть, обновляет в ней update_columns
+        (по умолчанию - все столбцы, кроме conflict_columns). Возвращает итоговую запись (словарь) или None при ошибке.
+        При update_columns=[] существующая запись не меняется: INSERT ... ON CONFLICT DO NOTHING RETURNING *,
+        а если запись уже была - ее SELECT по conflict_columns на том же соединении. Одновременные вызовы
+        не приводят к ошибке уникальности: вставит запись только один из них.
+        """
+        if len(columns) != len(values):
+            logging.error("Ошибка: Количество столбцов и значений должно совпадать.")
+            return None
+        if update_columns is None:
+            update_columns = [column for column in columns if column not in conflict_columns]
+
+        if update_columns:
+            conflict_action = "DO UPDATE SET " + ", ".join([f"{column} = EXCLUDED.{column}" for column in update_columns])
+        else:
+            conflict_action = "DO NOTHING"
+        placeholders = ", ".join("%s" for _ in columns)
+        upsert_query = (f"INSERT INTO \"{table_name}\" ({', '.join(columns)}) VALUES ({placeholders}) "
+                        f"ON CONFLICT ({', '.join(conflict_columns)}) {conflict_action} RETURNING *")
+        try:
+            async with self._connect() as conn:
+                cursor = await conn.execute(upsert_query, list(values))
+                record = await cursor.fetchone()
+                written = record is not None
+                if not written: # Запись уже была и не изменялась
+                    where_conditions = " AND ".join([f"{column} = %s" for column in conflict_columns])
+                    cursor = await conn.execute(f"SELECT * FROM \"{table_name}\" WHERE {where_conditions}",
+                                                [values[columns.index(column)] for column in conflict_columns])
+                    record = await cursor.fetchone()
+            if written:
+                _read_from_primary.set(True) # Дальнейшее чтение в этом обработчике должно видеть запись
+                logging.info(f"Запись успешно сохранена в таблице {table_name}.")
+            return record
+        except psycopg.Error as e:
+            logging.error(f"Ошибка при сохранении данных в таблице {table_name}: {e}")
+            return None
+
+    async def find_records(self, table_name: str, search_columns: list = None, search_values: list = None, multiple: bool = False, custom_query: str = None, query_params: tuple = None):
+        if custom_query:
+            query, params = custom_query, query_params
+        elif search_columns and search_values:
+            if len(search_columns) != len(search_values):
+                raise ValueError("Количество столбцов и значений должно совпадать")
+            where_conditions = " AND ".join([f"{column} = %s" for column in search_columns])
+            query, params = f"SELECT * FROM \"{table_name}\" WHERE {where_conditions}", tuple(search_values)
+        else:
+            query, params = f"SELECT * FROM \"{table_name}\"", None
+        try:
+            return await self._read(query, params, multiple)
+        except psycopg.Error as e:
+            logging.error(f"Ошибка при поиске записей в таблице {table_name}: {e}")
+            return [] if multiple else None
+
+    async def update(self, table_name: str, set_columns: list, set_values: list,
+                     condition_columns: list, condition_values: list):
+        if len(set_columns) != len(set_values) or len(condition_columns) != len(condition_values):
+            logging.error("Ошибка: Количество столбцов и значений для обновления/условия должно совпадать.")
+            return False
+
+        try:
+            async with self._connect() as conn:
+                where_conditions = " AND ".join([f"{col} = %s" for col in condition_columns])
+                set_clause = ", ".join([f"{col} = %s" for col in set_columns])
+                cursor = await conn.execute(f"UPDATE \"{table_name}\" SET {set_clause} WHERE {where_conditions}",
+                                            list(set_values) + list(condition_values))
+                if cursor.rowcount == 0:
+                    logging.warning(f"Запись не найдена в таблице {table_name}.")
+                    return False
+            _read_from_primary.set(True) # Дальнейшее чтение в этом обработчике должно видеть запись
+            logging.info(f"Успешно обновлено {cursor.rowcount} строк в таблице {table_name}.")
+            return True
+        except psycopg.Error as e:
+            logging.error(f"Ошибка при обновлении данных в таблице {table_name}: {e}")
+            return False
+
+    async def delete(self, table_name: str, unique_column: str, unique_value):
+        try:
+            async with self._connect() as conn:
+                cursor = await conn.execute(f"DELETE FROM \"{table_name}\" WHERE {unique_column} = %s", (unique_value,))
+                if cursor.rowcount == 0:
+                    logging.warning(f"Запись с уникальным значением {unique_value} не найдена в таблице {table_name}.")
+                    return False
+            _read_from_primary.set(True) # Дальнейшее чтение в этом обработчике должно видеть запись
+            logging.info(f"Запись с уникальным значением {unique_value} успешно удалена из таблицы {table_name}.")
+            return True
+        except psycopg.Error as e:
             logging.error(f"Ошибка при удалении данных из таблицы {table_name}: {e}")
             return False
 
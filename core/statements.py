@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+import psycopg2
+
+# SQLSTATE ошибок, после которых подготовленный запрос нужно подготовить заново:
+# 0A000 - "cached plan must not change result type" (таблица изменилась), 26000 - запрос не найден на сервере
+STALE_STATEMENT_CODES = ('0A000', '26000')
+
+
+class Statement:
+    """Текст SQL-запроса одной формы и имя, под которым он готовится на сервере (PREPARE)."""
+
+    def __init__(self, name: str, sql: str):
+        self.name: str = name
+        self.sql: str = sql # Текст с плейсхолдерами %s (для выполнения без подготовки)
+        # Текст для PREPARE: плейсхолдеры $1..$n вместо %s
+        parts = sql.split("%s")
+        param_count = len(parts) - 1
+        self.param_count: int = param_count
+        self.prepare_sql: str = parts[0] + "".join(f"${index}{part}" for index, part in enumerate(parts[1:], start=1))
+        self.execute_sql: str = f"EXECUTE {name}" + (f" ({', '.join(['%s'] * param_count)})" if param_count else "")
+
+
+class StatementCache:
+    """
+    Кэш SQL-запросов DatabaseManager по ключу (операция, таблица, столбцы, столбцы условия, RETURNING).
+    Текст каждого запроса строится один раз; на каждом соединении запрос один раз готовится
+    на сервере (PREPARE), дальше выполняется через EXECUTE без повторного разбора и планирования.
+    Подготовленные на соединении запросы отслеживаются в PooledConnection.prepared.
+    """
+
+    def __init__(self, prepare: bool = True):
+        self.prepare: bool = prepare
+        self._statements: Dict[Tuple, Statement] = {}
+        self._lock = threading.Lock()
+        self.hits: int = 0 # Текст запроса взят из кэша
+        self.misses: int = 0 # Текст запроса построен впервые
+        self.prepares: int = 0 # Выполнено PREPARE (по одному на запрос и соединение)
+        self.prepared_executions: int = 0 # Выполнено EXECUTE подготовленных запросов
+        self.prepare_time_total: float = 0.0 # Суммарное время PREPARE (разбор и анализ запроса сервером), секунд
+
+    def get(self, operation: str, table_name: str, columns: Sequence[str] = (), condition_columns: Sequence[str] = (),
+            returning: str = None, update_columns: Sequence[str] = ()) -> Statement:
+        """
+        Возвращает запрос нужной формы, строя его текст при первом обращении.
+        Для операции 'upsert' condition_columns - столбцы ON CONFLICT, update_columns - обновляемые при конфликте столбцы.
+        """
+        key = (operation, table_name, tuple(columns), tuple(condition_columns), returning, tuple(update_columns))
+        with self._lock:
+            statement = self._statements.get(key)
+            if statement is not None:
+                self.hits += 1
+                return statement
+            self.misses += 1
+            statement = Statement(f"bio_stmt_{len(self._statements) + 1}", self._build(*key))
+            self._statements[key] = statement
+            return statement
+
+    @staticmethod
+    def _build(operation: str, table_name: str, columns: Tuple[str, ...], condition_columns: Tuple[str, ...],
+               returning: Optional[str], update_columns: Tuple[str, ...]) -> str:
+        """Строит текст запроса."""
+        where_conditions = " AND ".join([f"{column} = %s" for column in condition_columns])
+        where_clause = f" WHERE {where_conditions}" if condition_columns else ""
+        returning_clause = f" RETURNING {returning}" if returning else ""
+        if operation == 'select':
+            return f"SELECT * FROM \"{table_name}\"{where_clause}"
+        if operation == 'insert':
+            return f"INSERT INTO \"{table_name}\" ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}){returning_clause}"
+        if operation == 'upsert':
+            # Без обновляемых столбцов существующая строка не трогается (и RETURNING ее не возвращает)
+            if update_columns:
+                conflict_action = "DO UPDATE SET " + ", ".join([f"{column} = EXCLUDED.{column}" for column in update_columns])
+            else:
+                conflict_action = "DO NOTHING"
+            return (f"INSERT INTO \"{table_name}\" ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                    f"ON CONFLICT ({', '.join(condition_columns)}) {conflict_action}{returning_clause}")
+        if operation == 'update':
+            set_clause = ", ".join([f"{column} = %s" for column in columns])
+            return f"UPDATE \"{table_name}\" SET {set_clause}{where_clause}{returning_clause}"
+        if operation == 'delete':
+            return f"DELETE FROM \"{table_name}\"{where_clause}{returning_clause}"
+        raise ValueError(f"Неизвестная операция '{operation}'.")
+
+    def execute(self, cursor, statement: Statement, params: Sequence = ()):
+        """
+        Выполняет запрос на курсоре. Если соединение поддерживает учет подготовленных запросов
+        (PooledConnection), запрос готовится на нем при первом выполнении и дальше выполняется через EXECUTE.
+        """
+        conn = cursor.connection
+        prepared = getattr(conn, 'prepared', None)
+        if not self.prepare or prepared is None:
+            cursor.execute(statement.sql, params)
+            return
+
+        if statement.name not in prepared:
+            started = time.perf_counter()
+            cursor.execute(f"PREPARE {statement.name} AS {statement.prepare_sql}")
+            elapsed = time.perf_counter() - started
+            prepared.add(statement.name)
+            with self._lock:
+                self.prepares += 1
+                self.prepare_time_total += elapsed
+        try:
+            cursor.execute(statement.execute_sql, params)
+        except psycopg2.Error as e:
+            if e.pgcode in STALE_STATEMENT_CODES:
+                # Подготовленный запрос устарел (например, после изменения таблицы): удаляем его
+                # после отката транзакции и готовим заново при следующем выполнении
+                prepared.discard(statement.name)
+                conn.deallocate_pending.add(statement.name)
+            raise
+        with self._lock:
+            self.prepared_executions += 1
+
+    def stats(self) -> Dict[str, float]:
+        """Возвращает снимок счетчиков кэша."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'statements': len(self._statements),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'prepares': self.prepares,
+                'prepared_executions': self.prepared_executions,
+                'prepare_time_total_ms': self.prepare_time_total * 1000,
+                'prepare_time_avg_ms': self.prepare_time_total / self.prepares * 1000 if self.prepares else 0.0,
+            }
+
+
+def deallocate_pending(conn) -> bool:
+    """
+    Удаляет на соединении устаревшие подготовленные запросы. Вызывается пулом при возврате
+    соединения, когда транзакция уже откачена. Возвращает False, если соединение лучше закрыть.
+    """
+    names = getattr(conn, 'deallocate_pending', None)
+    if not names:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            for name in names:
+                cursor.execute(f"DEALLOCATE {name}")
+        conn.commit()
+        names.clear()
+        return True
+    except psycopg2.Error as e:
+        logging.warning(f"Не удалось удалить подготовленные запросы {sorted(names)}: {e}")
+        return False
@@ -1,7 +1,24 @@
-from core.sql import PostgreSQLStorage, DatabaseManager 
+from core.sql import AsyncPostgreSQLStorage, DatabaseManager, AsyncDatabaseManager
+from core.fsm_storage import FSMStorage, MemoryFSMStorage, SQLiteFSMStorage, WriteBackStorage
+from core.config import FSM_CACHE_MAX_SIZE, FSM_STORAGE_BACKEND
 from aiogram import Bot
 
+
+def create_storage(backend: str = FSM_STORAGE_BACKEND) -> FSMStorage:
+    """Создает хранилище состояний FSM по FSM_STORAGE_BACKEND, при включенном кэше - за WriteBackStorage."""
+    if backend == 'memory':
+        return MemoryFSMStorage() # Кэш перед памятью не нужен
+    if backend == 'postgres':
+        storage = AsyncPostgreSQLStorage()
+    elif backend == 'sqlite':
+        storage = SQLiteFSMStorage()
+    else:
+        raise ValueError(f"Неизвестное хранилище состояний FSM '{backend}', ожидается 'postgres', 'sqlite' или 'memory'.")
+    return WriteBackStorage(storage) if FSM_CACHE_MAX_SIZE else storage
+
+
 db_manager = DatabaseManager()
-storage = PostgreSQLStorage()
+async_db_manager = AsyncDatabaseManager()
+storage = create_storage()
 
-bot: Bot = None
\ No newline at end of file
+bot: Bot = None